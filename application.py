@@ -1,439 +1,21 @@
 import utils
-from utils import Profession
-import picture
-import profession_parsing
+import generation
+import bundle
+import tracing
+import catalog
+import output_cache
+import jobs
 
-import docx
-import math
 import streamlit as st
 import datetime
-from docxtpl import DocxTemplate
-from io import BytesIO
-import zipfile
-import copy
-from lxml import etree
-
-from docx import Document
-from docx.oxml import OxmlElement
-from docx.shared import Inches, Pt
-from docx.oxml import register_element_cls
-from docx.enum.table import WD_TABLE_ALIGNMENT
-from dataclasses import dataclass
-from dateutil.relativedelta import relativedelta
-
-NAME_KEY = "student_name"
-CERTIFICATE_KEY = "certificate_number"
-MACHINE_CATEGORY = "machine_category"
-ROLE = 'student_role'
-
-TRACTOR_PROFESSION_WORDING = "19203 «Тракторист»"
-
-CERT_HEIGHT_INCHES = Inches(3.65)
-CERT_WIDTH_INCHES = Inches(5.6)
-
-TRACTOR_CERT_HEIGHT = Inches(5.63)
-TRACTOR_CERT_WIDTH = Inches(8.04)
-
-register_element_cls("wp:anchor", picture.CT_Anchor)
-
-
-def make_student_copy(replacement_dict, student):
-    local_dict = replacement_dict.copy()
-    local_dict[NAME_KEY] = student.name
-    local_dict[CERTIFICATE_KEY] = student.cert_number
-    local_dict[ROLE] = student.role
-    local_dict[MACHINE_CATEGORY] = student.machine_category
-    return local_dict
-
-
-def create_confirmation_page(replacement_dict, students, picture_path):
-    if not students:
-        return Document()
-
-    merged_doc = Document()
-    merged_doc = utils.fit_more_rows(merged_doc)
-    utils.set_default_font(merged_doc)
-
-    merged_table = merged_doc.add_table(rows=len(students), cols=2)
-    merged_tractor_table = merged_doc.add_table(rows=len(students), cols=2)
-
-    curr_index = 0
-    for student_index, student in enumerate(students):
-        local_dict = make_student_copy(replacement_dict, student)
-
-        doc = DocxTemplate("templates/milana_conf_page.docx")
-        doc.render(local_dict)
-
-        add_student_content_to_merged_table(
-            merged_table, doc.tables[0], student_index, curr_index, picture_path, picture_height=Inches(5.54), picture_width=Inches(7.85)
-        )
-        add_student_content_to_merged_table(
-            merged_tractor_table, doc.tables[1], student_index, curr_index, picture_path, picture_height=Inches(5.54), picture_width=Inches(7.85)
-        ) 
-        curr_index += 1
-
-    return merged_doc
-
-def copy_text_and_formatting(source_cell, target_cell):
-    utils.copy_cell_properties(source_cell, target_cell)
-
-    for p_i, paragraph in enumerate(source_cell.paragraphs):
-        if paragraph.text.strip() == "": 
-            continue
-        if p_i == 0: 
-            new_paragraph = target_cell.paragraphs[0]  # Use the existing empty paragraph
-        else:
-            new_paragraph = target_cell.add_paragraph()
-        new_paragraph.paragraph_format.space_before = Pt(0)
-        new_paragraph.paragraph_format.space_after = Pt(0)
-        new_paragraph.alignment = paragraph.alignment
-        new_paragraph.paragraph_format.left_indent = paragraph.paragraph_format.left_indent
-
-        for run in paragraph.runs:
-            new_run = new_paragraph.add_run(run.text)
-            if "prof_educ_logo" in run.text:
-                new_run.text = new_run.text.replace("prof_educ_logo", "") 
-                new_run.add_picture('pictures/professional-education-logo.png')
-                continue
-            utils.preserve_formatting(new_run, run) 
-
-def maybe_add_nested_table(cell, target_cell): 
-    if len(cell.tables) > 0: 
-        # for now just copy the first one
-        # Set "Spacing After" for the last paragraph to 0
-        last_paragraph = target_cell.paragraphs[-1]
-        last_paragraph.paragraph_format.space_after = Pt(0) 
-        
-        nested_table = cell.tables[0] 
-        new_table = target_cell.add_table(rows=len(nested_table.rows), cols=len(nested_table.columns))
-        new_table.alignment = WD_TABLE_ALIGNMENT.CENTER 
-        for r_i, rw in enumerate(nested_table.rows):
-            for c_i, cll in enumerate(rw.cells):
-                copy_text_and_formatting(cll, new_table.cell(r_i, c_i))
-
-def add_table(merged_table, curr_row, curr_col, table): 
-    for row_index, row in enumerate(table.rows):
-        merged_table.rows[curr_row].height = Inches(2.76)
-        for col_index, cell in enumerate(row.cells):
-            target_cell = merged_table.cell(curr_row, curr_col)
-            target_cell.width = Inches(3.84)
-            # add tables too! 
-            copy_text_and_formatting(cell, target_cell)
-            maybe_add_nested_table(cell, target_cell)
-
-
-def create_certificate_for_labour_protection(replacement_dict, students):
-    if not students:
-        return Document()
-
-    merged_doc = Document()
-    merged_doc = utils.fit_more_rows(merged_doc)
-    utils.set_default_font(merged_doc)
-
-    num_rows = math.ceil(len(students) / 2)
-
-    merged_table_front = merged_doc.add_table(rows=num_rows, cols=2)
-    merged_table_front.style = "TableGrid"
-    merged_doc.add_page_break()
-    merged_table_back = merged_doc.add_table(rows=num_rows, cols=2)
-
-    curr_row = 0
-    curr_col = 0 
-    for student_index, student in enumerate(students):
-        local_dict = make_student_copy(replacement_dict, student)
-
-        doc = DocxTemplate("templates/labour_protection.docx")
-        doc.render(local_dict)
-
-        # Copy content from the template document to the target cell
-
-        add_table(merged_table_front, curr_row, curr_col, doc.tables[0])
-        add_table(merged_table_back, curr_row, curr_col, doc.tables[1])
-
-        # Update cell indices for the next student
-        curr_col += 1 
-        if curr_col == 2:  
-            curr_col = 0
-            curr_row += 1 
-    return merged_doc
-
-def create_certificate(replacement_dict, students):
-    if not students:
-        return Document()
-
-    all_paragraphs = []
-    for student in students[1:]:
-        local_dict = make_student_copy(replacement_dict, student)
-
-        doc = DocxTemplate("templates/свидетельство.docx")
-        doc.render(local_dict)
-
-        paragraphs = doc.tables[0].cell(0, 0).paragraphs
-        all_paragraphs.append(paragraphs)
-
-    # Create final document using the first student's data as a base
-    final_doc = DocxTemplate("templates/свидетельство.docx")
-    local_dict = replacement_dict.copy()
-    local_dict[NAME_KEY] = students[0].name
-    local_dict[CERTIFICATE_KEY] = students[0].cert_number
-    final_doc.render(local_dict)
-
-    # Set default font style
-    utils.set_default_font(final_doc, bold=True)
-
-    # Get the table and add rows for each additional student
-    table = final_doc.tables[0]
-    for paragraphs in all_paragraphs:
-        row = table.add_row()
-        # this ensure that the rows are not split between pages https://github.com/python-openxml/python-docx/issues/245
-        trPr = row._tr.get_or_add_trPr()
-        trPr.append(OxmlElement("w:cantSplit"))
-
-        target_cell = row.cells[0]
-        source_cell = table.cell(0, 0)  # Use the first cell as a template
-
-        # Copy cell properties from the template cell
-        utils.copy_cell_properties(source_cell, target_cell)
-
-        # Add paragraphs and runs to the new cell, copying formatting
-        for p_i, paragraph in enumerate(paragraphs):
-            if p_i == 0: 
-                new_paragraph = target_cell.paragraphs[0]
-            else: 
-                new_paragraph = target_cell.add_paragraph()
-            source_paragraph = source_cell.paragraphs[p_i]
-            if p_i == 0:
-                picture.add_float_picture(
-                    new_paragraph,
-                    "pictures/basic-cert-background.png",
-                    width=CERT_WIDTH_INCHES,
-                    height=CERT_HEIGHT_INCHES,
-                )
-
-            new_paragraph.alignment = source_paragraph.alignment
-            new_paragraph.paragraph_format.left_indent = (
-                source_paragraph.paragraph_format.left_indent
-            )
-            for target_run, source_run in zip(paragraph.runs, source_paragraph.runs):
-                new_run = new_paragraph.add_run(target_run.text)
-                utils.preserve_formatting(new_run, source_run)
-    return final_doc
-
-
-def add_student_content_to_merged_table(
-    merged_table, tbl, student_index, curr_index, picture_path=None, picture_height=None, picture_width=None
-):
-    if student_index == 0:
-        for element_name in ["w:tblGrid", "w:tblPr"]:
-            utils.copy_table_element(tbl._tbl, merged_table._tbl, element_name)
-
-    for row_index in range(
-        len(tbl._tbl.findall("./w:tr", namespaces=tbl._tbl.nsmap))
-    ):  # Iterate using XML
-        target_row = merged_table.rows[curr_index]._element
-        source_row_element = tbl.rows[row_index]._element
-
-        utils.addTrPr(source_row_element, target_row)
-
-        # --- Copy cells from source row to target row ---
-        source_row_cells = source_row_element.findall(
-            "./w:tc", namespaces=source_row_element.nsmap
-        )
-        for col_index, source_cell in enumerate(source_row_cells):
-            target_cell = target_row[col_index]
-            for child in source_cell:
-                utils.update_nested_table_styles(source_cell, source_row_element)
-                target_cell.append(copy.deepcopy(child))
-        
-        for cell in merged_table.rows[curr_index].cells:
-            for paragraph in cell.paragraphs:
-                for run in paragraph.runs:
-                    if "prof_educ_logo" in run.text:
-                        run.text = run.text.replace("prof_educ_logo", "") 
-                        run.add_picture('pictures/professional-education-logo.png')
-                    if "bigger_educ_logo" in run.text:
-                        run.text = run.text.replace("bigger_educ_logo", "") 
-                        run.add_picture('pictures/professional-education-logo.png', width=Inches(1.53), height=Inches(1.09))
-                    
-
-        first_cell = merged_table.rows[curr_index].cells[0]
-        curr_index += 1
-        p = first_cell.add_paragraph()
-        if picture_path: 
-            picture.add_float_picture(
-                p,
-                picture_path,
-                height=picture_height,
-                width=picture_width,
-                pos_x=Pt(0),
-                pos_y=Pt(0),
-            )
-
-
-def create_tractor_certificate(replacement_dict, students, picture_front, picture_back):
-    if not students:
-        return Document()
-
-    merged_doc = Document()
-    merged_doc = utils.fit_more_rows(merged_doc)
-    utils.set_default_font(merged_doc)
-
-    merged_table = merged_doc.add_table(rows=len(students), cols=2)
-    merged_doc.add_page_break()
-    merged_tractor_table = merged_doc.add_table(rows=len(students), cols=2)
-
-    curr_index = 0
-    for student_index, student in enumerate(students):
-        local_dict = make_student_copy(replacement_dict, student)
-
-        doc = DocxTemplate("templates/certificate_tractor.docx")
-        doc.render(local_dict)
-
-        add_student_content_to_merged_table(
-            merged_table, doc.tables[0], student_index, curr_index, picture_front, picture_height=TRACTOR_CERT_HEIGHT, picture_width=TRACTOR_CERT_WIDTH
-        )
-
-        add_student_content_to_merged_table(
-            merged_tractor_table, doc.tables[1], student_index, curr_index, picture_back, picture_height=TRACTOR_CERT_HEIGHT, picture_width=TRACTOR_CERT_WIDTH
-        )
-        curr_index += 1
-
-    return merged_doc
-
-
-def create_height_certificate(replacement_dict, students):
-    if not students:
-        return Document()
-
-    merged_doc = Document()
-    merged_doc = utils.fit_more_rows(merged_doc)
-    utils.set_default_font(merged_doc)
-
-    merged_table = merged_doc.add_table(rows=len(students), cols=3)
-
-    curr_index = 0
-    for student_index, student in enumerate(students):
-        local_dict = make_student_copy(replacement_dict, student)
-
-        doc = DocxTemplate("templates/height_certificate.docx")
-        doc.render(local_dict)
-
-        add_student_content_to_merged_table(
-            merged_table,
-            doc.tables[0],
-            student_index,
-            curr_index
-        )
-        curr_index += 1
-
-    return merged_doc
-
-
-def create_tractor_certs(dict, students):
-    blue = create_tractor_certificate(
-        dict, students, "pictures/tractor-background-blue.png", "pictures/tractor-background-blue-with-tractor.png"
-    )
-    dict_with_profession_replaced = dict.copy()
-    dict_with_profession_replaced["student_profession"] = TRACTOR_PROFESSION_WORDING
-    green = create_tractor_certificate(
-        dict_with_profession_replaced,
-        students,
-        "pictures/tractor-background-green.png",
-        "pictures/tractor-background-green-with-tractor.png",
-    )
-    return (blue, green)
-
-
-def create_beginning_document(beginning_dict, students):
-    """Creates a Word document with the provided information."""
-
-    doc = DocxTemplate("templates/Приказ о начале.docx")
-    doc.render(beginning_dict)
-    utils.set_default_font(doc)
-    table = doc.tables[0]
-
-    for index, student in enumerate(students):
-        # Create a new row
-        new_row = table.add_row()
-
-        # Populate cells in the new row
-        new_row.cells[0].text = str(index + 1)
-        new_row.cells[1].text = student.name
-        new_row.cells[2].text = beginning_dict["student_company"]
-
-        # Add more cells for other data (profession, date, etc.) if needed
-    return doc
-
-
-def create_end_doc(replacement_dict, students):
-    """Creates a Word document with the provided information."""
-
-    doc = DocxTemplate("templates/Приказ о выпуске.docx")
-    doc.render(replacement_dict)
-    utils.set_default_font(doc)
-    table = doc.tables[0]
-
-    for index, student in enumerate(students):
-        # Create a new row
-        new_row = table.add_row()
-
-        # Populate cells in the new row
-        new_row.cells[0].text = str(index + 1)
-        new_row.cells[1].text = student.name
-        new_row.cells[2].text = replacement_dict["student_company"]
-        new_row.cells[3].text = student.cert_number
-
-    return doc
-
-
-def create_protocol_doc(replacement_dict, students):
-    """Creates a Word document with the provided information."""
-
-    doc = DocxTemplate("templates/Протокол.docx")
-    doc.render(replacement_dict)
-    utils.set_default_font(doc)
-    table = doc.tables[0]
-
-    for index, student in enumerate(students):
-        # Create a new row
-        new_row = table.add_row()
-
-        # Populate cells in the new row
-        new_row.cells[0].text = str(index + 1)
-        new_row.cells[1].text = student.name
-        new_row.cells[2].text = replacement_dict["student_company"]
-        new_row.cells[3].text = student.cert_number
-
-    return doc
-
-
-def create_labour_protection_protocol(replacement_dict, students):
-    """Creates a Word document with the provided information."""
-
-    doc = DocxTemplate("templates/protocol_milana.docx")
-    doc.render(replacement_dict)
-    utils.set_default_font(doc)
-    table = doc.tables[0]
-
-    for index, student in enumerate(students):
-        # Create a new row
-        new_row = table.add_row()
-
-        # Populate cells in the new row
-        new_row.cells[0].text = str(index + 1)
-        new_row.cells[1].text = student.name
-        new_row.cells[2].text = student.role
-        new_row.cells[3].text = replacement_dict["student_company"]
-        new_row.cells[4].text = ''
-        new_row.cells[5].text = replacement_dict['end_date']
-
-    return doc
+import uuid
+import pandas as pd
 
 
 st.title("Профессиональное обучение")
 
 # Input 1: Text Input
-available_professions = utils.load_from_pickle("data/professions.pickle")
+available_professions = catalog.load_professions()
 student_profession = utils.choose_profession(available_professions)
 
 today = datetime.date.today()
@@ -448,64 +30,85 @@ end_number = st.number_input(
 )
 
 # this should be replaced by a scroll through
-teacher_name = utils.choose_teacher(utils.load_from_pickle("data/teachers.pickle"))
+teacher_name = utils.choose_teacher(catalog.load_teachers())
 
 company = st.text_input(
     "Предприятие", "заявление", placeholder="Наименование предприятия или 'заявление'"
 )
-student_names = st.text_area("Введите имена студентов, по одному на строку").split("\n")
-student_data = []
-for line in student_names:
-    if line:
-        items = [item for item in line.split("\t") if item]
-        certificate_number, _, _, name, *category = (
-            items  # Split each line by tab
-        )
-        (machine_category, role) = utils.parse_machine_cat_or_role(student_profession, category[0] if category else "")
-        cert_number = utils.get_cert_number(certificate_number)
-        student_data.append(
-            utils.Student(name=name, cert_number=cert_number, machine_category=machine_category, role=role)
-        )
-num_students = len(student_data)
-
-formatted_beginning_date = utils.format_date(beginning_date)
-formatted_end_date = utils.format_date(end_date)
-expiration_date = utils.format_date((end_date + relativedelta(years=3)))
-replacement_dict = {
-    "beginning_date": formatted_beginning_date,
-    "beginning_number": beginning_number,
-    "end_date": formatted_end_date,
-    "end_number": end_number,
-    "student_company": company,
-    "teacher_name": teacher_name,
-    "num_students": num_students,
-    "class": "4",
-    "year": beginning_date.year,
-    "expiration_date": expiration_date,
-}
-if student_profession: 
-    if student_profession.hours_str:
-        replacement_dict['hours'] = student_profession.hours_str
-    if student_profession.formatted_profession: 
-        replacement_dict['student_profession'] = student_profession.formatted_profession
-
-beginning_doc = create_beginning_document(replacement_dict, student_data)
-end_doc = create_end_doc(replacement_dict, student_data)
-protocol = create_protocol_doc(replacement_dict, student_data)
-certificate_docs = create_certificate(replacement_dict, student_data)
-(blue_tractor_cert, green_tractor_cert) = create_tractor_certs(
-    replacement_dict, student_data
+student_table = utils.choose_students(student_profession)
+num_students = len(student_table)
+
+replacement_dict = generation.build_replacement_dict(
+    student_profession,
+    teacher_name,
+    company,
+    beginning_date,
+    end_date,
+    beginning_number,
+    end_number,
+    num_students,
 )
-milana_conf_page = create_confirmation_page(replacement_dict, student_data, 'pictures/tractor-background-green.png')
-milana_cert = create_certificate_for_labour_protection(replacement_dict, student_data)
-labour_protection_protocol = create_labour_protection_protocol(
-    replacement_dict, student_data
+
+if "planner" not in st.session_state:
+    st.session_state.planner = generation.GenerationPlanner(
+        batch=True, max_workers=generation.DEFAULT_WORKERS, cache=output_cache.get_cache()
+    )
+planner = st.session_state.planner
+
+
+selected_titles = st.multiselect(
+    "Документы",
+    [spec.title for spec in planner.specs],
+    default=[spec.title for spec in planner.specs],
 )
-height_certificate = create_height_certificate(replacement_dict, student_data)
+selected_keys = [spec.key for spec in planner.specs if spec.title in selected_titles]
+
+with st.expander("Макет свидетельств"):
+    chunk_size = st.number_input(
+        "Обучающихся в одном файле (0 — все в одном файле)", min_value=0, step=50, value=0
+    )
+    per_page = st.selectbox(
+        "Свидетельств на странице",
+        [0, 1, 2, 3],
+        format_func=lambda n: "сколько поместится" if n == 0 else str(n),
+        help="Не больше, чем помещается на странице",
+    )
+    page_backgrounds = st.checkbox(
+        "Фон в колонтитулах (один рисунок на место на странице, а не на каждое свидетельство)"
+    )
+layout = generation.Layout(chunk_size=chunk_size, per_page=per_page, page_backgrounds=page_backgrounds)
+
+
+def build_zip_bundle():
+    """Generates the selected documents that are out of date and packs them into a ZIP."""
+    parts = planner.iter_generate(replacement_dict, student_table.students(), selected_keys, layout)
+    return bundle.build_bundle((part.filename, part.data) for part in parts)
+
 
 show_documents = st.button("Сгенерировать документы")
+queue_documents = st.button(
+    "Сгенерировать в фоне",
+    help="Архив собирается отдельным процессом; его можно скачать позже, в том числе после обновления страницы",
+)
+profile = st.sidebar.checkbox("Профилирование", help="Замер времени и памяти по этапам генерации")
 
-if show_documents:
+
+def show_trace(trace):
+    summary = pd.DataFrame(trace.summary()).T.fillna(0).round(3)
+    st.sidebar.subheader("Время по этапам, с")
+    st.sidebar.dataframe(summary)
+    st.sidebar.download_button(
+        "Скачать трассировку (JSON)", trace.to_json(), file_name="trace.json", mime="application/json"
+    )
+    st.sidebar.download_button(
+        "Скачать трассировку (Chrome)",
+        trace.to_chrome_trace(),
+        file_name="trace.chrome.json",
+        mime="application/json",
+    )
+
+def check_inputs():
+    """Shows what is missing for the generation, returns whether it can start."""
     if not student_profession:
         st.warning("Укажите профессию")
     if not teacher_name:
@@ -520,93 +123,119 @@ if show_documents:
         st.warning("Укажите номер приказа о выпуске")
     if num_students == 0:
         st.warning("Укажите обучающихся")
+    if student_table.errors:
+        st.warning("Исправьте ошибки в списке обучающихся")
+
+    if not selected_keys:
+        st.warning("Выберите документы")
 
-    if (
-        student_profession
+    return bool(
+        selected_keys
+        and not student_table.errors
+        and student_profession
         and teacher_name
         and beginning_date
         and end_date
         and beginning_number
         and end_number
-    ):
-        document_tabs = st.tabs(
-            [
-                "Приказ о начале",
-                "Приказ об окончании",
-                "Протокол",
-                "Свидетельство",
-                "Свидетельство тракторов синее",
-                "Свидетельство тракторов зеленое",
-                "Милана удостоверение", 
-                "Милана св-во охрана труда",
-                'Милана протокол охрана труда',
-                'На высоте',
-            ]
-        )
-        with document_tabs[0]:  # Приказ о начале
-            utils.display_docx_content(beginning_doc)
-
-        with document_tabs[1]:  # Приказ об окончании
-            utils.display_docx_content(end_doc)
-
-        with document_tabs[2]:  # Протокол
-            utils.display_docx_content(protocol)
-
-        with document_tabs[3]:  # Свидетельство
-            utils.display_docx_content(certificate_docs)
-
-        with document_tabs[4]:  # Свидетельство тракторов
-            utils.display_docx_content(blue_tractor_cert)
-
-        with document_tabs[5]:
-            utils.display_docx_content(green_tractor_cert)
-        with document_tabs[6]: 
-            utils.display_docx_content(milana_conf_page)
-        with document_tabs[7]: 
-            utils.display_docx_content(milana_cert)
-        with document_tabs[8]: 
-            utils.display_docx_content(labour_protection_protocol)
-        with document_tabs[9]: 
-            utils.display_docx_content(height_certificate)
-
-# --- Create a ZIP archive in memory ---
-zip_buffer = BytesIO()
-with zipfile.ZipFile(zip_buffer, "w") as zipf:
-    # Add the beginning document
-    with zipf.open("Приказ о начале.docx", "w") as f:
-        beginning_doc.save(f)
-
-    # Add the end document
-    with zipf.open("Приказ о выпуске.docx", "w") as f:
-        end_doc.save(f)
-
-    with zipf.open("Протокол.docx", "w") as f:
-        protocol.save(f)
-
-    with zipf.open("Свидетельство.docx", "w") as f:
-        certificate_docs.save(f)
-
-    with zipf.open("Свидетельство синее трактор.docx", "w") as f:
-        blue_tractor_cert.save(f)
-
-    with zipf.open("Свидетельство зеленое трактор.docx", "w") as f:
-        green_tractor_cert.save(f)
-    with zipf.open("Удостоверение Милана.docx", "w") as f:
-        milana_conf_page.save(f)
-    with zipf.open("Свидетельство Милана.docx", "w") as f:
-        milana_cert.save(f)
-    with zipf.open('Протокол Милана.docx', 'w') as f:
-        labour_protection_protocol.save(f)
-    with zipf.open('На высоте.docx', 'w') as f:
-        height_certificate.save(f)
-
-zip_buffer.seek(0)
+    )
+
+
+# background jobs belong to the browser tab: the owner id is kept in the URL, so they survive a refresh
+if "owner" not in st.query_params:
+    st.query_params["owner"] = uuid.uuid4().hex
+owner = st.query_params["owner"]
+jobs.start_workers()
+
+JOB_STATUSES = {
+    jobs.QUEUED: "в очереди",
+    jobs.RUNNING: "выполняется",
+    jobs.DONE: "готово",
+    jobs.FAILED: "ошибка",
+    jobs.CANCELLED: "отменено",
+}
+
+
+def read_bundle(job_id):
+    with open(jobs.bundle_path(job_id), "rb") as f:
+        return f.read()
+
+
+def show_jobs(polling):
+    """Lists the background jobs of this tab; reruns every few seconds while one of them is not finished."""
+    owner_jobs = jobs.list_jobs(owner)
+    if not owner_jobs:
+        return
+    st.subheader("Задания")
+    for job in owner_jobs:
+        with st.container(border=True):
+            st.markdown(f"**{job.title}** — {JOB_STATUSES[job.status]}")
+            if job.status in (jobs.QUEUED, jobs.RUNNING):
+                st.progress(job.progress, text=f"Файлов готово: {job.files_done} из {job.files_total}")
+                st.caption(
+                    ", ".join(
+                        f"{document.title} {document.files_done}/{document.files_total}"
+                        for document in job.documents
+                    )
+                )
+                st.button("Отменить", key=f"cancel_{job.id}", on_click=jobs.cancel, args=(job.id,))
+            elif job.status == jobs.DONE:
+                st.download_button(
+                    "Скачать документы (ZIP)",
+                    data=lambda job_id=job.id: read_bundle(job_id),
+                    file_name=f"{job.title}.zip",
+                    mime="application/zip",
+                    key=f"download_{job.id}",
+                )
+            elif job.status == jobs.FAILED:
+                st.error(job.error)
+    if polling and all(job.status in jobs.FINISHED for job in owner_jobs):
+        # stops the polling
+        st.rerun()
+
+
+if queue_documents and check_inputs():
+    jobs.submit(
+        replacement_dict,
+        student_table.students(),
+        selected_keys,
+        layout,
+        owner=owner,
+        title=f"{end_date.strftime('%d.%m.%Y')} {company}, обучающихся {num_students}",
+    )
+
+# the preview stays after the click, so that its page inputs can rerun the script;
+# the planner only regenerates what the inputs changed
+if show_documents:
+    st.session_state.show_documents = True
+
+if st.session_state.get("show_documents"):
+    if check_inputs():
+        if profile:
+            tracing.start()
+        try:
+            outputs = planner.generate(replacement_dict, student_table.students(), selected_keys, layout)
+            selected_specs = [spec for spec in planner.specs if spec.key in outputs]
+            document_tabs = st.tabs([spec.title for spec in selected_specs])
+            for tab, spec in zip(document_tabs, selected_specs):
+                parts = outputs[spec.key]
+                with tab, tracing.span("document", document=spec.key):
+                    if len(parts) > 1:
+                        st.caption(f"{parts[0].filename} (файл 1 из {len(parts)})")
+                    utils.display_preview(parts[0].data, spec.key)
+        finally:
+            trace = tracing.stop()
+        if trace is not None:
+            show_trace(trace)
 
 formatted_end_date = end_date.strftime("%d.%m.%Y")
-# --- Download the ZIP archive ---
+# --- Download the ZIP archive, built only when the button is clicked ---
 st.download_button(
     label="Скачать документы (ZIP)",
-    data=zip_buffer,
+    data=build_zip_bundle,
     file_name=f"{formatted_end_date}.zip",
     mime="application/zip",
 )
+
+polling = any(job.status not in jobs.FINISHED for job in jobs.list_jobs(owner))
+st.fragment(show_jobs, run_every=2 if polling else None)(polling)
@@ -0,0 +1,111 @@
+import utils
+
+import copy
+from lxml import etree
+from docx.oxml import OxmlElement
+from docx.oxml.ns import qn
+
+PAGE_BREAK = '<w:p><w:r><w:br w:type="page"/></w:r></w:p>'
+EMPTY_PARAGRAPH = "<w:p/>"
+
+EMPTY_CELL = "<w:tc><w:p/></w:tc>"
+
+# markers in the batch body xml, see build_batch_body
+ROWS = "batch-rows"
+CELLS = "batch-cells"
+SEGMENT = "<!--batch-segment-->"
+
+
+def prepare_row(row):
+    """Applies the per-row formatting the merged tables get, once, on the template row."""
+    trPr = row.get_or_add_trPr()
+    if trPr.find(qn("w:cantSplit")) is None:
+        cant_split = OxmlElement("w:cantSplit")
+        tr_height = trPr.find(qn("w:trHeight"))
+        if tr_height is not None:
+            tr_height.addprevious(cant_split)
+        else:
+            trPr.append(cant_split)
+    for cell in row.findall(qn("w:tc")):
+        utils.update_nested_table_styles(cell, row)
+
+
+def widen_grid(tbl, per_row):
+    """Repeats the grid columns so that `per_row` template cells fit side by side."""
+    grid = tbl.find(qn("w:tblGrid"))
+    columns = grid.findall(qn("w:gridCol"))
+    for _ in range(per_row - 1):
+        for column in columns:
+            grid.append(copy.deepcopy(column))
+
+    tblW = tbl.find(f"{qn('w:tblPr')}/{qn('w:tblW')}")
+    if tblW is not None and tblW.get(qn("w:type")) == "dxa":
+        tblW.set(qn("w:w"), str(int(tblW.get(qn("w:w"))) * per_row))
+
+
+def build_batch_body(body, per_row=1, separator=None):
+    """Cuts the body xml of a template into a BatchBody.
+
+    Only the tables of the template are kept, in order, joined by `separator`.
+    With `per_row` > 1 the cells of the template row are repeated for
+    `per_row` consecutive students and the last row is padded with empty cells.
+    """
+    body = copy.deepcopy(body)
+    for child in list(body):
+        if child.tag not in (qn("w:tbl"), qn("w:sectPr")):
+            body.remove(child)
+    # a document must not end with a table
+    body.find(qn("w:sectPr")).addprevious(OxmlElement("w:p"))
+
+    for tbl in body.findall(qn("w:tbl")):
+        rows = tbl.findall(qn("w:tr"))
+        rows[0].addprevious(etree.Comment(ROWS))
+        rows[-1].addnext(etree.Comment(ROWS))
+        if per_row > 1:
+            widen_grid(tbl, per_row)
+        for row in rows:
+            prepare_row(row)
+            row_cells = row.findall(qn("w:tc"))
+            row_cells[0].addprevious(etree.Comment(CELLS))
+            row_cells[-1].addnext(etree.Comment(CELLS))
+
+    xml = etree.tostring(body, encoding="unicode", pretty_print=False)
+    xml = xml.replace("</w:tbl><w:tbl", f"</w:tbl>{separator or ''}<w:tbl")
+    pieces = xml.split(f"<!--{CELLS}-->")
+    frame = f"<!--{CELLS}-->".join(pieces[::2])
+    return BatchBody(frame, SEGMENT.join(pieces[1::2]), per_row)
+
+
+class BatchBody:
+    """The body of a template cut into the parts rendered once and the cells rendered per student.
+
+    `frame` is the body with the cells of every table row taken out, `cells`
+    the xml of those cells, the cells of one row after another joined by
+    SEGMENT. Both are rendered separately, the frame once per document and the
+    cells once per student, and put together by `join`.
+    """
+
+    def __init__(self, frame, cells, per_row=1):
+        self.frame = frame
+        self.cells = cells
+        self.per_row = per_row
+
+    def join(self, frame, students):
+        """Returns the body xml from the rendered `frame` and the rendered cells of each student."""
+        students = [cells.split(SEGMENT) for cells in students]
+        pieces = frame.split(f"<!--{ROWS}-->")
+        out = [pieces[0]]
+        segment = 0
+        for table, rows in enumerate(pieces[1::2]):
+            # the text between the cells of consecutive rows
+            bounds = rows.split(f"<!--{CELLS}-->")
+            for start in range(0, len(students), self.per_row):
+                group = students[start:start + self.per_row]
+                for row, bound in enumerate(bounds[:-1]):
+                    out.append(bound)
+                    out.extend(cells[segment + row] for cells in group)
+                    out.append(EMPTY_CELL * (self.per_row - len(group)))
+                out.append(bounds[-1])
+            segment += len(bounds) - 1
+            out.append(pieces[2 * table + 2])
+        return "".join(out)
@@ -0,0 +1,198 @@
+"""Benchmarks every document builder on synthetic cohorts.
+
+For each document and cohort size the build and the .save() are timed
+separately (best of --repeat runs), then one more run under tracemalloc
+records the peak memory. Every run starts without the memoized student
+fragments and tractor bases, so build_s is the cost of the builders; the
+build right after it, served from those memos, is reported as warm_build_s.
+Results are written as JSON and can be compared against a stored baseline:
+
+    python benchmark.py --sizes 1,10,100 --output after.json --baseline before.json
+"""
+import utils
+import documents
+import generation
+import template_cache
+
+import argparse
+import datetime
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from io import BytesIO
+
+DEFAULT_SIZES = (1, 10, 100, 500, 2000)
+
+PROFESSION = utils.Profession(
+    name="Тракторист",
+    code=[19203],
+    hours_str="72 часов",
+    formatted_profession="19203 «Тракторист»",
+    role_required=False,
+)
+
+SURNAMES = ("Иванов", "Петров", "Сидоров", "Кузнецов", "Смирнов", "Попов", "Васильев")
+NAMES = ("Иван", "Петр", "Алексей", "Сергей", "Николай", "Дмитрий")
+
+
+def synthetic_students(count):
+    return [
+        utils.Student(
+            name=f"{SURNAMES[i % len(SURNAMES)]} {NAMES[i % len(NAMES)]} Иванович",
+            cert_number=str(1000 + i),
+            role="слесарь-ремонтник" if i % 2 else "",
+            machine_category="B, C, D" if i % 3 else "",
+        )
+        for i in range(count)
+    ]
+
+
+def replacement_dict(num_students):
+    return generation.build_replacement_dict(
+        PROFESSION,
+        "А.И. Мамонтов",
+        "ООО «Ромашка»",
+        datetime.date(2024, 3, 1),
+        datetime.date(2024, 3, 20),
+        808,
+        809,
+        num_students,
+    )
+
+
+def clear_memos():
+    """Forgets what an earlier build of the same students memoized, the compiled templates stay."""
+    template_cache.clear_fragments()
+    documents.clear_tractor_bases()
+
+
+def measure(spec, students, batch, repeat, memory=True):
+    values = replacement_dict(len(students))
+    build_times, warm_build_times, save_times = [], [], []
+    for _ in range(repeat):
+        clear_memos()
+        start = time.perf_counter()
+        doc = generation.build_document(spec, values, students, batch)
+        build_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        generation.build_document(spec, values, students, batch)
+        warm_build_times.append(time.perf_counter() - start)
+
+        buffer = BytesIO()
+        start = time.perf_counter()
+        doc.save(buffer)
+        save_times.append(time.perf_counter() - start)
+
+    result = {
+        "document": spec.key,
+        "students": len(students),
+        "mode": "batch" if batch and spec.batchable else "single",
+        "build_s": min(build_times),
+        "warm_build_s": min(warm_build_times),
+        "save_s": min(save_times),
+        "size_bytes": len(buffer.getvalue()),
+    }
+
+    if memory:
+        clear_memos()
+        tracemalloc.start()
+        doc = generation.build_document(spec, values, students, batch)
+        doc.save(BytesIO())
+        result["peak_mb"] = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+    return result
+
+
+def compare(results, baseline, threshold):
+    """Prints the change against `baseline`, returns the number of regressions above `threshold`."""
+    previous = {
+        (r["document"], r["students"], r["mode"]): r for r in baseline["results"]
+    }
+    regressions = 0
+    print(
+        f"\n{'document':32s} {'n':>5s} {'mode':6s} {'build':>8s} {'warm':>8s} {'save':>8s} {'size':>8s}"
+    )
+    for result in results:
+        old = previous.get((result["document"], result["students"], result["mode"]))
+        if old is None:
+            continue
+        # results stored before warm_build_s existed compare as unchanged there
+        ratios = [
+            result[field] / old[field] if old.get(field) else 1.0
+            for field in ("build_s", "warm_build_s", "save_s", "size_bytes")
+        ]
+        flag = ""
+        if any(ratio > 1 + threshold for ratio in ratios):
+            regressions += 1
+            flag = "  <-- slower"
+        print(
+            f"{result['document']:32s} {result['students']:5d} {result['mode']:6s} "
+            + " ".join(f"{ratio:7.2f}x" for ratio in ratios)
+            + flag
+        )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        default=",".join(map(str, DEFAULT_SIZES)),
+        help="comma separated cohort sizes",
+    )
+    parser.add_argument("--documents", help="comma separated document keys, all by default")
+    parser.add_argument("--mode", choices=("single", "batch"), default="batch")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc run")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="results file to compare against")
+    parser.add_argument(
+        "--threshold", type=float, default=0.1, help="relative slowdown reported as a regression"
+    )
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    specs = generation.DOCUMENT_SPECS
+    if args.documents:
+        specs = [generation.SPECS_BY_KEY[key] for key in args.documents.split(",")]
+    batch = args.mode == "batch"
+
+    # compile the templates and resample the images once, so that the first size is not penalised
+    for spec in specs:
+        generation.build_document(spec, replacement_dict(1), synthetic_students(1), batch)
+
+    results = []
+    for size in sizes:
+        students = synthetic_students(size)
+        for spec in specs:
+            result = measure(spec, students, batch, args.repeat, memory=not args.no_memory)
+            results.append(result)
+            print(
+                f"{spec.key:32s} {size:5d} build {result['build_s']:8.3f}s "
+                f"warm {result['warm_build_s']:7.3f}s save {result['save_s']:7.3f}s {result['size_bytes'] / 2**20:7.2f} MB"
+                + (f" peak {result['peak_mb']:7.1f} MB" if "peak_mb" in result else "")
+            )
+
+    report = {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+import bz2
+import struct
+import tempfile
+import time
+import zlib
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+# Bundles larger than this are spilled from memory to a temporary file.
+SPOOL_THRESHOLD = 32 * 1024 * 1024
+
+DEFAULT_COMPRESSION = zipfile.ZIP_DEFLATED
+DEFAULT_COMPRESSLEVEL = 6
+COMPRESSION_METHODS = {
+    "stored": zipfile.ZIP_STORED,
+    "deflated": zipfile.ZIP_DEFLATED,
+    "bzip2": zipfile.ZIP_BZIP2,
+}
+
+# Layouts of the zip records, see APPNOTE.TXT sections 4.3.7, 4.3.12 and 4.3.16
+LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+CENTRAL_HEADER = struct.Struct("<4s6H3L5H2L")
+END_OF_CENTRAL_DIRECTORY = struct.Struct("<4s4H2LH")
+UTF8_FLAG = 0x800
+# version needed to extract, per compression method
+VERSIONS = {zipfile.ZIP_STORED: 20, zipfile.ZIP_DEFLATED: 20, zipfile.ZIP_BZIP2: 46}
+MADE_BY_UNIX = 3 << 8
+
+
+def compress(data, method, level):
+    """Returns the compressed payload of a zip entry. zlib and bz2 release the GIL while working."""
+    if method == zipfile.ZIP_STORED:
+        return data
+    if method == zipfile.ZIP_DEFLATED:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        return compressor.compress(data) + compressor.flush()
+    if method == zipfile.ZIP_BZIP2:
+        return bz2.compress(data, max(1, level))
+    raise ValueError(f"Unsupported compression method: {method}")
+
+
+def dos_date_time(timestamp):
+    t = time.localtime(timestamp)
+    dos_time = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    dos_date = ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    return dos_time, dos_date
+
+
+class BundleWriter:
+    """Assembles the download ZIP from serialized documents as they become available.
+
+    Entries are compressed in parallel threads and written to the archive in
+    the order they finish. The archive is kept in memory up to
+    `spool_threshold` bytes and spilled to a temporary file beyond that.
+    Archives are limited to the classic zip format (no zip64, < 4 GB).
+    """
+
+    def __init__(
+        self,
+        compression=DEFAULT_COMPRESSION,
+        compresslevel=DEFAULT_COMPRESSLEVEL,
+        max_workers=4,
+        spool_threshold=SPOOL_THRESHOLD,
+    ):
+        self.compression = compression
+        self.compresslevel = compresslevel
+        self.file = tempfile.SpooledTemporaryFile(max_size=spool_threshold)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.pending = []
+        self.central_directory = []
+        self.names = set()
+        self.date_time = dos_date_time(time.time())
+
+    def add(self, filename, data):
+        """Schedules `data` for compression under `filename` and writes the entries that are ready."""
+        if filename in self.names:
+            raise ValueError(f"Duplicate entry in bundle: {filename}")
+        self.names.add(filename)
+        future = self.executor.submit(compress, data, self.compression, self.compresslevel)
+        self.pending.append((filename, data, future))
+        self._write_ready()
+
+    def _write_ready(self, wait=False):
+        remaining = []
+        for filename, data, future in self.pending:
+            if wait or future.done():
+                self._write_entry(filename, data, future.result())
+            else:
+                remaining.append((filename, data, future))
+        self.pending = remaining
+
+    def _write_entry(self, filename, data, payload):
+        name = filename.encode("utf-8")
+        crc = zlib.crc32(data)
+        version = VERSIONS[self.compression]
+        dos_time, dos_date = self.date_time
+        offset = self.file.tell()
+        self.file.write(
+            LOCAL_HEADER.pack(
+                b"PK\003\004", version, UTF8_FLAG, self.compression,
+                dos_time, dos_date, crc, len(payload), len(data), len(name), 0,
+            )
+        )
+        self.file.write(name)
+        self.file.write(payload)
+        self.central_directory.append(
+            CENTRAL_HEADER.pack(
+                b"PK\001\002", MADE_BY_UNIX | version, version, UTF8_FLAG, self.compression,
+                dos_time, dos_date, crc, len(payload), len(data), len(name),
+                0, 0, 0, 0, 0o644 << 16, offset,
+            )
+            + name
+        )
+
+    def close(self):
+        """Finishes the archive and returns it as a file object positioned at the start."""
+        self._write_ready(wait=True)
+        self.executor.shutdown()
+
+        start = self.file.tell()
+        for record in self.central_directory:
+            self.file.write(record)
+        size = self.file.tell() - start
+        count = len(self.central_directory)
+        self.file.write(
+            END_OF_CENTRAL_DIRECTORY.pack(b"PK\005\006", 0, 0, count, count, size, start, 0)
+        )
+        self.file.seek(0)
+        return self.file
+
+
+def build_bundle(documents, **options):
+    """Returns the ZIP of an iterable of (filename, .docx bytes), see BundleWriter for `options`."""
+    writer = BundleWriter(**options)
+    for filename, data in documents:
+        writer.add(filename, data)
+    return writer.close()
@@ -0,0 +1,210 @@
+"""SQLite store for the training programmes (professions) and teachers.
+
+Replaces the data/*.pickle files, which had to be loaded whole on every
+rerun and rewritten whole for every added entry. The pickles are imported
+once, when the database is created. Every write runs in its own
+transaction and bumps a revision counter; readers keep the last loaded
+catalog per process and reload it only when the revision changed, also if
+another process wrote it.
+"""
+import utils
+
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+DB_PATH = "data/catalog.sqlite3"
+PROFESSIONS_PICKLE = "data/professions.pickle"
+TEACHERS_PICKLE = "data/teachers.pickle"
+
+SCHEMA_VERSION = 1
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS professions (
+    name TEXT PRIMARY KEY,
+    codes TEXT NOT NULL,
+    hours_str TEXT,
+    formatted_profession TEXT NOT NULL,
+    role_required INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS profession_codes (
+    code INTEGER NOT NULL,
+    name TEXT NOT NULL REFERENCES professions (name) ON DELETE CASCADE,
+    PRIMARY KEY (code, name)
+);
+CREATE INDEX IF NOT EXISTS profession_codes_name ON profession_codes (name);
+CREATE TABLE IF NOT EXISTS teachers (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('revision', 0)
+"""
+
+_cache = {}
+_lock = threading.Lock()
+
+
+@contextmanager
+def connect(path=DB_PATH):
+    """Yields a connection inside a transaction, creating and migrating the database on first use."""
+    connection = sqlite3.connect(path, timeout=30)
+    try:
+        connection.execute("PRAGMA foreign_keys = ON")
+        initialize(connection)
+        with connection:
+            yield connection
+    finally:
+        connection.close()
+
+
+def schema_version(connection):
+    return connection.execute("PRAGMA user_version").fetchone()[0]
+
+
+def initialize(connection):
+    if schema_version(connection) >= SCHEMA_VERSION:
+        return
+    connection.execute("PRAGMA journal_mode = WAL")
+    # the write lock makes concurrent first runs wait for the one creating the database
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        if schema_version(connection) < SCHEMA_VERSION:
+            for statement in SCHEMA.split(";"):
+                connection.execute(statement)
+            migrate_pickles(connection)
+            connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        connection.commit()
+    except BaseException:
+        connection.rollback()
+        raise
+
+
+def migrate_pickles(connection, professions_path=PROFESSIONS_PICKLE, teachers_path=TEACHERS_PICKLE):
+    """Copies the entries of the legacy pickle files into a freshly created database."""
+    insert_professions(connection, utils.load_from_pickle(professions_path).values())
+    insert_teachers(connection, utils.load_from_pickle(teachers_path))
+    bump_revision(connection)
+
+
+def bump_revision(connection):
+    connection.execute("UPDATE meta SET value = value + 1 WHERE key = 'revision'")
+
+
+def revision(connection):
+    return connection.execute("SELECT value FROM meta WHERE key = 'revision'").fetchone()[0]
+
+
+def insert_professions(connection, professions):
+    for profession in professions:
+        connection.execute(
+            "INSERT OR REPLACE INTO professions"
+            " (name, codes, hours_str, formatted_profession, role_required)"
+            " VALUES (?, ?, ?, ?, ?)",
+            (
+                profession.name,
+                json.dumps(profession.code),
+                profession.hours_str,
+                profession.formatted_profession,
+                int(profession.role_required),
+            ),
+        )
+        connection.execute("DELETE FROM profession_codes WHERE name = ?", (profession.name,))
+        connection.executemany(
+            "INSERT OR IGNORE INTO profession_codes (code, name) VALUES (?, ?)",
+            [(code, profession.name) for code in profession.code],
+        )
+
+
+def insert_teachers(connection, names):
+    connection.executemany(
+        "INSERT OR IGNORE INTO teachers (name) VALUES (?)", [(name,) for name in names]
+    )
+
+
+def row_to_profession(row):
+    name, codes, hours_str, formatted_profession, role_required = row
+    return utils.Profession(
+        name=name,
+        code=json.loads(codes),
+        hours_str=hours_str,
+        formatted_profession=formatted_profession,
+        role_required=bool(role_required),
+    )
+
+
+def cached(key, path, load):
+    """Returns load(connection) from the process cache, reloading it when the database revision changed."""
+    with connect(path) as connection:
+        current = revision(connection)
+        with _lock:
+            entry = _cache.get((key, path))
+            if entry and entry[0] == current:
+                return entry[1]
+        value = load(connection)
+    with _lock:
+        _cache[(key, path)] = (current, value)
+    return value
+
+
+def load_professions(path=DB_PATH):
+    """Returns {name: Profession} sorted by name. The dict is shared, do not modify it."""
+    return cached(
+        "professions",
+        path,
+        lambda connection: {
+            row[0]: row_to_profession(row)
+            for row in connection.execute(
+                "SELECT name, codes, hours_str, formatted_profession, role_required"
+                " FROM professions ORDER BY name"
+            )
+        },
+    )
+
+
+def load_teachers(path=DB_PATH):
+    """Returns the teacher names in the order they were added. The list is shared, do not modify it."""
+    return cached(
+        "teachers",
+        path,
+        lambda connection: [
+            name for (name,) in connection.execute("SELECT name FROM teachers ORDER BY id")
+        ],
+    )
+
+
+def find_by_code(code, path=DB_PATH):
+    """Returns the professions with the classifier code `code`."""
+    with connect(path) as connection:
+        rows = connection.execute(
+            "SELECT p.name, p.codes, p.hours_str, p.formatted_profession, p.role_required"
+            " FROM profession_codes c JOIN professions p ON p.name = c.name"
+            " WHERE c.code = ? ORDER BY p.name",
+            (code,),
+        ).fetchall()
+    return [row_to_profession(row) for row in rows]
+
+
+def save_profession(profession, path=DB_PATH):
+    """Adds `profession`, or replaces the one with the same name."""
+    save_professions([profession], path)
+
+
+def save_professions(professions, path=DB_PATH):
+    with connect(path) as connection:
+        insert_professions(connection, professions)
+        bump_revision(connection)
+
+
+def add_teacher(name, path=DB_PATH):
+    """Adds a teacher, returns False if one with this name already exists."""
+    with connect(path) as connection:
+        added = connection.execute(
+            "INSERT OR IGNORE INTO teachers (name) VALUES (?)", (name,)
+        ).rowcount
+        if added:
+            bump_revision(connection)
+    return bool(added)
@@ -0,0 +1,235 @@
+"""Generates the document bundles of one or more groups without Streamlit.
+
+A cohort file starts with `key: value` header lines, followed by an empty
+line and the same tab separated student rows the text area accepts:
+
+    profession: Администратор
+    teacher: А.И. Мамонтов
+    company: заявление
+    beginning_date: 2024-03-01
+    end_date: 20.03.2024
+    beginning_number: 808
+    end_number: 809
+
+    12	...	...	Иванов Иван Иванович	B, C
+
+Example: python cli.py cohorts/*.txt --output-dir out --jobs 4
+"""
+import generation
+import bundle
+import catalog
+import student_import
+import output_cache
+
+import argparse
+import datetime
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+HEADER_FIELDS = (
+    "profession",
+    "teacher",
+    "company",
+    "beginning_date",
+    "end_date",
+    "beginning_number",
+    "end_number",
+)
+
+
+@dataclass
+class Cohort:
+    name: str
+    replacement_dict: dict
+    students: list
+
+
+def parse_date(value):
+    for date_format in ("%Y-%m-%d", "%d.%m.%Y"):
+        try:
+            return datetime.datetime.strptime(value, date_format).date()
+        except ValueError:
+            pass
+    raise ValueError(f"Неверная дата '{value}', ожидается ГГГГ-ММ-ДД или ДД.ММ.ГГГГ")
+
+
+def header_replacement_dict(header, profession, num_students):
+    """Returns the template values of a group from its HEADER_FIELDS, given as strings or numbers."""
+    try:
+        beginning_number = int(header["beginning_number"])
+        end_number = int(header["end_number"])
+    except (TypeError, ValueError):
+        raise ValueError("номера приказов должны быть целыми числами")
+    return generation.build_replacement_dict(
+        profession,
+        str(header["teacher"]),
+        str(header["company"]),
+        parse_date(str(header["beginning_date"])),
+        parse_date(str(header["end_date"])),
+        beginning_number,
+        end_number,
+        num_students,
+    )
+
+
+def read_cohort(path, professions):
+    with open(path, encoding="utf-8-sig") as f:
+        lines = f.read().split("\n")
+
+    header = {}
+    for index, line in enumerate(lines):
+        if not line.strip():
+            break
+        key, _, value = line.partition(":")
+        header[key.strip()] = value.strip()
+    missing = [field for field in HEADER_FIELDS if field not in header]
+    if missing:
+        raise ValueError(f"{path}: не указаны поля {', '.join(missing)}")
+
+    profession = professions.get(header["profession"])
+    if profession is None:
+        raise ValueError(f"{path}: неизвестная программа обучения '{header['profession']}'")
+
+    table = student_import.parse_text("\n".join(lines[index + 1:]), profession.role_required)
+    for issue in sorted(table.issues, key=lambda issue: issue.row):
+        # rows of the file, after the header lines and the empty line
+        message = f"{path}, строка {issue.row + index + 1}: {issue.message}"
+        if issue.level == student_import.ERROR:
+            raise ValueError(message)
+        print(f"{message} ({issue.level})", file=sys.stderr)
+    students = table.students()
+    try:
+        replacement_dict = header_replacement_dict(header, profession, len(students))
+    except ValueError as e:
+        raise ValueError(f"{path}: {e}")
+    name = os.path.splitext(os.path.basename(path))[0]
+    return Cohort(name=name, replacement_dict=replacement_dict, students=students)
+
+
+# cohorts generated at once with --jobs > 1: while one waits for its last
+# files the next keeps the workers busy, and only these are held in memory
+COHORTS_IN_FLIGHT = 2
+
+
+def write_cohort(
+    cohort, specs, output_dir, jobs=1, batch=True, layout=generation.DEFAULT_LAYOUT, cache=None
+):
+    """Writes the ZIP of one cohort into `output_dir`, returns the number of files in it."""
+    parts = generation.iter_documents(
+        specs,
+        cohort.replacement_dict,
+        cohort.students,
+        batch,
+        max_workers=jobs,
+        layout=layout,
+        cache=cache,
+    )
+    writer = bundle.BundleWriter()
+    count = 0
+    for part in parts:
+        writer.add(part.filename, part.data)
+        count += 1
+    archive = writer.close()
+    path = os.path.join(output_dir, f"{cohort.name}.zip")
+    with archive, open(path, "wb") as f:
+        shutil.copyfileobj(archive, f)
+    print(f"{path}: {len(cohort.students)} обучающихся, {count} файлов")
+    return count
+
+
+def generate_cohorts(
+    cohorts, specs, output_dir, jobs=1, batch=True, layout=generation.DEFAULT_LAYOUT, cache=None
+):
+    """Writes one ZIP per cohort into `output_dir`, returns the number of files written."""
+    def write(cohort):
+        return write_cohort(cohort, specs, output_dir, jobs, batch, layout, cache)
+
+    if jobs > 1 and len(cohorts) > 1:
+        # the cohorts share the worker pool of generation.iter_documents
+        with ThreadPoolExecutor(max_workers=COHORTS_IN_FLIGHT) as executor:
+            return sum(executor.map(write, cohorts))
+    return sum(write(cohort) for cohort in cohorts)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Генерация документов для групп без Streamlit.")
+    parser.add_argument("cohorts", nargs="+", help="файлы групп")
+    parser.add_argument("-o", "--output-dir", default="output", help="папка для ZIP архивов")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="количество процессов")
+    parser.add_argument(
+        "--documents",
+        help="документы через запятую, по умолчанию все: "
+        + ", ".join(spec.key for spec in generation.DOCUMENT_SPECS),
+    )
+    parser.add_argument(
+        "--no-batch", action="store_true", help="заполнять свидетельства по одному обучающемуся"
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="не использовать кэш готовых документов"
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=0,
+        help="обучающихся в одном файле свидетельств, 0 — все в одном файле",
+    )
+    parser.add_argument(
+        "--per-page",
+        type=int,
+        choices=(0, 1, 2, 3),
+        default=0,
+        help="свидетельств на странице, не больше, чем поместится; 0 — сколько поместится",
+    )
+    parser.add_argument(
+        "--page-backgrounds",
+        action="store_true",
+        help="рисовать фон свидетельств в колонтитулах, один раз на страницу",
+    )
+    args = parser.parse_args(argv)
+
+    specs = generation.DOCUMENT_SPECS
+    if args.documents:
+        keys = args.documents.split(",")
+        unknown = [key for key in keys if key not in generation.SPECS_BY_KEY]
+        if unknown:
+            parser.error(f"неизвестные документы: {', '.join(unknown)}")
+        specs = [spec for spec in specs if spec.key in keys]
+
+    professions = catalog.load_professions()
+    try:
+        cohorts = [read_cohort(path, professions) for path in args.cohorts]
+    except ValueError as e:
+        parser.error(str(e))
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    start = time.perf_counter()
+    layout = generation.Layout(
+        chunk_size=args.chunk_size, per_page=args.per_page, page_backgrounds=args.page_backgrounds
+    )
+    num_documents = generate_cohorts(
+        cohorts,
+        specs,
+        args.output_dir,
+        jobs=args.jobs,
+        batch=not args.no_batch,
+        layout=layout,
+        cache=None if args.no_cache else output_cache.get_cache(),
+    )
+    elapsed = time.perf_counter() - start
+
+    num_students = sum(len(cohort.students) for cohort in cohorts)
+    print(
+        f"{len(cohorts)} групп, {num_students} обучающихся, {num_documents} файлов "
+        f"за {elapsed:.1f} с: {num_students / elapsed:.1f} обучающихся/с, "
+        f"{num_documents / elapsed:.1f} файлов/с"
+    )
+    generation.discard_pool()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
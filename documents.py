@@ -0,0 +1,835 @@
+import utils
+import picture
+import template_cache
+import images
+import placeholders
+import tracing
+import streaming
+from batch import PAGE_BREAK
+
+import math
+import copy
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from io import BytesIO
+
+from docx import Document
+from docx.oxml import OxmlElement
+from docx.shared import Emu, Inches, Pt, Twips
+from docx.enum.table import WD_ROW_HEIGHT_RULE, WD_TABLE_ALIGNMENT
+from docx.table import _Cell
+from docx.oxml.ns import qn
+
+NAME_KEY = "student_name"
+CERTIFICATE_KEY = "certificate_number"
+MACHINE_CATEGORY = "machine_category"
+ROLE = 'student_role'
+
+TRACTOR_PROFESSION_WORDING = "19203 «Тракторист»"
+
+CERT_HEIGHT_INCHES = Inches(3.65)
+CERT_WIDTH_INCHES = Inches(5.6)
+
+TRACTOR_CERT_HEIGHT = Inches(5.63)
+TRACTOR_CERT_WIDTH = Inches(8.04)
+
+CONFIRMATION_PAGE_BACKGROUND = 'pictures/tractor-background-green.png'
+CONFIRMATION_HEIGHT = Inches(5.54)
+CONFIRMATION_WIDTH = Inches(7.85)
+
+STUDENT_KEYS = (NAME_KEY, CERTIFICATE_KEY, ROLE, MACHINE_CATEGORY)
+
+
+def student_values(student):
+    return {
+        NAME_KEY: student.name,
+        CERTIFICATE_KEY: student.cert_number,
+        ROLE: student.role,
+        MACHINE_CATEGORY: student.machine_category,
+    }
+
+
+def make_student_copy(replacement_dict, student):
+    local_dict = replacement_dict.copy()
+    local_dict.update(student_values(student))
+    return local_dict
+
+
+def render_batch(template_path, replacement_dict, students, per_row=1, separator=None):
+    """Renders the tables of a template once for all students, see batch.build_batch_body."""
+    doc = template_cache.load_batch_template(
+        template_path, STUDENT_KEYS, per_row=per_row, separator=separator
+    )
+    context = replacement_dict.copy()
+    context["students"] = [student_values(student) for student in students]
+    doc.render(context)
+    return doc
+
+
+def insert_images(table):
+    """Fills the image directives of a batch rendered table, whose rows all share one layout."""
+    index = None
+    for tr in table._tbl.tr_lst:
+        if index is None:
+            index = placeholders.SlotIndex(tr)
+        placeholders.fill_runs(index.runs(tr), table)
+
+
+def add_row_backgrounds(table, picture_path, picture_height, picture_width):
+    picture_path = images.prepare_background(picture_path, picture_width, picture_height)
+    for row in table.rows:
+        p = row.cells[0].add_paragraph()
+        picture.add_float_picture(
+            p,
+            picture_path,
+            height=picture_height,
+            width=picture_width,
+            pos_x=Pt(0),
+            pos_y=Pt(0),
+        )
+
+
+def finish_merged_batch(doc):
+    """Gives a batch rendered document the page setup and images of the merged documents."""
+    doc = utils.fit_more_rows(doc)
+    utils.set_default_font(doc)
+    for table in doc.tables:
+        insert_images(table)
+    return doc
+
+
+def page_break_paragraph():
+    br = OxmlElement("w:br")
+    br.set(qn("w:type"), "page")
+    run = OxmlElement("w:r")
+    run.append(br)
+    paragraph = OxmlElement("w:p")
+    paragraph.append(run)
+    return paragraph
+
+
+def row_height(tr):
+    """Returns the height of a w:tr element in twips: its set height or its tallest floating picture, 0 if unknown."""
+    height = 0
+    if tr.trPr is not None and tr.trPr.trHeight_val is not None:
+        height = tr.trPr.trHeight_val.twips
+    for extent in tr.iterfind(f".//{qn('wp:anchor')}/{qn('wp:extent')}"):
+        height = max(height, Emu(int(extent.get("cy"))).twips)
+    return height
+
+
+def impose(doc, per_page):
+    """Lays the certificates of `doc` out `per_page` rows to a page (N-up).
+
+    Every table of the body is split into tables of `per_page` rows separated
+    by page breaks, fewer if that many rows do not fit on a page. Word
+    paginates such small tables much faster than a single table with a row
+    per student.
+    """
+    body = doc.element.body
+    section = doc.sections[-1]
+    usable = section.page_height.twips - section.top_margin.twips - section.bottom_margin.twips
+    for tbl in list(body.iterchildren(qn("w:tbl"))):
+        rows = tbl.tr_lst
+        if not rows:
+            continue
+        rows_per_page = per_page
+        height = max(row_height(tr) for tr in rows)
+        if height:
+            rows_per_page = min(per_page, max(1, usable // height))
+        previous = tbl
+        for start in range(rows_per_page, len(rows), rows_per_page):
+            page = OxmlElement("w:tbl")
+            page.append(copy.deepcopy(tbl.tblPr))
+            page.append(copy.deepcopy(tbl.tblGrid))
+            page.extend(rows[start:start + rows_per_page])
+            page_break = page_break_paragraph()
+            previous.addnext(page_break)
+            page_break.addnext(page)
+            previous = page
+    return doc
+
+
+@dataclass(frozen=True)
+class PageBackground:
+    """The background picture of the rows of one table, see draw_page_backgrounds."""
+
+    picture: str
+    width: int
+    height: int
+
+
+CERTIFICATE_BACKGROUNDS = (
+    PageBackground("pictures/basic-cert-background.png", CERT_WIDTH_INCHES, CERT_HEIGHT_INCHES),
+)
+CONFIRMATION_BACKGROUNDS = (
+    PageBackground(CONFIRMATION_PAGE_BACKGROUND, CONFIRMATION_WIDTH, CONFIRMATION_HEIGHT),
+) * 2
+
+# height of the paragraphs ending the sections, in twips; it has to fit under a full page of rows
+SECTION_END_HEIGHT = 20
+# left cell margin of a table without tblCellMar, in twips
+DEFAULT_CELL_MARGIN = 108
+
+
+def remove_row_backgrounds(doc, table):
+    """Removes the floating pictures of the rows of `table`, and their images if nothing else shows them."""
+    rIds = set()
+    for anchor in list(table._tbl.iter(qn("wp:anchor"))):
+        rIds.update(blip.get(qn("r:embed")) for blip in anchor.iter(qn("a:blip")))
+        drawing = anchor.getparent()
+        drawing.getparent().remove(drawing)
+    for rId in rIds:
+        if not doc.element.xpath(f'//a:blip[@r:embed="{rId}"]'):
+            doc.part.drop_rel(rId)
+
+
+def section_end_paragraph(sectPr=None):
+    """Returns an empty paragraph of SECTION_END_HEIGHT, ending a section if `sectPr` is given."""
+    paragraph = OxmlElement("w:p")
+    pPr = paragraph.get_or_add_pPr()
+    spacing = OxmlElement("w:spacing")
+    spacing.set(qn("w:before"), "0")
+    spacing.set(qn("w:after"), "0")
+    spacing.set(qn("w:line"), str(SECTION_END_HEIGHT))
+    spacing.set(qn("w:lineRule"), "exact")
+    pPr.append(spacing)
+    rPr = OxmlElement("w:rPr")
+    size = OxmlElement("w:sz")
+    size.set(qn("w:val"), "2")
+    rPr.append(size)
+    pPr.append(rPr)
+    if sectPr is not None:
+        pPr.append(sectPr)
+    return paragraph
+
+
+def table_offset(tbl):
+    """Returns the distance from the left margin to the left edge of the cells of `tbl`, in twips."""
+    offset = -DEFAULT_CELL_MARGIN
+    indent = tbl.tblPr.find(qn("w:tblInd"))
+    if indent is not None and indent.get(qn("w:type"), "dxa") == "dxa":
+        offset += int(indent.get(qn("w:w"), 0))
+    margin = tbl.tblPr.find(f"{qn('w:tblCellMar')}/{qn('w:left')}")
+    if margin is not None and margin.get(qn("w:type"), "dxa") == "dxa":
+        offset += DEFAULT_CELL_MARGIN - int(margin.get(qn("w:w"), 0))
+    return offset
+
+
+def draw_page_backgrounds(doc, backgrounds, per_page=0):
+    """Draws the backgrounds of the certificates once per page layout instead of behind every row.
+
+    `backgrounds` holds a PageBackground for every table of the body. Each
+    table is laid out as rows of one fixed height, as many to a page as the
+    picture allows (at most `per_page` if set), and gets sections of its own:
+    one for its full pages and one for the last page, if that is not full.
+    The header of every section draws the background once per row slot of
+    the page, so the document holds one set of pictures per section rather
+    than one picture per student. Replaces impose for these documents.
+    """
+    body = doc.element.body
+    tables = list(body.iterchildren(qn("w:tbl")))
+    if len(tables) != len(backgrounds):
+        raise ValueError(f"The document has {len(tables)} tables, {len(backgrounds)} backgrounds")
+    # page breaks between the tables are replaced by the section breaks
+    for child in list(body):
+        if child.tag not in (qn("w:tbl"), qn("w:sectPr")):
+            body.remove(child)
+    final = body.sectPr
+    for reference in final.findall(qn("w:headerReference")):
+        final.remove(reference)
+    section = doc.sections[-1]
+    usable = section.page_height.twips - section.top_margin.twips - section.bottom_margin.twips
+
+    # (table, background, rows on a page of the section, row height) of every section
+    sections = []
+    for tbl, background in zip(tables, backgrounds):
+        # a floating table would be positioned apart from the row slots
+        for position in tbl.tblPr.findall(qn("w:tblpPr")):
+            tbl.tblPr.remove(position)
+        rows_per_page = max(1, usable // background.height.twips)
+        if per_page:
+            rows_per_page = min(per_page, rows_per_page)
+        pitch = (usable - SECTION_END_HEIGHT) // rows_per_page
+        rows = tbl.tr_lst
+        for tr in rows:
+            trPr = tr.get_or_add_trPr()
+            trPr.trHeight_val = Twips(pitch)
+            trPr.trHeight_hRule = WD_ROW_HEIGHT_RULE.EXACTLY
+        full = len(rows) - len(rows) % rows_per_page
+        if 0 < full < len(rows):
+            last_page = OxmlElement("w:tbl")
+            last_page.append(copy.deepcopy(tbl.tblPr))
+            last_page.append(copy.deepcopy(tbl.tblGrid))
+            last_page.extend(rows[full:])
+            tbl.addnext(last_page)
+            sections.append((tbl, background, rows_per_page, pitch))
+            sections.append((last_page, background, len(rows) - full, pitch))
+        else:
+            sections.append((tbl, background, min(len(rows), rows_per_page), pitch))
+
+    for tbl, *_ in sections[:-1]:
+        tbl.addnext(section_end_paragraph(copy.deepcopy(final)))
+    sections[-1][0].addnext(section_end_paragraph())
+
+    for section, (tbl, background, slots, pitch) in zip(doc.sections, sections):
+        section.header_distance = 0
+        header = section.header
+        header.is_linked_to_previous = False
+        # the header must not push the rows down
+        paragraph = header.paragraphs[0]
+        paragraph.paragraph_format.space_before = 0
+        paragraph.paragraph_format.space_after = 0
+        paragraph.paragraph_format.line_spacing = Twips(SECTION_END_HEIGHT)
+        picture_path = images.prepare_background(background.picture, background.width, background.height)
+        left = section.left_margin + Twips(table_offset(tbl))
+        for slot in range(slots):
+            picture.add_float_picture(
+                paragraph,
+                picture_path,
+                width=background.width,
+                height=background.height,
+                pos_x=left,
+                pos_y=section.top_margin + Twips(slot * pitch),
+            )
+        # picture counts the shape ids per part, they have to be unique in the whole document
+        for docPr in header._element.iter(qn("wp:docPr")):
+            docPr.id = picture.next_shape_id(doc.part)
+    return doc
+
+
+def create_confirmation_page(replacement_dict, students, picture_path=CONFIRMATION_PAGE_BACKGROUND, batch=False, row_backgrounds=True):
+    if not students:
+        return Document()
+    if batch:
+        doc = finish_merged_batch(
+            render_batch("templates/milana_conf_page.docx", replacement_dict, students)
+        )
+        if row_backgrounds:
+            for table in doc.tables:
+                add_row_backgrounds(table, picture_path, CONFIRMATION_HEIGHT, CONFIRMATION_WIDTH)
+        return doc
+
+    merged_doc = Document()
+    merged_doc = utils.fit_more_rows(merged_doc)
+    utils.set_default_font(merged_doc)
+
+    merged_table = merged_doc.add_table(rows=len(students), cols=2)
+    merged_tractor_table = merged_doc.add_table(rows=len(students), cols=2)
+
+    if not row_backgrounds:
+        picture_path = None
+    front = RowCloner(merged_table, picture_path, picture_height=CONFIRMATION_HEIGHT, picture_width=CONFIRMATION_WIDTH)
+    back = RowCloner(merged_tractor_table, picture_path, picture_height=CONFIRMATION_HEIGHT, picture_width=CONFIRMATION_WIDTH)
+    curr_index = 0
+    for student_index, student in enumerate(students):
+        with tracing.span("student", student=student_index):
+            local_dict = make_student_copy(replacement_dict, student)
+
+            tables = template_cache.render_tables("templates/milana_conf_page.docx", local_dict)
+
+            front.add(tables[0], curr_index)
+            back.add(tables[1], curr_index)
+            curr_index += 1
+
+    return merged_doc
+
+def copy_text_and_formatting(source_cell, target_cell):
+    utils.copy_cell_properties(source_cell, target_cell)
+
+    for p_i, paragraph in enumerate(source_cell.paragraphs):
+        if paragraph.text.strip() == "": 
+            continue
+        if p_i == 0: 
+            new_paragraph = target_cell.paragraphs[0]  # Use the existing empty paragraph
+        else:
+            new_paragraph = target_cell.add_paragraph()
+        new_paragraph.paragraph_format.space_before = Pt(0)
+        new_paragraph.paragraph_format.space_after = Pt(0)
+        new_paragraph.alignment = paragraph.alignment
+        new_paragraph.paragraph_format.left_indent = paragraph.paragraph_format.left_indent
+
+        for run in paragraph.runs:
+            new_run = new_paragraph.add_run(run.text)
+            slots = placeholders.parse(run.text)
+            if slots:
+                placeholders.fill(new_run, slots)
+                continue
+            utils.preserve_formatting(new_run, run) 
+
+def maybe_add_nested_table(cell, target_cell): 
+    if len(cell.tables) > 0: 
+        # for now just copy the first one
+        # Set "Spacing After" for the last paragraph to 0
+        last_paragraph = target_cell.paragraphs[-1]
+        last_paragraph.paragraph_format.space_after = Pt(0) 
+        
+        nested_table = cell.tables[0] 
+        new_table = target_cell.add_table(rows=len(nested_table.rows), cols=len(nested_table.columns))
+        new_table.alignment = WD_TABLE_ALIGNMENT.CENTER 
+        for r_i, rw in enumerate(nested_table.rows):
+            for c_i, cll in enumerate(rw.cells):
+                copy_text_and_formatting(cll, new_table.cell(r_i, c_i))
+
+def add_table(merged_table, curr_row, curr_col, table): 
+    for row_index, row in enumerate(table.rows):
+        merged_table.rows[curr_row].height = Inches(2.76)
+        for col_index, cell in enumerate(row.cells):
+            target_cell = merged_table.cell(curr_row, curr_col)
+            target_cell.width = Inches(3.84)
+            # add tables too! 
+            copy_text_and_formatting(cell, target_cell)
+            maybe_add_nested_table(cell, target_cell)
+
+
+def create_certificate_for_labour_protection(replacement_dict, students, batch=False):
+    if not students:
+        return Document()
+    if batch:
+        return finish_merged_batch(
+            render_batch(
+                "templates/labour_protection.docx",
+                replacement_dict,
+                students,
+                per_row=2,
+                separator=PAGE_BREAK,
+            )
+        )
+
+    merged_doc = Document()
+    merged_doc = utils.fit_more_rows(merged_doc)
+    utils.set_default_font(merged_doc)
+
+    num_rows = math.ceil(len(students) / 2)
+
+    merged_table_front = merged_doc.add_table(rows=num_rows, cols=2)
+    merged_table_front.style = "TableGrid"
+    merged_doc.add_page_break()
+    merged_table_back = merged_doc.add_table(rows=num_rows, cols=2)
+
+    curr_row = 0
+    curr_col = 0 
+    for student_index, student in enumerate(students):
+        with tracing.span("student", student=student_index):
+            local_dict = make_student_copy(replacement_dict, student)
+
+            tables = template_cache.render_tables("templates/labour_protection.docx", local_dict)
+
+            # Copy content from the template document to the target cell
+
+            add_table(merged_table_front, curr_row, curr_col, tables[0])
+            add_table(merged_table_back, curr_row, curr_col, tables[1])
+
+            # Update cell indices for the next student
+            curr_col += 1 
+            if curr_col == 2:  
+                curr_col = 0
+                curr_row += 1 
+    return merged_doc
+
+def create_certificate(replacement_dict, students, batch=False, row_backgrounds=True):
+    if not students:
+        return Document()
+    if batch:
+        # the template row already carries the background picture, see
+        # template_cache.CompiledTemplate.shrink_backgrounds
+        final_doc = render_batch("templates/свидетельство.docx", replacement_dict, students)
+        utils.set_default_font(final_doc, bold=True)
+        if not row_backgrounds:
+            remove_row_backgrounds(final_doc, final_doc.tables[0])
+        return final_doc
+
+    all_paragraphs = []
+    for student_index, student in enumerate(students[1:], start=1):
+        with tracing.span("student", student=student_index):
+            local_dict = make_student_copy(replacement_dict, student)
+
+            tables = template_cache.render_tables("templates/свидетельство.docx", local_dict)
+
+            paragraphs = tables[0].cell(0, 0).paragraphs
+            all_paragraphs.append(paragraphs)
+
+    # Create final document using the first student's data as a base
+    final_doc = template_cache.load_template("templates/свидетельство.docx")
+    local_dict = replacement_dict.copy()
+    local_dict[NAME_KEY] = students[0].name
+    local_dict[CERTIFICATE_KEY] = students[0].cert_number
+    final_doc.render(local_dict)
+
+    # Set default font style
+    utils.set_default_font(final_doc, bold=True)
+
+    # Get the table and add rows for each additional student
+    table = final_doc.tables[0]
+    # every row gets a copy of the background drawing of the template row, so the
+    # document embeds one picture, resampled when the template was compiled
+    background = next(table._tbl.iter(qn("wp:anchor"))).getparent()
+    for paragraphs in all_paragraphs:
+        row = table.add_row()
+        # this ensure that the rows are not split between pages https://github.com/python-openxml/python-docx/issues/245
+        trPr = row._tr.get_or_add_trPr()
+        trPr.append(OxmlElement("w:cantSplit"))
+
+        target_cell = row.cells[0]
+        source_cell = table.cell(0, 0)  # Use the first cell as a template
+
+        # Copy cell properties from the template cell
+        utils.copy_cell_properties(source_cell, target_cell)
+
+        # Add paragraphs and runs to the new cell, copying formatting
+        for p_i, paragraph in enumerate(paragraphs):
+            if p_i == 0: 
+                new_paragraph = target_cell.paragraphs[0]
+            else: 
+                new_paragraph = target_cell.add_paragraph()
+            source_paragraph = source_cell.paragraphs[p_i]
+            if p_i == 0 and row_backgrounds:
+                drawing = copy.deepcopy(background)
+                # drawing ids have to be unique within the document
+                docPr = next(drawing.iter(qn("wp:docPr")))
+                shape_id = picture.next_shape_id(final_doc.part)
+                docPr.set("id", str(shape_id))
+                docPr.set("name", "Picture %d" % shape_id)
+                new_paragraph.add_run()._r.append(drawing)
+
+            new_paragraph.alignment = source_paragraph.alignment
+            new_paragraph.paragraph_format.left_indent = (
+                source_paragraph.paragraph_format.left_indent
+            )
+            for target_run, source_run in zip(paragraph.runs, source_paragraph.runs):
+                new_run = new_paragraph.add_run(target_run.text)
+                utils.preserve_formatting(new_run, source_run)
+    if not row_backgrounds:
+        # the first row comes from the template, with its background
+        remove_row_backgrounds(final_doc, table)
+    return final_doc
+
+
+class RowPrototype:
+    """The layout of the rows of a rendered template table.
+
+    Every student's copy of a template has the same structure, only the text
+    differs. So the cells holding nested tables and the image slots are
+    located once, in the first copy, and then looked up by position in the
+    copies of the other students.
+    """
+
+    def __init__(self, tbl):
+        self.rows = [self.analyse_row(tr) for tr in tbl.tr_lst]
+
+    @staticmethod
+    def analyse_row(tr):
+        """Returns (indices of cells with nested tables, SlotIndex) of a w:tr element."""
+        nested_cells = [
+            col_index
+            for col_index, tc in enumerate(tr.tc_lst)
+            if tc.find(".//w:tbl", namespaces=tc.nsmap) is not None
+        ]
+        return nested_cells, placeholders.SlotIndex(tr)
+
+    def layout(self, tbl):
+        rows = tbl.tr_lst
+        if len(rows) != len(self.rows):
+            return RowPrototype(tbl).rows
+        return self.rows
+
+
+class RowCloner:
+    """Copies rendered template tables into `merged_table`, one student per row.
+
+    The rows of the merged table are looked up once, and the layout of the
+    template rows comes from a RowPrototype, so adding a student is one
+    deepcopy per template row plus filling the image slots. The background
+    picture, if any, is floated behind the first cell of every row.
+    """
+
+    def __init__(self, merged_table, picture_path=None, picture_height=None, picture_width=None):
+        self.table = merged_table
+        self.rows = merged_table._tbl.tr_lst
+        self.prototype = None
+        self.picture_height = picture_height
+        self.picture_width = picture_width
+        self.picture_path = (
+            images.prepare_background(picture_path, picture_width, picture_height)
+            if picture_path
+            else None
+        )
+
+    def add(self, tbl, curr_index):
+        """Copies the rows of the template table `tbl` into the merged rows from `curr_index` on."""
+        source = tbl._tbl
+        if self.prototype is None:
+            for element_name in ["w:tblGrid", "w:tblPr"]:
+                utils.copy_table_element(source, self.table._tbl, element_name)
+            self.prototype = RowPrototype(source)
+
+        for source_row, (nested_cells, slot_index) in zip(
+            source.tr_lst, self.prototype.layout(source)
+        ):
+            target_row = self.rows[curr_index]
+            utils.addTrPr(source_row, target_row)
+
+            source_cells = source_row.tc_lst
+            for col_index in nested_cells:
+                utils.update_nested_table_styles(source_cells[col_index], source_row)
+
+            clone = copy.deepcopy(source_row)
+            slots = slot_index.runs(clone)
+            for col_index, cell in enumerate(clone.tc_lst):
+                target_row[col_index].extend(list(cell))
+            placeholders.fill_runs(slots, self.table)
+
+            first_cell = _Cell(target_row.tc_lst[0], self.table)
+            curr_index += 1
+            p = first_cell.add_paragraph()
+            if self.picture_path:
+                picture.add_float_picture(
+                    p,
+                    self.picture_path,
+                    height=self.picture_height,
+                    width=self.picture_width,
+                    pos_x=Pt(0),
+                    pos_y=Pt(0),
+                )
+
+
+@dataclass(frozen=True)
+class TractorVariant:
+    """What sets one colour of the tractor certificates apart from the others."""
+
+    picture_front: str
+    picture_back: str
+    # replaces the student_profession of the group if set
+    profession: str = None
+
+    @property
+    def page_backgrounds(self):
+        """The backgrounds of the front and back tables, see draw_page_backgrounds."""
+        return (
+            PageBackground(self.picture_front, TRACTOR_CERT_WIDTH, TRACTOR_CERT_HEIGHT),
+            PageBackground(self.picture_back, TRACTOR_CERT_WIDTH, TRACTOR_CERT_HEIGHT),
+        )
+
+
+BLUE_TRACTOR = TractorVariant(
+    "pictures/tractor-background-blue.png",
+    "pictures/tractor-background-blue-with-tractor.png",
+)
+GREEN_TRACTOR = TractorVariant(
+    "pictures/tractor-background-green.png",
+    "pictures/tractor-background-green-with-tractor.png",
+    profession=TRACTOR_PROFESSION_WORDING,
+)
+
+# rendered in place of student_profession, see apply_tractor_variant
+PROFESSION_MARK = "@@student_profession@@"
+# tractor bases kept per process, one is enough to build both colours of a group
+TRACTOR_BASES = 2
+
+_tractor_bases = OrderedDict()
+_tractor_lock = threading.Lock()
+
+
+def build_tractor_base(replacement_dict, students, batch=False):
+    """Builds the tractor certificates shared by all variants: no backgrounds, PROFESSION_MARK for the profession."""
+    replacement_dict = dict(replacement_dict, student_profession=PROFESSION_MARK)
+    if batch:
+        doc = finish_merged_batch(
+            render_batch(
+                "templates/certificate_tractor.docx",
+                replacement_dict,
+                students,
+                separator=PAGE_BREAK,
+            )
+        )
+        return doc
+
+    merged_doc = Document()
+    merged_doc = utils.fit_more_rows(merged_doc)
+    utils.set_default_font(merged_doc)
+
+    merged_table = merged_doc.add_table(rows=len(students), cols=2)
+    merged_doc.add_page_break()
+    merged_tractor_table = merged_doc.add_table(rows=len(students), cols=2)
+
+    front = RowCloner(merged_table)
+    back = RowCloner(merged_tractor_table)
+    curr_index = 0
+    for student_index, student in enumerate(students):
+        with tracing.span("student", student=student_index):
+            local_dict = make_student_copy(replacement_dict, student)
+
+            tables = template_cache.render_tables("templates/certificate_tractor.docx", local_dict)
+
+            front.add(tables[0], curr_index)
+            back.add(tables[1], curr_index)
+            curr_index += 1
+
+    return merged_doc
+
+
+def tractor_base(replacement_dict, students, batch=False):
+    """Returns the tractor base of the group, built only once for all variants.
+
+    The base is kept as .docx bytes, the later calls open a fresh document from them.
+    """
+    shared = {key: value for key, value in replacement_dict.items() if key != "student_profession"}
+    key = (
+        template_cache.context_key(shared),
+        tuple(tuple(student_values(student).values()) for student in students),
+        batch,
+    )
+    with _tractor_lock:
+        data = _tractor_bases.get(key)
+        if data is not None:
+            _tractor_bases.move_to_end(key)
+    if data is not None:
+        return Document(BytesIO(data))
+
+    doc = build_tractor_base(replacement_dict, students, batch)
+    buffer = BytesIO()
+    doc.save(buffer)
+    with _tractor_lock:
+        _tractor_bases[key] = buffer.getvalue()
+        while len(_tractor_bases) > TRACTOR_BASES:
+            _tractor_bases.popitem(last=False)
+    return doc
+
+
+def clear_tractor_bases():
+    with _tractor_lock:
+        _tractor_bases.clear()
+
+
+def float_background(paragraph, picture_path):
+    picture.add_float_picture(
+        paragraph,
+        picture_path,
+        height=TRACTOR_CERT_HEIGHT,
+        width=TRACTOR_CERT_WIDTH,
+        pos_x=Pt(0),
+        pos_y=Pt(0),
+    )
+
+
+def apply_tractor_variant(doc, replacement_dict, variant, batch=False, row_backgrounds=True):
+    """Turns a copy of the tractor base into the certificates of `variant`."""
+    profession = variant.profession
+    if profession is None:
+        profession = replacement_dict.get("student_profession", "")
+    for t in doc.element.body.iter(qn("w:t")):
+        if t.text and PROFESSION_MARK in t.text:
+            t.text = t.text.replace(PROFESSION_MARK, str(profession))
+    if not row_backgrounds:
+        return doc
+
+    front_table, back_table = doc.tables
+    if batch:
+        add_row_backgrounds(front_table, variant.picture_front, TRACTOR_CERT_HEIGHT, TRACTOR_CERT_WIDTH)
+        add_row_backgrounds(back_table, variant.picture_back, TRACTOR_CERT_HEIGHT, TRACTOR_CERT_WIDTH)
+        return doc
+
+    # the merged rows end with an empty paragraph for the background, see RowCloner
+    picture_front = images.prepare_background(variant.picture_front, TRACTOR_CERT_WIDTH, TRACTOR_CERT_HEIGHT)
+    picture_back = images.prepare_background(variant.picture_back, TRACTOR_CERT_WIDTH, TRACTOR_CERT_HEIGHT)
+    for front_row, back_row in zip(front_table._tbl.tr_lst, back_table._tbl.tr_lst):
+        float_background(_Cell(front_row.tc_lst[0], front_table).paragraphs[-1], picture_front)
+        float_background(_Cell(back_row.tc_lst[0], back_table).paragraphs[-1], picture_back)
+    return doc
+
+
+def create_tractor_certificate(replacement_dict, students, variant, batch=False, row_backgrounds=True):
+    if not students:
+        return Document()
+    doc = tractor_base(replacement_dict, students, batch)
+    return apply_tractor_variant(doc, replacement_dict, variant, batch, row_backgrounds)
+
+
+def create_height_certificate(replacement_dict, students, batch=False):
+    if not students:
+        return Document()
+    if batch:
+        return finish_merged_batch(
+            render_batch("templates/height_certificate.docx", replacement_dict, students)
+        )
+
+    merged_doc = Document()
+    merged_doc = utils.fit_more_rows(merged_doc)
+    utils.set_default_font(merged_doc)
+
+    merged_table = merged_doc.add_table(rows=len(students), cols=3)
+
+    cloner = RowCloner(merged_table)
+    curr_index = 0
+    for student_index, student in enumerate(students):
+        with tracing.span("student", student=student_index):
+            local_dict = make_student_copy(replacement_dict, student)
+
+            tables = template_cache.render_tables("templates/height_certificate.docx", local_dict)
+
+            cloner.add(tables[0], curr_index)
+            curr_index += 1
+
+    return merged_doc
+
+
+def create_blue_tractor_certificate(replacement_dict, students, batch=False, row_backgrounds=True):
+    return create_tractor_certificate(
+        replacement_dict, students, BLUE_TRACTOR, batch=batch, row_backgrounds=row_backgrounds
+    )
+
+
+def create_green_tractor_certificate(replacement_dict, students, batch=False, row_backgrounds=True):
+    return create_tractor_certificate(
+        replacement_dict, students, GREEN_TRACTOR, batch=batch, row_backgrounds=row_backgrounds
+    )
+
+
+def create_tractor_certs(dict, students):
+    blue = create_blue_tractor_certificate(dict, students)
+    green = create_green_tractor_certificate(dict, students)
+    return (blue, green)
+
+
+# the columns of the student tables, see streaming.row_values
+BEGINNING_COLUMNS = ("index", "student.name", "student_company")
+END_COLUMNS = ("index", "student.name", "student_company", "student.cert_number")
+PROTOCOL_COLUMNS = ("index", "student.name", "student_company", "student.cert_number")
+LABOUR_PROTECTION_COLUMNS = ("index", "student.name", "student.role", "student_company", "", "end_date")
+
+
+def create_table_document(template_path, columns, replacement_dict, students):
+    """Renders the template and fills its first table with a row per student, laid out by `columns`."""
+    doc = template_cache.load_template(template_path)
+    doc.render(replacement_dict)
+    utils.set_default_font(doc)
+    return streaming.fill_table(doc, doc.tables[0], columns, students, replacement_dict)
+
+
+def create_beginning_document(beginning_dict, students):
+    """Creates a Word document with the provided information."""
+    return create_table_document(
+        "templates/Приказ о начале.docx", BEGINNING_COLUMNS, beginning_dict, students
+    )
+
+
+def create_end_doc(replacement_dict, students):
+    """Creates a Word document with the provided information."""
+    return create_table_document(
+        "templates/Приказ о выпуске.docx", END_COLUMNS, replacement_dict, students
+    )
+
+
+def create_protocol_doc(replacement_dict, students):
+    """Creates a Word document with the provided information."""
+    return create_table_document(
+        "templates/Протокол.docx", PROTOCOL_COLUMNS, replacement_dict, students
+    )
+
+
+def create_labour_protection_protocol(replacement_dict, students):
+    """Creates a Word document with the provided information."""
+    return create_table_document(
+        "templates/protocol_milana.docx", LABOUR_PROTECTION_COLUMNS, replacement_dict, students
+    )
@@ -0,0 +1,518 @@
+import documents
+import images
+import utils
+import tracing
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from dataclasses import dataclass
+from typing import Callable
+from dateutil.relativedelta import relativedelta
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class DocumentSpec:
+    key: str
+    title: str
+    filename: str
+    build: Callable
+    # replacement_dict keys and utils.Student fields the document is built from
+    fields: tuple
+    student_fields: tuple
+    # whether the builder accepts batch=True, see documents.render_batch. These
+    # are the per-student certificates, which can also be split by Layout.
+    batchable: bool = False
+    # template and picture files the document is built from, see part_key
+    assets: tuple = ()
+    # a documents.PageBackground per table if the builder accepts row_backgrounds=False,
+    # see Layout.page_backgrounds
+    page_backgrounds: tuple = ()
+    # specs with the same build_group share work within a process (the tractor
+    # base), so iter_documents builds their files of the same students in one task
+    build_group: str = ""
+
+
+@dataclass(frozen=True)
+class Layout:
+    """Layout of the per-student certificates."""
+
+    # students per file, 0 puts the whole group into one file
+    chunk_size: int = 0
+    # certificate rows per page (N-up), at most as many as fit; 0 lets them flow, see documents.impose
+    per_page: int = 0
+    # draw the backgrounds in the page headers, once per page layout instead of
+    # behind every certificate, see documents.draw_page_backgrounds
+    page_backgrounds: bool = False
+
+
+DEFAULT_LAYOUT = Layout()
+
+
+@dataclass(frozen=True)
+class Part:
+    """One generated file; a document split by Layout.chunk_size has several."""
+
+    key: str
+    index: int
+    filename: str
+    data: bytes
+
+
+DOCUMENT_SPECS = [
+    DocumentSpec(
+        key="beginning",
+        title="Приказ о начале",
+        filename="Приказ о начале.docx",
+        build=documents.create_beginning_document,
+        fields=("beginning_date", "beginning_number", "student_profession", "teacher_name", "student_company"),
+        student_fields=("name",),
+        assets=("templates/Приказ о начале.docx",),
+    ),
+    DocumentSpec(
+        key="end",
+        title="Приказ об окончании",
+        filename="Приказ о выпуске.docx",
+        build=documents.create_end_doc,
+        fields=("end_date", "end_number", "num_students", "student_profession", "teacher_name", "student_company"),
+        student_fields=("name", "cert_number"),
+        assets=("templates/Приказ о выпуске.docx",),
+    ),
+    DocumentSpec(
+        key="protocol",
+        title="Протокол",
+        filename="Протокол.docx",
+        build=documents.create_protocol_doc,
+        fields=("end_date", "end_number", "student_profession", "teacher_name", "student_company"),
+        student_fields=("name", "cert_number"),
+        assets=("templates/Протокол.docx",),
+    ),
+    DocumentSpec(
+        key="certificate",
+        title="Свидетельство",
+        filename="Свидетельство.docx",
+        build=documents.create_certificate,
+        fields=("beginning_date", "end_date", "student_profession", "class", "year"),
+        student_fields=("name", "cert_number"),
+        batchable=True,
+        assets=("templates/свидетельство.docx", "pictures/basic-cert-background.png"),
+        page_backgrounds=documents.CERTIFICATE_BACKGROUNDS,
+    ),
+    DocumentSpec(
+        key="tractor_blue",
+        title="Свидетельство тракторов синее",
+        filename="Свидетельство синее трактор.docx",
+        build=documents.create_blue_tractor_certificate,
+        fields=("beginning_date", "end_date", "student_profession", "class", "year"),
+        student_fields=("name", "cert_number", "machine_category"),
+        batchable=True,
+        assets=(
+            "templates/certificate_tractor.docx",
+            "pictures/tractor-background-blue.png",
+            "pictures/tractor-background-blue-with-tractor.png",
+        ),
+        page_backgrounds=documents.BLUE_TRACTOR.page_backgrounds,
+        build_group="tractor",
+    ),
+    DocumentSpec(
+        key="tractor_green",
+        title="Свидетельство тракторов зеленое",
+        filename="Свидетельство зеленое трактор.docx",
+        build=documents.create_green_tractor_certificate,
+        # student_profession is always replaced by TRACTOR_PROFESSION_WORDING
+        fields=("beginning_date", "end_date", "class", "year"),
+        student_fields=("name", "cert_number", "machine_category"),
+        batchable=True,
+        assets=(
+            "templates/certificate_tractor.docx",
+            "pictures/tractor-background-green.png",
+            "pictures/tractor-background-green-with-tractor.png",
+        ),
+        page_backgrounds=documents.GREEN_TRACTOR.page_backgrounds,
+        build_group="tractor",
+    ),
+    DocumentSpec(
+        key="confirmation_page",
+        title="Милана удостоверение",
+        filename="Удостоверение Милана.docx",
+        build=documents.create_confirmation_page,
+        fields=("beginning_date", "end_date", "end_number", "hours", "student_profession", "year"),
+        student_fields=("name", "cert_number"),
+        batchable=True,
+        assets=(
+            "templates/milana_conf_page.docx",
+            documents.CONFIRMATION_PAGE_BACKGROUND,
+            images.NAMED_IMAGES["prof_educ_logo"],
+        ),
+        page_backgrounds=documents.CONFIRMATION_BACKGROUNDS,
+    ),
+    DocumentSpec(
+        key="labour_protection_certificate",
+        title="Милана св-во охрана труда",
+        filename="Свидетельство Милана.docx",
+        build=documents.create_certificate_for_labour_protection,
+        fields=("end_date", "end_number", "hours", "student_profession", "student_company"),
+        student_fields=("name", "cert_number", "role"),
+        batchable=True,
+        assets=("templates/labour_protection.docx", images.NAMED_IMAGES["prof_educ_logo"]),
+    ),
+    DocumentSpec(
+        key="labour_protection_protocol",
+        title="Милана протокол охрана труда",
+        filename="Протокол Милана.docx",
+        build=documents.create_labour_protection_protocol,
+        fields=("end_date", "end_number", "hours", "student_profession", "teacher_name", "student_company"),
+        student_fields=("name", "role"),
+        assets=("templates/protocol_milana.docx",),
+    ),
+    DocumentSpec(
+        key="height_certificate",
+        title="На высоте",
+        filename="На высоте.docx",
+        build=documents.create_height_certificate,
+        fields=("end_date", "end_number", "expiration_date", "student_company", "year"),
+        student_fields=("name", "cert_number", "role"),
+        batchable=True,
+        assets=("templates/height_certificate.docx",),
+    ),
+]
+
+
+SPECS_BY_KEY = {spec.key: spec for spec in DOCUMENT_SPECS}
+
+# Number of worker processes used by default, one per document at most.
+DEFAULT_WORKERS = min(len(DOCUMENT_SPECS), os.cpu_count() or 1)
+
+
+def build_replacement_dict(
+    profession,
+    teacher_name,
+    company,
+    beginning_date,
+    end_date,
+    beginning_number,
+    end_number,
+    num_students,
+):
+    """Returns the template values shared by all documents of a group."""
+    replacement_dict = {
+        "beginning_date": utils.format_date(beginning_date),
+        "beginning_number": beginning_number,
+        "end_date": utils.format_date(end_date),
+        "end_number": end_number,
+        "student_company": company,
+        "teacher_name": teacher_name,
+        "num_students": num_students,
+        "class": "4",
+        "year": beginning_date.year,
+        "expiration_date": utils.format_date((end_date + relativedelta(years=3))),
+    }
+    if profession: 
+        if profession.hours_str:
+            replacement_dict['hours'] = profession.hours_str
+        if profession.formatted_profession: 
+            replacement_dict['student_profession'] = profession.formatted_profession
+    return replacement_dict
+
+
+def document_to_bytes(doc):
+    buffer = BytesIO()
+    with tracing.span("save"):
+        doc.save(buffer)
+    return buffer.getvalue()
+
+
+def split_parts(spec, students, layout=DEFAULT_LAYOUT):
+    """Returns [(filename, students)] of the files the document of `spec` is written to."""
+    size = layout.chunk_size
+    if not spec.batchable or not size or len(students) <= size:
+        return [(spec.filename, students)]
+    stem, extension = os.path.splitext(spec.filename)
+    parts = []
+    for start in range(0, len(students), size):
+        chunk = students[start:start + size]
+        numbers = f"{start + 1}-{start + len(chunk)}" if len(chunk) > 1 else f"{start + 1}"
+        parts.append((f"{stem} {numbers}{extension}", chunk))
+    return parts
+
+
+# Bump when a change to the builders changes their output for the same inputs.
+OUTPUT_VERSION = 6
+
+
+def header_backgrounds(spec, layout):
+    """Returns whether the backgrounds of `spec` are drawn in the page headers."""
+    return bool(layout.page_backgrounds and spec.page_backgrounds)
+
+
+def part_key(spec, replacement_dict, students, batch=False, layout=DEFAULT_LAYOUT):
+    """Returns the output_cache key of one file: a hash of everything it is built from."""
+    description = [
+        OUTPUT_VERSION,
+        spec.key,
+        [images.file_digest(path) for path in spec.assets],
+        images.encoding_settings(),
+        [replacement_dict.get(field) for field in spec.fields],
+        [[getattr(student, field) for field in spec.student_fields] for student in students],
+        bool(batch and spec.batchable),
+        layout.per_page if spec.batchable else 0,
+        header_backgrounds(spec, layout),
+    ]
+    encoded = json.dumps(description, ensure_ascii=False, default=str).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def build_document(spec, replacement_dict, students, batch=False, layout=DEFAULT_LAYOUT):
+    with tracing.span("build", document=spec.key):
+        options = {}
+        if batch and spec.batchable:
+            options["batch"] = True
+        if header_backgrounds(spec, layout):
+            options["row_backgrounds"] = False
+        doc = spec.build(replacement_dict, students, **options)
+        if header_backgrounds(spec, layout):
+            doc = documents.draw_page_backgrounds(doc, spec.page_backgrounds, layout.per_page)
+        elif layout.per_page and spec.batchable:
+            doc = documents.impose(doc, layout.per_page)
+        return doc
+
+
+def build_serialized(key, replacement_dict, students, batch=False, trace=False, layout=DEFAULT_LAYOUT):
+    """Builds the document of spec `key` and returns it as .docx bytes. Runs in the worker processes.
+
+    With trace=True returns (bytes, trace events recorded in the worker).
+    """
+    spec = SPECS_BY_KEY[key]
+    if not trace:
+        return document_to_bytes(
+            build_document(spec, replacement_dict, students, batch, layout)
+        )
+    with tracing.record() as worker_trace:
+        with tracing.span("document", document=key):
+            data = document_to_bytes(
+                build_document(spec, replacement_dict, students, batch, layout)
+            )
+    return data, worker_trace.events
+
+
+def build_serialized_group(
+    keys, replacement_dict, students, batch=False, trace=False, layout=DEFAULT_LAYOUT
+):
+    """Builds the documents of specs `keys` one after another in one worker, see DocumentSpec.build_group.
+
+    Returns the list of their bytes, with trace=True (that list, trace events).
+    """
+    results = [
+        build_serialized(key, replacement_dict, students, batch, trace, layout) for key in keys
+    ]
+    if not trace:
+        return results
+    return [data for data, _ in results], [event for _, events in results for event in events]
+
+
+def group_tasks(tasks):
+    """Returns the (spec, index, filename, chunk, key) tasks in lists of those built together."""
+    groups = {}
+    for task in tasks:
+        spec, index = task[0], task[1]
+        groups.setdefault((spec.build_group or spec.key, index), []).append(task)
+    return list(groups.values())
+
+
+_pool = None
+_pool_workers = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(max_workers):
+    """Returns the process-wide worker pool, so that workers keep their template and image caches warm."""
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != max_workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            # spawn: forking the threaded Streamlit server is not safe
+            _pool = ProcessPoolExecutor(
+                max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")
+            )
+            _pool_workers = max_workers
+        return _pool
+
+
+def discard_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def iter_documents(
+    specs,
+    replacement_dict,
+    students,
+    batch=False,
+    max_workers=1,
+    layout=DEFAULT_LAYOUT,
+    cache=None,
+):
+    """Yields a Part for every file of every spec as soon as it is built.
+
+    Files found in `cache` (an output_cache.OutputCache) come first, the
+    others are built and added to it. With max_workers > 1 the files, also
+    the chunks of one document, are built in parallel worker processes,
+    otherwise (or if the pool breaks) one after another here. The files of
+    specs sharing a build_group are built by the same worker.
+    """
+    tasks = []
+    for spec in specs:
+        for index, (filename, chunk) in enumerate(split_parts(spec, students, layout)):
+            key = None
+            if cache is not None:
+                key = part_key(spec, replacement_dict, chunk, batch, layout)
+                data = cache.get(key)
+                if data is not None:
+                    yield Part(spec.key, index, filename, data)
+                    continue
+            tasks.append((spec, index, filename, chunk, key))
+
+    def built(spec, index, filename, key, data):
+        if cache is not None:
+            cache.put(key, data)
+        return Part(spec.key, index, filename, data)
+
+    groups = group_tasks(tasks)
+    if max_workers > 1 and len(groups) > 1:
+        done = set()
+        try:
+            pool = get_pool(max_workers)
+            trace = tracing.is_enabled()
+            futures = {
+                pool.submit(
+                    build_serialized_group,
+                    [spec.key for spec, *_ in group],
+                    replacement_dict,
+                    group[0][3],
+                    batch,
+                    trace,
+                    layout,
+                ): group
+                for group in groups
+            }
+            for future in as_completed(futures):
+                results = future.result()
+                if trace:
+                    results, events = results
+                    tracing.merge(events)
+                for (spec, index, filename, chunk, key), data in zip(futures[future], results):
+                    yield built(spec, index, filename, key, data)
+                    done.add((spec.key, index))
+            return
+        except (BrokenProcessPool, OSError):
+            logger.warning("Parallel generation failed, falling back to serial", exc_info=True)
+            discard_pool()
+            tasks = [task for task in tasks if (task[0].key, task[1]) not in done]
+
+    for group in group_tasks(tasks):
+        for spec, index, filename, chunk, key in group:
+            with tracing.span("document", document=spec.key):
+                doc = build_document(spec, replacement_dict, chunk, batch, layout)
+                data = document_to_bytes(doc)
+            yield built(spec, index, filename, key, data)
+
+
+def fingerprint(spec, replacement_dict, students, layout=DEFAULT_LAYOUT):
+    """Returns a hashable value that changes only when the inputs of `spec` change.
+
+    The inputs include the templates and pictures, so an edited file is
+    picked up without a restart.
+    """
+    assets = tuple(images.file_digest(path) for path in spec.assets)
+    header = tuple(replacement_dict.get(field) for field in spec.fields)
+    rows = tuple(
+        tuple(getattr(student, field) for field in spec.student_fields)
+        for student in students
+    )
+    return (assets, header, rows, layout if spec.batchable else None)
+
+
+class GenerationPlanner:
+    """Builds documents on demand and rebuilds only those whose inputs changed.
+
+    Kept in st.session_state so that the results survive Streamlit reruns.
+    """
+
+    def __init__(self, specs=DOCUMENT_SPECS, batch=False, max_workers=1, cache=None):
+        self.specs = list(specs)
+        self.batch = batch
+        self.max_workers = max_workers
+        # shared output_cache.OutputCache, consulted before building anything
+        self.cache = cache
+        self._fingerprints = {}
+        self._outputs = {}
+        self._lock = threading.Lock()
+
+    def _selected(self, keys):
+        if keys is None:
+            return self.specs
+        return [spec for spec in self.specs if spec.key in keys]
+
+    def stale(self, replacement_dict, students, keys=None, layout=DEFAULT_LAYOUT):
+        """Returns the specs that have to be (re)built for the given inputs."""
+        return [
+            spec
+            for spec in self._selected(keys)
+            if self._fingerprints.get(spec.key)
+            != fingerprint(spec, replacement_dict, students, layout)
+        ]
+
+    def is_current(self, replacement_dict, students, keys=None, layout=DEFAULT_LAYOUT):
+        return not self.stale(replacement_dict, students, keys, layout)
+
+    def iter_generate(self, replacement_dict, students, keys=None, layout=DEFAULT_LAYOUT):
+        """Yields Parts: those of up to date documents first, rebuilt ones as they finish."""
+        with self._lock:
+            stale = self.stale(replacement_dict, students, keys, layout)
+            for spec in self._selected(keys):
+                if spec not in stale:
+                    yield from self._outputs[spec.key]
+
+            specs_by_key = {spec.key: spec for spec in stale}
+            pending = {
+                spec.key: len(split_parts(spec, students, layout)) for spec in stale
+            }
+            built = {spec.key: [] for spec in stale}
+            parts = iter_documents(
+                stale,
+                replacement_dict,
+                students,
+                self.batch,
+                self.max_workers,
+                layout,
+                self.cache,
+            )
+            for part in parts:
+                built[part.key].append(part)
+                if len(built[part.key]) == pending[part.key]:
+                    self._outputs[part.key] = sorted(built[part.key], key=lambda p: p.index)
+                    self._fingerprints[part.key] = fingerprint(
+                        specs_by_key[part.key], replacement_dict, students, layout
+                    )
+                yield part
+
+    def generate(self, replacement_dict, students, keys=None, layout=DEFAULT_LAYOUT):
+        """Returns a dict from spec key to the list of its Parts, in order."""
+        outputs = {}
+        for part in self.iter_generate(replacement_dict, students, keys, layout):
+            outputs.setdefault(part.key, []).append(part)
+        return {
+            key: sorted(parts, key=lambda part: part.index) for key, parts in outputs.items()
+        }
@@ -0,0 +1,150 @@
+import hashlib
+import os
+import threading
+from io import BytesIO
+
+from PIL import Image
+from docx.image.image import Image as DocxImage
+
+# Resolution backgrounds are resampled to for their print size.
+BACKGROUND_DPI = 150
+# Encodings tried for the resampled backgrounds, the smallest one is kept.
+BACKGROUND_FORMATS = ("png", "jpg")
+JPEG_QUALITY = 90
+CACHE_DIR = ".cache/images"
+
+# Images the templates can refer to by name, see placeholders.py
+NAMED_IMAGES = {
+    "prof_educ_logo": "pictures/professional-education-logo.png",
+}
+
+_digests = {}
+_registry = {}
+_lock = threading.Lock()
+
+
+def file_digest(path):
+    """Returns the SHA-256 of the file content, re-hashing only when the file changed on disk."""
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    with _lock:
+        entry = _digests.get(path)
+        if entry and entry[0] == signature:
+            return entry[1]
+    with open(path, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    with _lock:
+        _digests[path] = (signature, digest)
+    return digest
+
+
+def load_image(path):
+    """Returns the python-docx Image for `path`.
+
+    The file is read, hashed and its header parsed (pixel size, dpi) once per
+    process; it is loaded again only when it changes on disk.
+    """
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    with _lock:
+        entry = _registry.get(path)
+        if entry and entry[0] == signature:
+            return entry[1]
+    image = DocxImage.from_file(path)
+    image.sha1  # computed once here instead of on every lookup
+    with _lock:
+        _registry[path] = (signature, image)
+    return image
+
+
+def register_image(name, path):
+    """Makes the image at `path` available to the templates as `[[image name]]`."""
+    NAMED_IMAGES[name] = path
+
+
+def named_image(name):
+    try:
+        return NAMED_IMAGES[name]
+    except KeyError:
+        raise ValueError(f"Unknown image '{name}' in template, see images.NAMED_IMAGES") from None
+
+
+def target_pixels(length, dpi):
+    return max(1, round(length.inches * dpi))
+
+
+def encoding_settings():
+    """Returns the settings the resampled backgrounds depend on, for the keys of the caches."""
+    return (BACKGROUND_DPI, BACKGROUND_FORMATS, JPEG_QUALITY)
+
+
+def encode_smallest(image, dpi):
+    """Returns (extension, bytes) of the smallest of an optimised PNG and a JPEG.
+
+    Only the BACKGROUND_FORMATS are tried. Backgrounds are drawn behind the
+    text on a white page, so for the JPEG candidate transparency is flattened
+    onto white.
+    """
+    candidates = []
+
+    if "png" in BACKGROUND_FORMATS:
+        png = BytesIO()
+        image.save(png, format="PNG", optimize=True, dpi=(dpi, dpi))
+        candidates.append(("png", png.getvalue()))
+
+    if "jpg" in BACKGROUND_FORMATS:
+        flat = Image.new("RGB", image.size, "white")
+        if image.mode == "RGBA":
+            flat.paste(image, mask=image.getchannel("A"))
+        else:
+            flat.paste(image.convert("RGB"))
+        jpeg = BytesIO()
+        flat.save(jpeg, format="JPEG", quality=JPEG_QUALITY, optimize=True, dpi=(dpi, dpi))
+        candidates.append(("jpg", jpeg.getvalue()))
+
+    return min(candidates, key=lambda candidate: len(candidate[1]))
+
+
+def prepare_background(path, width, height, dpi=BACKGROUND_DPI):
+    """Returns the path of a copy of `path` resampled for printing at `width` x `height`.
+
+    Derivatives are cached in CACHE_DIR by source hash, target size, dpi and
+    JPEG quality.
+    Images are never upscaled. Returns `path` unchanged when `dpi` is None.
+    """
+    if dpi is None:
+        return path
+    return resampled(file_digest(path), lambda: Image.open(path), width, height, dpi)
+
+
+def prepare_embedded_background(blob, width, height, dpi=BACKGROUND_DPI):
+    """Like prepare_background, for an image embedded in a template."""
+    return resampled(
+        hashlib.sha256(blob).hexdigest(), lambda: Image.open(BytesIO(blob)), width, height, dpi
+    )
+
+
+def resampled(digest, open_source, width, height, dpi):
+    size = (target_pixels(width, dpi), target_pixels(height, dpi))
+    name = "%s_%dx%d_%d_q%d" % (digest[:16], size[0], size[1], dpi, JPEG_QUALITY)
+    for extension in BACKGROUND_FORMATS:
+        cached = os.path.join(CACHE_DIR, f"{name}.{extension}")
+        if os.path.exists(cached):
+            return cached
+
+    with open_source() as source:
+        image = source.convert("RGBA") if source.mode in ("P", "LA") else source.copy()
+    if size[0] < image.width or size[1] < image.height:
+        image = image.resize(
+            (min(size[0], image.width), min(size[1], image.height)),
+            Image.LANCZOS,
+        )
+    extension, data = encode_smallest(image, dpi)
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    cached = os.path.join(CACHE_DIR, f"{name}.{extension}")
+    tmp_path = f"{cached}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, cached)
+    return cached
@@ -0,0 +1,426 @@
+"""Persistent queue of generation jobs, run by background worker processes.
+
+A job is the request of one group: the template values, the students, the
+documents and their layout. It is stored in an SQLite database together
+with the progress of each of its documents, and the finished ZIP is written
+next to it, so a job outlives the Streamlit session and the browser tab
+that submitted it; its bundle can be downloaded until the job expires
+(JOB_TTL). The workers are separate processes, started by the app (see
+start_workers) or on their own with
+
+    python jobs.py --workers 2
+
+A worker claims the oldest queued job, builds its files one after another
+through generation.iter_documents, with the shared output cache, at a lower
+scheduling priority than the app, and records the progress after every
+file. Cancelling a queued job takes it off the queue; a running job stops
+after the file being built. Jobs of a worker that died are queued again.
+"""
+import bundle
+import generation
+import output_cache
+import utils
+
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+import traceback
+import uuid
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+
+JOBS_DIR = ".cache/jobs"
+DB_PATH = os.path.join(JOBS_DIR, "jobs.sqlite3")
+# finished jobs and their bundles are removed after this many seconds
+JOB_TTL = 7 * 24 * 3600
+POLL_INTERVAL = 1.0
+WORKER_NICENESS = 10
+DEFAULT_WORKERS = max(1, (os.cpu_count() or 1) // 2)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+SCHEMA_VERSION = 1
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    title TEXT NOT NULL,
+    request TEXT NOT NULL,
+    status TEXT NOT NULL,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    worker INTEGER,
+    error TEXT,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created);
+CREATE INDEX IF NOT EXISTS jobs_owner ON jobs (owner, created);
+CREATE TABLE IF NOT EXISTS job_documents (
+    job_id TEXT NOT NULL REFERENCES jobs (id) ON DELETE CASCADE,
+    key TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    files_done INTEGER NOT NULL DEFAULT 0,
+    files_total INTEGER NOT NULL,
+    PRIMARY KEY (job_id, key)
+)
+"""
+
+
+@dataclass
+class DocumentProgress:
+    key: str
+    title: str
+    files_done: int
+    files_total: int
+
+
+@dataclass
+class Job:
+    id: str
+    title: str
+    status: str
+    error: str
+    created: float
+    started: float
+    finished: float
+    documents: list
+
+    @property
+    def files_done(self):
+        return sum(document.files_done for document in self.documents)
+
+    @property
+    def files_total(self):
+        return sum(document.files_total for document in self.documents)
+
+    @property
+    def progress(self):
+        return self.files_done / self.files_total if self.files_total else 1.0
+
+
+@contextmanager
+def connect(path=DB_PATH):
+    """Yields a connection inside a transaction, creating the database on first use."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    connection = sqlite3.connect(path, timeout=30)
+    try:
+        connection.execute("PRAGMA foreign_keys = ON")
+        initialize(connection)
+        with connection:
+            yield connection
+    finally:
+        connection.close()
+
+
+def initialize(connection):
+    if connection.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+        return
+    connection.execute("PRAGMA journal_mode = WAL")
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        if connection.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            for statement in SCHEMA.split(";"):
+                connection.execute(statement)
+            connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        connection.commit()
+    except BaseException:
+        connection.rollback()
+        raise
+
+
+def bundle_path(job_id, path=DB_PATH):
+    return os.path.join(os.path.dirname(path), f"{job_id}.zip")
+
+
+def encode_request(replacement_dict, students, keys, layout, batch):
+    return json.dumps(
+        {
+            "replacement_dict": replacement_dict,
+            "students": [asdict(student) for student in students],
+            "keys": list(keys),
+            "layout": asdict(layout),
+            "batch": batch,
+        },
+        ensure_ascii=False,
+        default=str,
+    )
+
+
+def decode_request(request):
+    """Returns (replacement_dict, students, specs, layout, batch) of a stored request."""
+    request = json.loads(request)
+    specs = [spec for spec in generation.DOCUMENT_SPECS if spec.key in request["keys"]]
+    return (
+        request["replacement_dict"],
+        [utils.Student(**student) for student in request["students"]],
+        specs,
+        generation.Layout(**request["layout"]),
+        request["batch"],
+    )
+
+
+def submit(
+    replacement_dict,
+    students,
+    keys,
+    layout=generation.DEFAULT_LAYOUT,
+    batch=True,
+    owner="",
+    title="",
+    path=DB_PATH,
+):
+    """Queues the generation of the documents `keys` of a group and returns the id of the job."""
+    job_id = uuid.uuid4().hex
+    specs = [spec for spec in generation.DOCUMENT_SPECS if spec.key in keys]
+    with connect(path) as connection:
+        connection.execute(
+            "INSERT INTO jobs (id, owner, title, request, status, created) VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                job_id,
+                owner,
+                title,
+                encode_request(replacement_dict, students, keys, layout, batch),
+                QUEUED,
+                time.time(),
+            ),
+        )
+        connection.executemany(
+            "INSERT INTO job_documents (job_id, key, position, files_total) VALUES (?, ?, ?, ?)",
+            [
+                (job_id, spec.key, position, len(generation.split_parts(spec, students, layout)))
+                for position, spec in enumerate(specs)
+            ],
+        )
+    return job_id
+
+
+def load_jobs(connection, rows):
+    jobs = []
+    for job_id, title, status, error, created, started, finished in rows:
+        documents = [
+            DocumentProgress(
+                key,
+                generation.SPECS_BY_KEY[key].title if key in generation.SPECS_BY_KEY else key,
+                files_done,
+                files_total,
+            )
+            for key, files_done, files_total in connection.execute(
+                "SELECT key, files_done, files_total FROM job_documents"
+                " WHERE job_id = ? ORDER BY position",
+                (job_id,),
+            )
+        ]
+        jobs.append(Job(job_id, title, status, error, created, started, finished, documents))
+    return jobs
+
+
+JOB_COLUMNS = "id, title, status, error, created, started, finished"
+
+
+def list_jobs(owner, limit=20, path=DB_PATH):
+    """Returns the latest jobs of `owner`, newest first."""
+    with connect(path) as connection:
+        rows = connection.execute(
+            f"SELECT {JOB_COLUMNS} FROM jobs WHERE owner = ? ORDER BY created DESC LIMIT ?",
+            (owner, limit),
+        ).fetchall()
+        return load_jobs(connection, rows)
+
+
+def get_job(job_id, path=DB_PATH):
+    with connect(path) as connection:
+        rows = connection.execute(
+            f"SELECT {JOB_COLUMNS} FROM jobs WHERE id = ?", (job_id,)
+        ).fetchall()
+        jobs = load_jobs(connection, rows)
+    return jobs[0] if jobs else None
+
+
+def cancel(job_id, path=DB_PATH):
+    """Cancels a queued job at once, a running one after the file being built."""
+    with connect(path) as connection:
+        connection.execute(
+            "UPDATE jobs SET status = ?, finished = ? WHERE id = ? AND status = ?",
+            (CANCELLED, time.time(), job_id, QUEUED),
+        )
+        connection.execute(
+            "UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = ?", (job_id, RUNNING)
+        )
+
+
+def claim(worker, path=DB_PATH):
+    """Marks the oldest queued job as run by `worker` and returns (id, request), or None."""
+    with connect(path) as connection:
+        # the write lock keeps two workers from claiming the same job
+        connection.execute("BEGIN IMMEDIATE")
+        row = connection.execute(
+            "SELECT id, request FROM jobs WHERE status = ? ORDER BY created LIMIT 1", (QUEUED,)
+        ).fetchone()
+        if row is None:
+            return None
+        connection.execute(
+            "UPDATE jobs SET status = ?, worker = ?, started = ? WHERE id = ?",
+            (RUNNING, worker, time.time(), row[0]),
+        )
+        return row
+
+
+def record_file(job_id, key, path=DB_PATH):
+    """Counts a built file of document `key`, returns whether the job should go on."""
+    with connect(path) as connection:
+        connection.execute(
+            "UPDATE job_documents SET files_done = files_done + 1 WHERE job_id = ? AND key = ?",
+            (job_id, key),
+        )
+        row = connection.execute(
+            "SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+    return row is not None and not row[0]
+
+
+def finish(job_id, status, error=None, path=DB_PATH):
+    with connect(path) as connection:
+        connection.execute(
+            "UPDATE jobs SET status = ?, error = ?, finished = ? WHERE id = ?",
+            (status, error, time.time(), job_id),
+        )
+
+
+def run_job(job_id, request, cache=None, path=DB_PATH):
+    """Builds the files of a claimed job into its bundle and records the outcome."""
+    replacement_dict, students, specs, layout, batch = decode_request(request)
+    writer = bundle.BundleWriter()
+    try:
+        parts = generation.iter_documents(
+            specs, replacement_dict, students, batch, layout=layout, cache=cache
+        )
+        for part in parts:
+            writer.add(part.filename, part.data)
+            if not record_file(job_id, part.key, path):
+                parts.close()
+                writer.close().close()
+                finish(job_id, CANCELLED, path=path)
+                return CANCELLED
+        archive = writer.close()
+        target = bundle_path(job_id, path)
+        tmp_path = f"{target}.{os.getpid()}.tmp"
+        with archive, open(tmp_path, "wb") as f:
+            shutil.copyfileobj(archive, f)
+        os.replace(tmp_path, target)
+    except Exception as e:
+        traceback.print_exc()
+        finish(job_id, FAILED, f"{type(e).__name__}: {e}", path=path)
+        return FAILED
+    finish(job_id, DONE, path=path)
+    return DONE
+
+
+def is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def recover(path=DB_PATH):
+    """Queues again the running jobs whose worker process is gone."""
+    with connect(path) as connection:
+        connection.execute("BEGIN IMMEDIATE")
+        rows = connection.execute(
+            "SELECT id, worker FROM jobs WHERE status = ?", (RUNNING,)
+        ).fetchall()
+        for job_id, worker in rows:
+            if worker is None or not is_alive(worker):
+                connection.execute(
+                    "UPDATE jobs SET status = ?, worker = NULL, started = NULL WHERE id = ?",
+                    (QUEUED, job_id),
+                )
+                connection.execute(
+                    "UPDATE job_documents SET files_done = 0 WHERE job_id = ?", (job_id,)
+                )
+
+
+def purge(ttl=JOB_TTL, path=DB_PATH):
+    """Removes the jobs that finished more than `ttl` seconds ago, with their bundles."""
+    with connect(path) as connection:
+        rows = connection.execute(
+            "SELECT id FROM jobs WHERE finished < ?", (time.time() - ttl,)
+        ).fetchall()
+        for (job_id,) in rows:
+            connection.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            try:
+                os.remove(bundle_path(job_id, path))
+            except FileNotFoundError:
+                pass
+
+
+def work(path=DB_PATH, poll_interval=POLL_INTERVAL):
+    """Runs queued jobs until the process is stopped."""
+    if hasattr(os, "nice"):
+        os.nice(WORKER_NICENESS)
+    cache = output_cache.get_cache()
+    recover(path)
+    purge(path=path)
+    while True:
+        claimed = claim(os.getpid(), path)
+        if claimed is None:
+            time.sleep(poll_interval)
+            continue
+        job_id, request = claimed
+        run_job(job_id, request, cache, path)
+
+
+_workers = []
+_workers_lock = threading.Lock()
+
+
+def start_workers(count=DEFAULT_WORKERS, path=DB_PATH):
+    """Makes sure `count` worker processes of this process are running, restarting those that exited."""
+    if multiprocessing.current_process().name != "MainProcess":
+        # spawned processes run the main script, the app, again while starting
+        return
+    with _workers_lock:
+        _workers[:] = [process for process in _workers if process.is_alive()]
+        if len(_workers) < count:
+            recover(path)
+        while len(_workers) < count:
+            # spawn: forking the threaded Streamlit server is not safe
+            process = multiprocessing.get_context("spawn").Process(
+                target=work, args=(path,), daemon=True
+            )
+            process.start()
+            _workers.append(process)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Обработчики очереди заданий генерации.")
+    parser.add_argument(
+        "-w", "--workers", type=int, default=DEFAULT_WORKERS, help="количество процессов"
+    )
+    args = parser.parse_args(argv)
+    start_workers(args.workers)
+    try:
+        while True:
+            time.sleep(POLL_INTERVAL)
+            start_workers(args.workers)
+    except KeyboardInterrupt:
+        return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
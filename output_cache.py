@@ -0,0 +1,142 @@
+"""Content addressed cache of generated .docx files.
+
+Keys are hashes of everything a file is built from (see generation.part_key),
+values the serialized document. Recently used files are kept in memory,
+all of them optionally on disk, each tier evicting the least recently used
+files beyond its size limit. The cache is per process and shared by all
+Streamlit sessions; the disk tier is also shared between processes.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+MEMORY_LIMIT = 256 * 1024 * 1024
+DISK_LIMIT = 2 * 1024 * 1024 * 1024
+DISK_DIR = ".cache/outputs"
+
+
+class OutputCache:
+    def __init__(self, memory_limit=MEMORY_LIMIT, directory=DISK_DIR, disk_limit=DISK_LIMIT):
+        """`directory=None` disables the disk tier."""
+        self.memory_limit = memory_limit
+        self.directory = directory
+        self.disk_limit = disk_limit
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._disk_size = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.docx")
+
+    def get(self, key):
+        """Returns the cached bytes of `key`, or None."""
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return data
+        data = self._read(key) if self.directory else None
+        with self._lock:
+            if data is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._remember(key, data)
+        return data
+
+    def put(self, key, data):
+        with self._lock:
+            self._remember(key, data)
+        if self.directory:
+            self._write(key, data)
+
+    def _remember(self, key, data):
+        if len(data) > self.memory_limit:
+            return
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_size -= len(previous)
+        self._memory[key] = data
+        self._memory_size += len(data)
+        while self._memory_size > self.memory_limit:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+
+    def _read(self, key):
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            # the modification time orders the disk tier for eviction
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return data
+
+    def _write(self, key, data):
+        path = self.path(key)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            if self._disk_size is None:
+                self._disk_size = sum(size for _, size, _ in self._disk_entries())
+            else:
+                self._disk_size += len(data)
+            if self._disk_size > self.disk_limit:
+                self._evict_disk()
+
+    def _disk_entries(self):
+        for root, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                if not filename.endswith(".docx"):
+                    continue
+                path = os.path.join(root, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield stat.st_mtime, stat.st_size, path
+
+    def _evict_disk(self):
+        """Removes the least recently used files until the disk tier is within 90% of its limit."""
+        entries = sorted(self._disk_entries())
+        self._disk_size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self._disk_size <= self.disk_limit * 0.9:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._disk_size -= size
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_size = 0
+            if self.directory:
+                for _, _, path in list(self._disk_entries()):
+                    os.remove(path)
+                self._disk_size = 0
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def get_cache():
+    """Returns the process-wide cache."""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = OutputCache()
+        return _default
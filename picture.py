@@ -1,7 +1,11 @@
 import os
+import images
+import tracing
+from docx.image.image import Image
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
 from docx.oxml import parse_xml, register_element_cls
 from docx.oxml.ns import nsdecls
-from docx.oxml.shape import CT_Picture
+from docx.oxml.shape import CT_Inline, CT_Picture
 from docx.oxml.xmlchemy import BaseOxmlElement, OneAndOnlyOne
 from docx import Document
 from docx.shared import Inches, Pt
@@ -59,10 +63,53 @@ class CT_Anchor(BaseOxmlElement):
         )
 
 
+register_element_cls('wp:anchor', CT_Anchor)
+
+
+def image_part_index(package):
+    """Returns the sha1 -> ImagePart map of `package`.
+
+    python-docx re-hashes every image part of the package on each lookup, the
+    index hashes the parts already in the package only once.
+    """
+    index = getattr(package, "_image_parts_by_sha1", None)
+    if index is None:
+        index = {image_part.sha1: image_part for image_part in package.image_parts}
+        package._image_parts_by_sha1 = index
+    return index
+
+
+def next_shape_id(part):
+    """Like StoryPart.next_id, but scans the document for used ids only once per part.
+
+    Valid as long as all pictures of the part are added through this module.
+    """
+    shape_id = getattr(part, "_next_shape_id", None) or part.next_id
+    part._next_shape_id = shape_id + 1
+    return shape_id
+
+
+# refer to docx.parts.story.StoryPart.get_or_add_image
+def get_or_add_image(part, image_descriptor):
+    """Returns (rId, image) for the image, taking file paths from the images registry."""
+    if isinstance(image_descriptor, str):
+        image = images.load_image(image_descriptor)
+    else:
+        image = Image.from_file(image_descriptor)
+    package = part.package
+    index = image_part_index(package)
+    image_part = index.get(image.sha1)
+    if image_part is None:
+        image_part = package.image_parts._add_image_part(image)
+        index[image.sha1] = image_part
+    rId = part.relate_to(image_part, RT.IMAGE)
+    return rId, image
+
+
 def new_pic_anchor(part, image_descriptor, width, height, pos_x, pos_y):
-    rId, image = part.get_or_add_image(image_descriptor)
+    rId, image = get_or_add_image(part, image_descriptor)
     cx, cy = image.scaled_dimensions(width, height)
-    shape_id, filename = part.next_id, image.filename
+    shape_id, filename = next_shape_id(part), image.filename
     return CT_Anchor.new_pic_anchor(shape_id, rId, filename, cx, cy, pos_x, pos_y)
 
 
@@ -70,13 +117,24 @@ def new_pic_anchor(part, image_descriptor, width, height, pos_x, pos_y):
 def add_float_picture(p, image_path_or_stream, width=None, height=None, pos_x=0, pos_y=0):
     """Add float picture at fixed position `pos_x` and `pos_y` to the top-left point of page.
     """
-    run = p.add_run()
-    anchor = new_pic_anchor(run.part, image_path_or_stream, width, height, pos_x, pos_y)
-    run._r.add_drawing(anchor)
+    with tracing.span("image"):
+        run = p.add_run()
+        anchor = new_pic_anchor(run.part, image_path_or_stream, width, height, pos_x, pos_y)
+        run._r.add_drawing(anchor)
+
+
+# refer to docx.text.run.add_picture
+def add_picture(run, image_path_or_stream, width=None, height=None):
+    """Add inline picture to `run`, resolving the image part through the images registry."""
+    with tracing.span("image"):
+        part = run.part
+        rId, image = get_or_add_image(part, image_path_or_stream)
+        cx, cy = image.scaled_dimensions(width, height)
+        inline = CT_Inline.new_pic_inline(next_shape_id(part), rId, image.filename, cx, cy)
+        run._r.add_drawing(inline)
 
 
 if __name__ == '__main__':
-    register_element_cls('wp:anchor', CT_Anchor)
     document = Document("document.docx")
 
     p = document.add_paragraph()
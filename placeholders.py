@@ -0,0 +1,140 @@
+"""Image slots declared in the text of the templates.
+
+A run whose text contains a directive gets the named image in its place:
+
+    [[image prof_educ_logo]]
+    [[image prof_educ_logo width=1.53in height=1.09in]]
+    [[image signature mode=float x=12cm y=2cm width=4cm]]
+
+The name refers to images.NAMED_IMAGES. Sizes accept in, cm, mm, pt or
+plain EMU; a missing width or height keeps the aspect ratio. `mode` is
+`inline` (default) or `float`, a float image is positioned at `x`, `y`
+from the top-left corner of the page, behind the text.
+
+SlotIndex records where the directives of an element are, so that the
+copies of one template (a row per student) are not scanned again.
+"""
+import images
+import picture
+import tracing
+
+import re
+from dataclasses import dataclass
+
+from docx.oxml.ns import qn
+from docx.shared import Cm, Emu, Inches, Mm, Pt
+from docx.text.run import Run
+
+DIRECTIVE = re.compile(r"\[\[image\s+(\w+)((?:\s+\w+=[^\s\]]+)*)\s*\]\]")
+MARKER = "[[image"
+UNITS = {"in": Inches, "cm": Cm, "mm": Mm, "pt": Pt}
+LENGTH = re.compile(r"(\d+(?:\.\d+)?)(in|cm|mm|pt)?")
+
+
+@dataclass(frozen=True)
+class Slot:
+    text: str
+    name: str
+    width: int = None
+    height: int = None
+    mode: str = "inline"
+    x: int = 0
+    y: int = 0
+
+
+def parse_length(value):
+    match = LENGTH.fullmatch(value)
+    if match is None:
+        raise ValueError(f"Invalid image size '{value}'")
+    number, unit = match.groups()
+    if unit is None:
+        return Emu(int(float(number)))
+    return UNITS[unit](float(number))
+
+
+def parse(text):
+    """Returns the Slots of the directives in `text`."""
+    if MARKER not in text:
+        return []
+    slots = []
+    for match in DIRECTIVE.finditer(text):
+        options = dict(option.split("=", 1) for option in match.group(2).split())
+        unknown = set(options) - {"width", "height", "mode", "x", "y"}
+        if unknown:
+            raise ValueError(f"Unknown image option {', '.join(sorted(unknown))} in '{match.group(0)}'")
+        mode = options.get("mode", "inline")
+        if mode not in ("inline", "float"):
+            raise ValueError(f"Unknown image mode '{mode}' in '{match.group(0)}'")
+        slots.append(
+            Slot(
+                text=match.group(0),
+                name=match.group(1),
+                width=parse_length(options["width"]) if "width" in options else None,
+                height=parse_length(options["height"]) if "height" in options else None,
+                mode=mode,
+                x=parse_length(options.get("x", "0")),
+                y=parse_length(options.get("y", "0")),
+            )
+        )
+    return slots
+
+
+def run_text(r):
+    return "".join(t.text or "" for t in r.iter(qn("w:t")))
+
+
+def fill(run, slots):
+    """Replaces the directives of `slots` in the python-docx `run` by their images."""
+    for slot in slots:
+        run.text = run.text.replace(slot.text, "")
+        path = images.named_image(slot.name)
+        if slot.mode == "float":
+            with tracing.span("image"):
+                anchor = picture.new_pic_anchor(run.part, path, slot.width, slot.height, slot.x, slot.y)
+                run._r.add_drawing(anchor)
+        else:
+            picture.add_picture(run, path, width=slot.width, height=slot.height)
+
+
+def path_to(element, descendant):
+    path = []
+    while descendant is not element:
+        parent = descendant.getparent()
+        path.append(parent.index(descendant))
+        descendant = parent
+    return tuple(reversed(path))
+
+
+class SlotIndex:
+    """The positions of the image directives below an element."""
+
+    def __init__(self, element):
+        self.slots = []
+        for r in element.iter(qn("w:r")):
+            slots = parse(run_text(r))
+            if slots:
+                self.slots.append((path_to(element, r), slots))
+
+    def runs(self, element):
+        """Returns [(w:r, slots)] of an element laid out like the indexed one.
+
+        The element is scanned afresh if a recorded position holds no directive.
+        """
+        found = []
+        for path, slots in self.slots:
+            r = element
+            try:
+                for index in path:
+                    r = r[index]
+            except IndexError:
+                return SlotIndex(element).runs(element)
+            if r.tag != qn("w:r") or not all(slot.text in run_text(r) for slot in slots):
+                return SlotIndex(element).runs(element)
+            found.append((r, slots))
+        return found
+
+
+def fill_runs(found, parent):
+    """Fills the runs returned by SlotIndex.runs, `parent` is any python-docx object of the document."""
+    for r, slots in found:
+        fill(Run(r, parent), slots)
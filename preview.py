@@ -0,0 +1,137 @@
+"""HTML preview of generated documents.
+
+The body of a .docx is split into blocks in one pass over its XML: a
+paragraph is one block, every row of a table is one block. The blocks are
+cut into pages of PAGE_SIZE and only the page shown is rendered to HTML,
+nested tables inside their cell. Previews are kept per content hash, so
+switching tabs or pages neither parses the document nor renders a page
+again.
+"""
+import tracing
+
+import hashlib
+import html
+import threading
+import zipfile
+from collections import OrderedDict
+from io import BytesIO
+
+from lxml import etree
+from docx.oxml.ns import qn
+
+PAGE_SIZE = 40
+CACHE_SIZE = 32
+
+STYLE = (
+    "<style>"
+    ".docx-preview table{border-collapse:collapse;margin:0.5em 0;width:100%}"
+    ".docx-preview td{border:1px solid #ccc;padding:2px 6px;vertical-align:top}"
+    ".docx-preview p{margin:0 0 0.3em 0}"
+    "</style>"
+)
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def paragraph_html(p):
+    parts = []
+    for element in p.iter(qn("w:t"), qn("w:tab"), qn("w:br")):
+        if element.tag == qn("w:t"):
+            parts.append(html.escape(element.text or ""))
+        elif element.tag == qn("w:tab"):
+            parts.append("&emsp;")
+        else:
+            parts.append("<br>")
+    return "".join(parts)
+
+
+def cell_html(tc):
+    content = []
+    for child in tc:
+        if child.tag == qn("w:p"):
+            text = paragraph_html(child)
+            if text:
+                content.append(f"<p>{text}</p>")
+        elif child.tag == qn("w:tbl"):
+            content.append(table_html(child))
+    span = tc.find(f"{qn('w:tcPr')}/{qn('w:gridSpan')}")
+    colspan = f' colspan="{span.get(qn("w:val"))}"' if span is not None else ""
+    return f"<td{colspan}>{''.join(content)}</td>"
+
+
+def row_html(tr):
+    return "<tr>" + "".join(cell_html(tc) for tc in tr.iterchildren(qn("w:tc"))) + "</tr>"
+
+
+def table_html(tbl):
+    return "<table>" + "".join(row_html(tr) for tr in tbl.iterchildren(qn("w:tr"))) + "</table>"
+
+
+def body_blocks(data):
+    """Returns the blocks of a .docx body: its non-empty paragraphs and the rows of its tables."""
+    with zipfile.ZipFile(BytesIO(data)) as archive:
+        root = etree.fromstring(archive.read("word/document.xml"))
+    blocks = []
+    for element in root.find(qn("w:body")):
+        if element.tag == qn("w:p"):
+            if element.find(f".//{qn('w:t')}") is not None:
+                blocks.append(element)
+        elif element.tag == qn("w:tbl"):
+            blocks.extend(element.iterchildren(qn("w:tr")))
+    return blocks
+
+
+class Preview:
+    def __init__(self, blocks, page_size=PAGE_SIZE):
+        self.blocks = blocks
+        self.page_size = page_size
+        self._pages = {}
+
+    @property
+    def page_count(self):
+        return max(1, -(-len(self.blocks) // self.page_size))
+
+    def page(self, number):
+        """Returns the HTML of page `number`, counted from 0. Only this page's blocks are rendered."""
+        if number not in self._pages:
+            self._pages[number] = self.render(
+                self.blocks[number * self.page_size:(number + 1) * self.page_size]
+            )
+        return self._pages[number]
+
+    def render(self, blocks):
+        out = [STYLE, '<div class="docx-preview">']
+        table = None
+        for block in blocks:
+            if table is not None and block.getparent() is not table:
+                out.append("</table>")
+                table = None
+            if block.tag == qn("w:p"):
+                out.append(f"<p>{paragraph_html(block)}</p>")
+            else:
+                if table is None:
+                    out.append("<table>")
+                    table = block.getparent()
+                out.append(row_html(block))
+        if table is not None:
+            out.append("</table>")
+        out.append("</div>")
+        return "".join(out)
+
+
+def get_preview(data):
+    """Returns the Preview of the .docx bytes `data`, parsed once per distinct content."""
+    digest = hashlib.sha256(data).digest()
+    with _lock:
+        preview = _cache.get(digest)
+        if preview is not None:
+            _cache.move_to_end(digest)
+            return preview
+    with tracing.span("preview"):
+        preview = Preview(body_blocks(data))
+    with _lock:
+        _cache[digest] = preview
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return preview
@@ -2,6 +2,7 @@ from docx import Document
 import streamlit as st
 import pickle
 import utils 
+import catalog
 
 
 def format_profession_string(profession_name, codes):
@@ -117,3 +118,5 @@ if __name__ == "__main__":
         pickle.dump(professions, f)
 
     teachers_to_pickle()
+    # the app reads the catalog database, the pickles only seed a new one
+    catalog.save_professions(professions.values())
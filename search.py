@@ -0,0 +1,157 @@
+"""Server side typeahead search over the training programmes.
+
+The index is built once per catalog revision and answers a query with the
+best `limit` names, so only those are sent to the selectbox. A query word
+matches a programme when it equals one of the programme's classifier
+codes or is a prefix of one, shares its stem with a word of the name
+(crude Russian suffix stripping, "трактористы" finds «Тракторист»), is
+a prefix of such a word, or starts like one and is close to it by
+trigram similarity (typos). Every word of the query has to match.
+"""
+import bisect
+import re
+import threading
+from collections import defaultdict
+
+DEFAULT_LIMIT = 20
+# minimal share of common trigrams for a fuzzy word match
+TRIGRAM_THRESHOLD = 0.4
+# letters a fuzzy match has to start with, common endings alone ("-ист") do not count
+FUZZY_PREFIX = 2
+
+WORD = re.compile(r"[0-9a-zа-я]+")
+
+# longest first, so that "ями" is stripped before "и"
+SUFFIXES = sorted(
+    (
+        "иями ями ами ией ием иях ого его ому ему ыми ими ых их ый ий ой ая яя ое ее ые ие "
+        "ом ем ам ям ах ях ов ев ей ию ия ья ью ы и а я о е у ю ь й"
+    ).split(),
+    key=len,
+    reverse=True,
+)
+MIN_STEM = 3
+
+# scores of the kinds of word matches
+CODE_MATCH = 10
+CODE_PREFIX = 6
+WORD_MATCH = 5
+STEM_MATCH = 4
+WORD_PREFIX = 3
+FUZZY_MATCH = 2
+
+
+def normalize(text):
+    return text.lower().replace("ё", "е")
+
+
+def words(text):
+    return WORD.findall(normalize(text))
+
+
+def stem(word):
+    for suffix in SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= MIN_STEM:
+            return word[: -len(suffix)]
+    return word
+
+
+def trigrams(word):
+    padded = f"  {word} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+class ProfessionIndex:
+    def __init__(self, professions):
+        """`professions` is the {name: Profession} dict of the catalog."""
+        self.names = list(professions)
+        by_word = defaultdict(set)
+        self.by_stem = defaultdict(set)
+        self.by_trigram = defaultdict(set)
+        by_code = defaultdict(set)
+        for position, profession in enumerate(professions.values()):
+            for word in words(profession.name):
+                by_word[word].add(position)
+                self.by_stem[stem(word)].add(position)
+            for code in profession.code:
+                by_code[str(code)].add(position)
+        self.by_word = dict(by_word)
+        self.word_list = sorted(by_word)
+        for word in self.word_list:
+            for trigram in trigrams(word):
+                self.by_trigram[trigram].add(word)
+        self.by_code = dict(by_code)
+        self.code_list = sorted(by_code)
+
+    def prefixed(self, keys, prefix):
+        start = bisect.bisect_left(keys, prefix)
+        end = bisect.bisect_left(keys, prefix + "\uffff")
+        return keys[start:end]
+
+    def match_word(self, word):
+        """Returns {position: score} of the programmes matching one query word."""
+        scores = {}
+
+        def add(positions, score):
+            for position in positions:
+                if scores.get(position, 0) < score:
+                    scores[position] = score
+
+        if word.isdigit():
+            for code in self.prefixed(self.code_list, word):
+                add(self.by_code[code], CODE_MATCH if code == word else CODE_PREFIX)
+            return scores
+
+        for name_word in self.prefixed(self.word_list, word):
+            add(self.by_word[name_word], WORD_MATCH if name_word == word else WORD_PREFIX)
+        add(self.by_stem.get(stem(word), ()), STEM_MATCH)
+
+        query_trigrams = trigrams(word)
+        shared = defaultdict(int)
+        for trigram in query_trigrams:
+            for name_word in self.by_trigram.get(trigram, ()):
+                shared[name_word] += 1
+        for name_word, count in shared.items():
+            if not name_word.startswith(word[:FUZZY_PREFIX]):
+                continue
+            similarity = count / (len(query_trigrams) + len(trigrams(name_word)) - count)
+            if similarity >= TRIGRAM_THRESHOLD:
+                add(self.by_word[name_word], FUZZY_MATCH * similarity)
+        return scores
+
+    def search(self, query, limit=DEFAULT_LIMIT):
+        """Returns up to `limit` programme names matching `query`, best first.
+
+        An empty query returns the first `limit` names in catalog order.
+        """
+        query_words = words(query)
+        if not query_words:
+            return self.names[:limit]
+        totals = None
+        for word in query_words:
+            scores = self.match_word(word)
+            if totals is None:
+                totals = scores
+            else:
+                totals = {
+                    position: totals[position] + score
+                    for position, score in scores.items()
+                    if position in totals
+                }
+            if not totals:
+                return []
+        best = sorted(totals, key=lambda position: (-totals[position], position))
+        return [self.names[position] for position in best[:limit]]
+
+
+_index = None
+_lock = threading.Lock()
+
+
+def get_index(professions):
+    """Returns the index of `professions`, rebuilt only when the catalog returns a new dict."""
+    global _index
+    with _lock:
+        if _index is None or _index[0] is not professions:
+            _index = (professions, ProfessionIndex(professions))
+        return _index[1]
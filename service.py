@@ -0,0 +1,290 @@
+"""HTTP service generating the document bundles of a group, for other local tools.
+
+    python service.py --port 8502 --jobs 4 --max-requests 2
+
+POST /generate takes a JSON cohort, the header fields of a cli.py cohort
+file plus the students, and returns the ZIP bundle:
+
+    {
+        "profession": "Администратор",
+        "teacher": "А.И. Мамонтов",
+        "company": "заявление",
+        "beginning_date": "2024-03-01",
+        "end_date": "20.03.2024",
+        "beginning_number": 808,
+        "end_number": 809,
+        "students": [
+            {"name": "Иванов Иван Иванович", "cert_number": "12", "machine_category": "B, C"}
+        ],
+        "documents": ["beginning", "certificate"],
+        "chunk_size": 0,
+        "per_page": 0,
+        "page_backgrounds": false
+    }
+
+"documents" (the keys of generation.DOCUMENT_SPECS, all by default),
+"chunk_size", "per_page", "page_backgrounds" and "batch" are optional, as
+are the fields of a student other than the name. The files are built
+exactly as in the app, through generation.iter_documents and
+bundle.build_bundle, in a process pool of --jobs workers that lives as long
+as the service, so the template, image and output caches stay warm between
+requests. At most --max-requests requests are generated at once; the
+others wait up to QUEUE_TIMEOUT and are then refused with 503. Every
+response carries a Server-Timing header with the time spent waiting and
+generating, and GET /stats returns the latency percentiles of the recent
+requests.
+"""
+import bundle
+import catalog
+import cli
+import generation
+import output_cache
+import utils
+
+import argparse
+import json
+import sys
+import threading
+import time
+from collections import deque
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote
+
+DEFAULT_PORT = 8502
+DEFAULT_MAX_REQUESTS = 2
+# seconds a request waits for a free slot before it is refused
+QUEUE_TIMEOUT = 30
+MAX_BODY_SIZE = 32 * 1024 * 1024
+# number of recent requests the latency statistics are computed from
+STATS_WINDOW = 1000
+STUDENT_FIELDS = ("name", "cert_number", "role", "machine_category")
+
+
+class RequestError(Exception):
+    def __init__(self, message, status=HTTPStatus.BAD_REQUEST):
+        super().__init__(message)
+        self.status = status
+
+
+class LatencyStats:
+    """Durations of the recent requests, in seconds."""
+
+    def __init__(self, window=STATS_WINDOW):
+        self.durations = deque(maxlen=window)
+        self.requests = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def add(self, duration):
+        with self._lock:
+            self.durations.append(duration)
+            self.requests += 1
+
+    def reject(self):
+        with self._lock:
+            self.rejected += 1
+
+    def summary(self):
+        with self._lock:
+            durations = sorted(self.durations)
+            summary = {"requests": self.requests, "rejected": self.rejected}
+        if durations:
+            for name, fraction in (("p50", 0.5), ("p95", 0.95), ("max", 1.0)):
+                index = min(len(durations) - 1, int(fraction * len(durations)))
+                summary[name] = round(durations[index], 3)
+        return summary
+
+
+def parse_cohort(payload, professions):
+    """Returns (replacement_dict, students, specs, layout, batch) of a /generate request."""
+    if not isinstance(payload, dict):
+        raise RequestError("ожидается объект JSON")
+    missing = [field for field in cli.HEADER_FIELDS if field not in payload]
+    if missing:
+        raise RequestError(f"не указаны поля {', '.join(missing)}")
+    profession = professions.get(payload["profession"])
+    if profession is None:
+        raise RequestError(f"неизвестная программа обучения '{payload['profession']}'")
+
+    rows = payload.get("students")
+    if not isinstance(rows, list) or not rows:
+        raise RequestError("не указаны обучающиеся")
+    students = []
+    for number, row in enumerate(rows, 1):
+        if not isinstance(row, dict) or not row.get("name"):
+            raise RequestError(f"обучающийся {number}: не указано имя")
+        students.append(
+            utils.Student(
+                **{field: "" if row.get(field) is None else str(row[field]) for field in STUDENT_FIELDS}
+            )
+        )
+
+    keys = payload.get("documents") or [spec.key for spec in generation.DOCUMENT_SPECS]
+    if not isinstance(keys, list):
+        raise RequestError("documents должен быть списком")
+    unknown = [key for key in keys if key not in generation.SPECS_BY_KEY]
+    if unknown:
+        raise RequestError(f"неизвестные документы: {', '.join(map(str, unknown))}")
+    specs = [spec for spec in generation.DOCUMENT_SPECS if spec.key in keys]
+
+    try:
+        replacement_dict = cli.header_replacement_dict(payload, profession, len(students))
+        layout = generation.Layout(
+            chunk_size=int(payload.get("chunk_size", 0)),
+            per_page=int(payload.get("per_page", 0)),
+            page_backgrounds=bool(payload.get("page_backgrounds", False)),
+        )
+    except (TypeError, ValueError) as e:
+        raise RequestError(str(e))
+    if layout.chunk_size < 0 or layout.per_page not in (0, 1, 2, 3):
+        raise RequestError("chunk_size не может быть отрицательным, per_page — от 0 до 3")
+    return replacement_dict, students, specs, layout, bool(payload.get("batch", True))
+
+
+class GenerationService:
+    """The state shared by the requests: the pool size, the request slots and the statistics."""
+
+    def __init__(self, jobs=generation.DEFAULT_WORKERS, max_requests=DEFAULT_MAX_REQUESTS, cache=None):
+        self.jobs = jobs
+        self.slots = threading.BoundedSemaphore(max_requests)
+        self.cache = cache
+        self.stats = LatencyStats()
+
+    def generate(self, payload):
+        """Returns (ZIP file object, its file name, timings) of a parsed /generate request."""
+        start = time.perf_counter()
+        # reloaded only when the catalog changed
+        professions = catalog.load_professions()
+        replacement_dict, students, specs, layout, batch = parse_cohort(payload, professions)
+        if not self.slots.acquire(timeout=QUEUE_TIMEOUT):
+            self.stats.reject()
+            raise RequestError("сервис занят, повторите запрос позже", HTTPStatus.SERVICE_UNAVAILABLE)
+        try:
+            started = time.perf_counter()
+            parts = generation.iter_documents(
+                specs,
+                replacement_dict,
+                students,
+                batch,
+                max_workers=self.jobs,
+                layout=layout,
+                cache=self.cache,
+            )
+            archive = bundle.build_bundle((part.filename, part.data) for part in parts)
+        finally:
+            self.slots.release()
+        finished = time.perf_counter()
+        self.stats.add(finished - start)
+        timings = {"queue": started - start, "generate": finished - started, "total": finished - start}
+        # named like the download of the app
+        filename = f"{cli.parse_date(str(payload['end_date'])).strftime('%d.%m.%Y')}.zip"
+        return archive, filename, timings
+
+
+class Handler(BaseHTTPRequestHandler):
+    # set by serve
+    service = None
+
+    def send_json(self, status, value, headers=()):
+        body = json.dumps(value, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for name, header in headers:
+            self.send_header(name, header)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self.send_json(HTTPStatus.OK, self.service.stats.summary())
+        else:
+            self.send_json(HTTPStatus.NOT_FOUND, {"error": "неизвестный адрес"})
+
+    def do_POST(self):
+        if self.path != "/generate":
+            self.send_json(HTTPStatus.NOT_FOUND, {"error": "неизвестный адрес"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            if length > MAX_BODY_SIZE:
+                raise RequestError("слишком большой запрос", HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+            try:
+                payload = json.loads(self.rfile.read(length))
+            except ValueError as e:
+                raise RequestError(f"неверный JSON: {e}")
+            archive, filename, timings = self.service.generate(payload)
+        except RequestError as e:
+            headers = [("Retry-After", str(QUEUE_TIMEOUT))] if e.status == HTTPStatus.SERVICE_UNAVAILABLE else []
+            self.send_json(e.status, {"error": str(e)}, headers)
+            return
+        except Exception as e:
+            self.log_error("generation failed: %r", e)
+            self.send_json(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": f"{type(e).__name__}: {e}"})
+            return
+
+        with archive:
+            data = archive.read()
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "application/zip")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header(
+            "Content-Disposition", f"attachment; filename*=UTF-8''{quote(filename)}"
+        )
+        self.send_header(
+            "Server-Timing",
+            ", ".join(f"{name};dur={duration * 1000:.0f}" for name, duration in timings.items()),
+        )
+        self.end_headers()
+        self.wfile.write(data)
+        self.log_message(
+            "%d students, %.2f s (waited %.2f s)",
+            len(payload["students"]),
+            timings["total"],
+            timings["queue"],
+        )
+
+
+def serve(host, port, service):
+    Handler.service = service
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    print(f"http://{host}:{port}/generate, {service.jobs} процессов", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        generation.discard_pool()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HTTP сервис генерации документов.")
+    parser.add_argument("--host", default="127.0.0.1", help="адрес, по умолчанию только локальный")
+    parser.add_argument("-p", "--port", type=int, default=DEFAULT_PORT, help="порт")
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=generation.DEFAULT_WORKERS, help="количество процессов"
+    )
+    parser.add_argument(
+        "--max-requests",
+        type=int,
+        default=DEFAULT_MAX_REQUESTS,
+        help="запросов, обрабатываемых одновременно",
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="не использовать кэш готовых документов"
+    )
+    args = parser.parse_args(argv)
+    service = GenerationService(
+        jobs=args.jobs,
+        max_requests=args.max_requests,
+        cache=None if args.no_cache else output_cache.get_cache(),
+    )
+    serve(args.host, args.port, service)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,201 @@
+"""Writes documents whose body holds one long table, streaming its rows into word/document.xml.
+
+The rows are xml strings made from the template's own data row, see fill_table.
+"""
+import copy
+import re
+import time
+import zipfile
+from xml.sax.saxutils import escape
+
+from docx.opc.packuri import CONTENT_TYPES_URI, PACKAGE_URI
+from docx.opc.pkgwriter import _ContentTypesItem
+from docx.oxml import OxmlElement
+from docx.oxml.ns import qn
+from lxml import etree
+
+ROWS_MARK = "streamed-rows"
+# rows are written to the archive in chunks of about this many characters
+CHUNK_SIZE = 64 * 1024
+
+SPECIAL = re.compile(r"([\t\n\r])")
+# characters xml does not allow, python-docx refuses them
+INVALID = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+def run_content(text):
+    """Returns the xml of the content of a run with `text`, as python-docx's Run.text writes it."""
+    out = []
+    for piece in SPECIAL.split(INVALID.sub("", text)):
+        if piece == "\t":
+            out.append("<w:tab/>")
+        elif piece in ("\n", "\r"):
+            out.append("<w:br/>")
+        elif piece:
+            space = ' xml:space="preserve"' if piece != piece.strip() else ""
+            out.append(f"<w:t{space}>{escape(piece)}</w:t>")
+    return "".join(out)
+
+
+INDEX = "index"
+STUDENT = "student."
+CELL_MARK = "streamed-cell"
+# attributes Word sets on every row and paragraph, they should not repeat in the generated ones
+REVISION_ATTRIBUTES = re.compile(r'\s(?:w:rsid\w*|w14:paraId|w14:textId)="[^"]*"')
+NAMESPACES = re.compile(r'\sxmlns:\w+="[^"]*"')
+
+
+class TemplateRow:
+    """The data row of a template table, split around the text of its cells.
+
+    Every cell keeps its properties (width, borders, shading, alignment) and
+    the properties of its first paragraph. Its text gets the formatting of
+    the first run, or of the paragraph mark when the cell is empty, as in a
+    row left blank in Word.
+    """
+
+    def __init__(self, tr):
+        row = copy.deepcopy(tr)
+        self.cell_count = 0
+        for tc in row.iterchildren(qn("w:tc")):
+            paragraphs = tc.findall(qn("w:p"))
+            if not paragraphs:
+                continue
+            p = paragraphs[0]
+            for extra in paragraphs[1:]:
+                tc.remove(extra)
+            properties = p.find(f"{qn('w:r')}/{qn('w:rPr')}")
+            if properties is None:
+                properties = p.find(f"{qn('w:pPr')}/{qn('w:rPr')}")
+            for child in list(p):
+                if child.tag != qn("w:pPr"):
+                    p.remove(child)
+            r = OxmlElement("w:r")
+            if properties is not None:
+                r.append(copy.deepcopy(properties))
+            r.append(etree.Comment(CELL_MARK))
+            p.append(r)
+            self.cell_count += 1
+        xml = etree.tostring(row, encoding="unicode")
+        # the document root declares the namespaces
+        head, rest = xml.split(">", 1)
+        xml = REVISION_ATTRIBUTES.sub("", NAMESPACES.sub("", head) + ">" + rest)
+        self.pieces = xml.split(f"<!--{CELL_MARK}-->")
+
+    def row(self, texts):
+        """Returns the xml of the row with `texts` in its cells, the cells beyond `texts` left empty."""
+        out = [self.pieces[0]]
+        for index, piece in enumerate(self.pieces[1:]):
+            if index < len(texts):
+                out.append(run_content(texts[index]))
+            out.append(piece)
+        return "".join(out)
+
+
+def row_values(columns, context):
+    """Returns a function of (index, student) giving the texts of a row laid out by `columns`.
+
+    A column is one of
+        "index"            the position of the student, counted from 1
+        "student.<field>"  the field of the student
+        "<key>"            context[key], the same in every row
+        ""                 an empty cell
+    """
+    getters = []
+    for column in columns:
+        if column == INDEX:
+            getters.append(lambda index, student: str(index + 1))
+        elif column.startswith(STUDENT):
+            getters.append(
+                lambda index, student, field=column[len(STUDENT):]: str(getattr(student, field))
+            )
+        else:
+            value = str(context[column]) if column else ""
+            getters.append(lambda index, student, value=value: value)
+    return lambda index, student: [getter(index, student) for getter in getters]
+
+
+def fill_table(document, table, columns, students, context):
+    """Returns a StreamedDocument with a row per student in `table`, laid out by `columns`.
+
+    The last row of the table, the data row of the template, is the model of
+    the rows and is replaced by them. See row_values for the columns.
+    """
+    data_row = table._tbl.tr_lst[-1]
+    template_row = TemplateRow(data_row)
+    if len(columns) > template_row.cell_count:
+        raise ValueError(
+            f"The table has {template_row.cell_count} columns, {len(columns)} are filled"
+        )
+    table._tbl.remove(data_row)
+    values = row_values(columns, context)
+
+    def rows():
+        for index, student in enumerate(students):
+            yield template_row.row(values(index, student))
+
+    return StreamedDocument(document, table, rows)
+
+
+class StreamedDocument:
+    """A rendered document whose `table` gets the rows returned by `rows()` when it is saved.
+
+    `document` is a python-docx Document or a rendered DocxTemplate. `rows`
+    is called on every save and returns an iterable of <w:tr> xml strings,
+    using the `w` prefix of the document.
+    """
+
+    def __init__(self, document, table, rows):
+        self.document = document
+        self.table = table
+        self.rows = rows
+
+    def split_main(self):
+        """Returns the serialized main document part before and after the streamed rows."""
+        tbl = self.table._tbl
+        mark = etree.Comment(ROWS_MARK)
+        rows = tbl.tr_lst
+        if rows:
+            rows[-1].addnext(mark)
+        else:
+            tbl.append(mark)
+        try:
+            blob = self.document.part.blob
+        finally:
+            tbl.remove(mark)
+        prefix, suffix = blob.split(f"<!--{ROWS_MARK}-->".encode("utf-8"))
+        return prefix, suffix
+
+    def write_main(self, stream):
+        prefix, suffix = self.split_main()
+        stream.write(prefix)
+        chunk, size = [], 0
+        for row in self.rows():
+            chunk.append(row)
+            size += len(row)
+            if size >= CHUNK_SIZE:
+                stream.write("".join(chunk).encode("utf-8"))
+                chunk, size = [], 0
+        stream.write("".join(chunk).encode("utf-8"))
+        stream.write(suffix)
+
+    def save(self, file):
+        """Writes the .docx to `file`, a path or a binary file object."""
+        main = self.document.part
+        package = main.package
+        parts = list(package.iter_parts())
+        for part in parts:
+            part.before_marshal()
+        with zipfile.ZipFile(file, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr(CONTENT_TYPES_URI.membername, _ContentTypesItem.from_parts(parts).blob)
+            archive.writestr(PACKAGE_URI.rels_uri.membername, package.rels.xml)
+            for part in parts:
+                if part is main:
+                    info = zipfile.ZipInfo(part.partname.membername, time.localtime(time.time())[:6])
+                    info.compress_type = zipfile.ZIP_DEFLATED
+                    with archive.open(info, "w") as stream:
+                        self.write_main(stream)
+                else:
+                    archive.writestr(part.partname.membername, part.blob)
+                if len(part.rels):
+                    archive.writestr(part.partname.rels_uri.membername, part.rels.xml)
@@ -0,0 +1,226 @@
+"""Import of student lists from pasted text, CSV and XLSX files.
+
+Every source has the layout of the text area: certificate number, two
+columns that are ignored, name and an optional machine category or role.
+Empty cells are skipped, so a row copied from a spreadsheet with blank
+columns still lines up. The rows are parsed column by column in one pass
+and checked; malformed rows end up in the report of the StudentTable
+instead of failing the whole list. utils.Student objects are only created
+when the documents are built, for the valid rows.
+"""
+import utils
+
+import csv
+import io
+import os
+import zipfile
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+# positions of the fields among the non-empty cells of a row
+CERT_NUMBER = 0
+NAME = 3
+CATEGORY = 4
+
+ERROR = "ошибка"
+WARNING = "предупреждение"
+
+CSV_EXTENSIONS = (".csv", ".txt", ".tsv")
+EXCEL_EXTENSIONS = (".xlsx", ".xlsm")
+CSV_DELIMITERS = "\t;,"
+CSV_ENCODINGS = ("utf-8-sig", "cp1251")
+SNIFF_SIZE = 64 * 1024
+
+
+@dataclass(frozen=True)
+class Issue:
+    # row of the source, counted from 1
+    row: int
+    level: str
+    message: str
+
+
+class StudentTable:
+    """The valid rows of an imported list as columns, plus the issues found."""
+
+    def __init__(self, rows, cert_numbers, names, categories, issues=(), role_required=False):
+        self.rows = rows
+        self.cert_numbers = cert_numbers
+        self.names = names
+        self.categories = categories
+        self.issues = list(issues)
+        # the category column holds roles for professions that require one, machine categories otherwise
+        self.role_required = role_required
+
+    @classmethod
+    def empty(cls, issues=()):
+        blank = np.array([], dtype=object)
+        return cls(np.array([], dtype=int), blank, blank, blank, issues)
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def errors(self):
+        return [issue for issue in self.issues if issue.level == ERROR]
+
+    @property
+    def warnings(self):
+        return [issue for issue in self.issues if issue.level == WARNING]
+
+    def students(self):
+        """Returns a utils.Student for every valid row."""
+        blank = [""] * len(self)
+        if self.role_required:
+            roles, machine_categories = self.categories, blank
+        else:
+            roles, machine_categories = blank, self.categories
+        return [
+            utils.Student(name=name, cert_number=cert_number, role=role, machine_category=category)
+            for name, cert_number, role, category in zip(
+                self.names, self.cert_numbers, roles, machine_categories
+            )
+        ]
+
+    def report(self):
+        """Returns the issues as a DataFrame, ordered by row."""
+        issues = sorted(self.issues, key=lambda issue: (issue.row, issue.level != ERROR))
+        return pd.DataFrame(
+            [(issue.row, issue.level, issue.message) for issue in issues],
+            columns=["Строка", "Уровень", "Сообщение"],
+        )
+
+
+def nth_filled(values, filled, position):
+    """Returns the `position`-th non-empty cell of every row of `values`, "" where a row has fewer."""
+    hit = filled & (filled.cumsum(axis=1) == position + 1)
+    found = hit.any(axis=1)
+    columns = hit.argmax(axis=1)
+    cells = values[np.arange(len(values)), columns]
+    return np.where(found, cells, "").astype(object)
+
+
+def normalize_cert_numbers(cert_numbers):
+    """Writes numeric certificate numbers as integers ("12.0" -> "12"), other values are kept.
+
+    Returns (numbers, mask of the numeric ones).
+    """
+    numbers = pd.to_numeric(pd.Series(cert_numbers, dtype=object), errors="coerce").to_numpy(dtype=float)
+    numeric = np.isfinite(numbers) & (np.abs(numbers) < 1e18)
+    result = cert_numbers.copy()
+    result[numeric] = [str(number) for number in np.trunc(numbers[numeric]).astype(np.int64)]
+    return result, numeric
+
+
+def parse_frame(frame, role_required=False):
+    """Parses a DataFrame of cells, one source row per row, into a StudentTable."""
+    if frame.empty:
+        return StudentTable.empty()
+    frame = frame.fillna("").astype(str)
+    values = frame.apply(lambda column: column.str.strip()).to_numpy(dtype=object)
+    filled = values != ""
+    counts = filled.sum(axis=1)
+    rows = np.arange(1, len(values) + 1)
+
+    cert_numbers = nth_filled(values, filled, CERT_NUMBER)
+    names = nth_filled(values, filled, NAME)
+    categories = nth_filled(values, filled, CATEGORY)
+    issues = []
+
+    # a spreadsheet header: a full first row without any digit in the number column
+    first = np.flatnonzero(counts)[:1]
+    if len(first) and counts[first[0]] > NAME and not any(c.isdigit() for c in cert_numbers[first[0]]):
+        counts[first[0]] = 0
+        issues.append(Issue(int(rows[first[0]]), WARNING, "строка заголовков пропущена"))
+
+    short = (counts > 0) & (counts <= NAME)
+    for row, count in zip(rows[short], counts[short]):
+        issues.append(
+            Issue(
+                int(row),
+                ERROR,
+                f"заполнено столбцов: {count}, нужны номер удостоверения, два столбца и ФИО",
+            )
+        )
+
+    valid = counts > NAME
+    rows, cert_numbers, names, categories = (
+        rows[valid], cert_numbers[valid], names[valid], categories[valid]
+    )
+    cert_numbers, numeric = normalize_cert_numbers(cert_numbers)
+    for row, cert_number in zip(rows[~numeric], cert_numbers[~numeric]):
+        issues.append(Issue(int(row), WARNING, f"номер удостоверения '{cert_number}' не число"))
+    duplicated = pd.Series(cert_numbers).duplicated(keep=False).to_numpy()
+    for row, cert_number in zip(rows[duplicated], cert_numbers[duplicated]):
+        issues.append(Issue(int(row), WARNING, f"номер удостоверения {cert_number} повторяется"))
+    if role_required:
+        for row in rows[categories == ""]:
+            issues.append(Issue(int(row), WARNING, "не указана должность"))
+
+    return StudentTable(rows, cert_numbers, names, categories, issues, role_required)
+
+
+def read_delimited(text, delimiter, quoting=csv.QUOTE_NONE):
+    """Returns the cells of delimited text as a DataFrame of strings, a row per line."""
+    lines = text.splitlines()
+    if not lines:
+        return pd.DataFrame()
+    # rows may have different lengths, the widest one sets the columns
+    width = max(line.count(delimiter) for line in lines) + 1
+    return pd.read_csv(
+        io.StringIO(text),
+        sep=delimiter,
+        header=None,
+        names=range(width),
+        dtype=str,
+        keep_default_na=False,
+        skip_blank_lines=False,
+        quoting=quoting,
+        engine="c",
+    )
+
+
+def parse_text(text, role_required=False):
+    """Parses tab separated text, as pasted from a spreadsheet."""
+    return parse_frame(read_delimited(text, "\t"), role_required)
+
+
+def decode(data):
+    for encoding in CSV_ENCODINGS:
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            pass
+    raise ValueError("Не удалось прочитать файл: неизвестная кодировка")
+
+
+def read_csv(data):
+    text = decode(data)
+    try:
+        delimiter = csv.Sniffer().sniff(text[:SNIFF_SIZE], delimiters=CSV_DELIMITERS).delimiter
+    except csv.Error:
+        delimiter = "\t" if "\t" in text[:SNIFF_SIZE] else ","
+    return read_delimited(text, delimiter, quoting=csv.QUOTE_MINIMAL)
+
+
+def read_excel(data):
+    try:
+        return pd.read_excel(io.BytesIO(data), header=None, dtype=str, sheet_name=0)
+    except ImportError:
+        raise ValueError("Для чтения XLSX установите пакет openpyxl")
+    except (ValueError, KeyError, zipfile.BadZipFile) as e:
+        raise ValueError(f"Не удалось прочитать файл XLSX: {e}")
+
+
+def parse_upload(filename, data, role_required=False):
+    """Parses an uploaded CSV or XLSX file, the first sheet of a workbook."""
+    extension = os.path.splitext(filename)[1].lower()
+    if extension in CSV_EXTENSIONS:
+        frame = read_csv(data)
+    elif extension in EXCEL_EXTENSIONS:
+        frame = read_excel(data)
+    else:
+        raise ValueError(f"Неизвестный формат файла '{filename}', ожидается CSV или XLSX")
+    return parse_frame(frame, role_required)
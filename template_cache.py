@@ -0,0 +1,265 @@
+import copy
+import hashlib
+import json
+import os
+import re
+import threading
+from io import BytesIO
+
+from docx.oxml import parse_xml
+from docx.oxml.ns import qn
+from docx.shared import Emu
+from docx.table import Table
+from docxtpl import DocxTemplate
+from jinja2 import Environment, Template, meta
+from lxml import etree
+
+import batch
+import images
+import output_cache
+import picture
+import tracing
+
+FRAGMENT_MEMORY_LIMIT = 64 * 1024 * 1024
+
+
+class CompiledTemplate:
+    """A template file that has been unzipped, cleaned up and compiled once.
+
+    Holds the parsed python-docx document and the jinja2 templates for the
+    body, headers and footers, so that rendering does not touch the disk or
+    re-run DocxTemplate.patch_xml.
+    """
+
+    def __init__(self, path, digest, blob):
+        self.path = path
+        self.digest = digest
+        self.blob = blob
+
+        source = DocxTemplate(BytesIO(blob))
+        source.init_docx()
+        self.source = source
+        self.docx = source.docx
+        self.shrink_backgrounds()
+        body = self._patch(source, source.get_xml())
+        self.body = Template(body)
+        # the values the tables of the body depend on, see render_tables
+        self.body_variables = referenced_variables(body)
+        self.batch_bodies = {}
+        self.parts = {}
+        for uri in (DocxTemplate.HEADER_URI, DocxTemplate.FOOTER_URI):
+            for rel_key, part in source.get_headers_footers(uri):
+                xml = source.get_part_xml(part)
+                encoding = source.get_headers_footers_encoding(xml)
+                self.parts[rel_key] = (uri, self._compile(source, xml), encoding)
+
+    def shrink_backgrounds(self):
+        """Replaces the pictures the body draws behind the text by copies resampled for their print size.
+
+        Every document rendered from the template, and every row copied from
+        its table, then embeds the print-sized picture, see images.prepare_background.
+        """
+        part = self.docx.part
+        for anchor in part.element.iter(qn("wp:anchor")):
+            if anchor.get("behindDoc") != "1":
+                continue
+            extent = anchor.find(qn("wp:extent"))
+            width, height = Emu(int(extent.get("cx"))), Emu(int(extent.get("cy")))
+            for blip in anchor.iter(qn("a:blip")):
+                rId = blip.get(qn("r:embed"))
+                path = images.prepare_embedded_background(part.related_parts[rId].blob, width, height)
+                blip.set(qn("r:embed"), picture.get_or_add_image(part, path)[0])
+                if not part.element.xpath(f'//a:blip[@r:embed="{rId}"]'):
+                    part.drop_rel(rId)
+
+    def batch_body(self, student_keys, per_row=1, separator=None):
+        """Returns the compiled body that renders all students at once, see batch.build_batch_body."""
+        key = (tuple(student_keys), per_row, separator)
+        if key not in self.batch_bodies:
+            self.batch_bodies[key] = CompiledBatchBody(self, *key)
+        return self.batch_bodies[key]
+
+    @staticmethod
+    def _patch(source, xml):
+        # same preparation as DocxTemplate.render_xml_part, minus the rendering
+        xml = source.patch_xml(xml)
+        return re.sub(r"<w:p([ >])", r"\n<w:p\1", xml)
+
+    @classmethod
+    def _compile(cls, source, xml):
+        return Template(cls._patch(source, xml))
+
+
+class CompiledBatchBody:
+    """A batch.BatchBody with its frame and cells compiled.
+
+    The cells of a student are rendered once per template, student values
+    and the shared values the cells refer to, so that a cohort in which one
+    student changed renders only that student's cells again, and values the
+    cells do not show (such as num_students) do not render them all again.
+    """
+
+    def __init__(self, compiled, student_keys, per_row=1, separator=None):
+        self.body = batch.build_batch_body(compiled.docx.element.body, per_row, separator)
+        self.student_keys = student_keys
+        self.frame = compiled._compile(compiled.source, self.body.frame)
+        cells = compiled._patch(compiled.source, self.body.cells)
+        self.cells = Template(cells)
+        self.cell_variables = referenced_variables(cells)
+        self.key = (compiled.digest, student_keys, per_row, separator)
+
+    def render(self, template, context):
+        """Returns the body xml of `template` for all students of `context["students"]`."""
+        part = template.docx._part
+        shared = {key: value for key, value in context.items() if key != "students"}
+        shared_key = context_key(
+            {key: value for key, value in shared.items() if key in self.cell_variables}
+        )
+        students = []
+        for student in context["students"]:
+            values = {key: student[key] for key in self.student_keys}
+            key = (self.key, shared_key, tuple(values.values()))
+            cells = _fragments.get(key)
+            if cells is None:
+                cells = template.render_compiled(self.cells, part, {**shared, **values})
+                _fragments.put(key, cells)
+            students.append(cells)
+        return self.body.join(template.render_compiled(self.frame, part, shared), students)
+
+
+class CachedDocxTemplate(DocxTemplate):
+    """DocxTemplate that renders from a CompiledTemplate.
+
+    Every instance starts from a deep copy of the cached document instead of
+    reading the template from disk.
+    """
+
+    def __init__(self, compiled, body=None):
+        super().__init__(compiled.path)
+        self.compiled = compiled
+        self.body = body or compiled.body
+
+    def init_docx(self, reload=True):
+        if not self.docx or (self.is_rendered and reload):
+            self.docx = copy.deepcopy(self.compiled.docx)
+            self.is_rendered = False
+
+    def render(self, context, jinja_env=None, autoescape=False):
+        with tracing.span("render"):
+            super().render(context, jinja_env, autoescape)
+
+    def render_compiled(self, template, part, context):
+        self.current_rendering_part = part
+        dst_xml = template.render(context)
+        dst_xml = re.sub(r"\n<w:p([ >])", r"<w:p\1", dst_xml)
+        dst_xml = (
+            dst_xml.replace("{_{", "{{")
+            .replace("}_}", "}}")
+            .replace("{_%", "{%")
+            .replace("%_}", "%}")
+        )
+        return self.resolve_listing(dst_xml)
+
+    def build_xml(self, context, jinja_env=None):
+        if jinja_env:
+            return super().build_xml(context, jinja_env)
+        if isinstance(self.body, CompiledBatchBody):
+            return self.body.render(self, context)
+        return self.render_compiled(self.body, self.docx._part, context)
+
+    def build_headers_footers_xml(self, context, uri, jinja_env=None):
+        if jinja_env:
+            yield from super().build_headers_footers_xml(context, uri, jinja_env)
+            return
+        for rel_key, (part_uri, template, encoding) in self.compiled.parts.items():
+            if part_uri != uri:
+                continue
+            part = self.docx._part.rels[rel_key].target_part
+            xml = self.render_compiled(template, part, context)
+            yield rel_key, xml.encode(encoding)
+
+
+_cache = {}
+_lock = threading.Lock()
+
+# rendered fragments of single students, see CompiledBatchBody and render_tables
+_fragments = output_cache.OutputCache(FRAGMENT_MEMORY_LIMIT, directory=None)
+
+
+def referenced_variables(xml):
+    """Returns the names of the context values a prepared template part refers to."""
+    return frozenset(meta.find_undeclared_variables(Environment().parse(xml)))
+
+
+def context_key(context):
+    """Returns a hash of the values of a render context."""
+    encoded = json.dumps(sorted(context.items()), ensure_ascii=False, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def get_compiled(path):
+    """Returns the CompiledTemplate for `path`, recompiling it if the file content changed."""
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    with _lock:
+        entry = _cache.get(path)
+        if entry and entry[0] == signature:
+            return entry[1]
+
+        with open(path, "rb") as f:
+            blob = f.read()
+        digest = hashlib.sha256(blob).hexdigest()
+        if entry and entry[1].digest == digest:
+            compiled = entry[1]
+        else:
+            compiled = CompiledTemplate(path, digest, blob)
+        _cache[path] = (signature, compiled)
+        return compiled
+
+
+def load_template(path):
+    """Returns a fresh DocxTemplate for `path` that renders from the process-wide cache."""
+    return CachedDocxTemplate(get_compiled(path))
+
+
+def load_batch_template(path, student_keys, per_row=1, separator=None):
+    """Returns a DocxTemplate for `path` that renders every student of `context["students"]` at once.
+
+    The students are dicts with the values of `student_keys`.
+    """
+    compiled = get_compiled(path)
+    with _lock:
+        body = compiled.batch_body(student_keys, per_row, separator)
+    return CachedDocxTemplate(compiled, body)
+
+
+def render_tables(path, context):
+    """Returns the tables of `path` rendered with `context`, for copying into a merged document.
+
+    The rendered tables are memoized per template and the context values the
+    template refers to, so a student whose values did not change is not
+    rendered again. The tables belong to no document and may be modified.
+    """
+    compiled = get_compiled(path)
+    used = {key: value for key, value in context.items() if key in compiled.body_variables}
+    key = (compiled.digest, context_key(used))
+    xml = _fragments.get(key)
+    if xml is None:
+        doc = CachedDocxTemplate(compiled)
+        doc.render(context)
+        xml = batch.SEGMENT.join(
+            etree.tostring(table._tbl, encoding="unicode") for table in doc.tables
+        )
+        _fragments.put(key, xml)
+    return [Table(parse_xml(tbl), compiled.docx) for tbl in xml.split(batch.SEGMENT)]
+
+
+def clear_fragments():
+    """Forgets the rendered fragments of the students, keeping the compiled templates."""
+    _fragments.clear()
+
+
+def clear():
+    with _lock:
+        _cache.clear()
+    clear_fragments()
@@ -0,0 +1,55 @@
+import os
+import zipfile
+
+import pytest
+
+import bundle
+
+DOCUMENTS = [
+    ("Приказ о начале.docx", b"beginning " * 1000),
+    ("Свидетельство 1-200.docx", os.urandom(50000)),
+    ("empty.docx", b""),
+    ("protocol.docx", b"protocol"),
+]
+
+
+def read_bundle(archive):
+    with zipfile.ZipFile(archive) as zf:
+        assert zf.testzip() is None
+        return zf.infolist(), {info.filename: zf.read(info) for info in zf.infolist()}
+
+
+@pytest.mark.parametrize("method", sorted(bundle.COMPRESSION_METHODS))
+def test_round_trip(method):
+    archive = bundle.build_bundle(DOCUMENTS, compression=bundle.COMPRESSION_METHODS[method])
+    infos, contents = read_bundle(archive)
+    assert contents == dict(DOCUMENTS)
+    assert {info.compress_type for info in infos} == {bundle.COMPRESSION_METHODS[method]}
+
+
+def test_non_ascii_names_are_flagged_utf8():
+    infos, _ = read_bundle(bundle.build_bundle(DOCUMENTS))
+    # entries are written in the order they finish compressing
+    assert sorted(info.filename for info in infos) == sorted(filename for filename, _ in DOCUMENTS)
+    assert all(info.flag_bits & bundle.UTF8_FLAG for info in infos)
+
+
+def test_empty_bundle():
+    infos, contents = read_bundle(bundle.build_bundle([]))
+    assert infos == []
+    assert contents == {}
+
+
+def test_spilled_to_disk():
+    archive = bundle.build_bundle(DOCUMENTS, spool_threshold=1024)
+    assert archive._rolled
+    _, contents = read_bundle(archive)
+    assert contents == dict(DOCUMENTS)
+
+
+def test_duplicate_names_are_refused():
+    writer = bundle.BundleWriter()
+    writer.add("a.docx", b"a")
+    with pytest.raises(ValueError):
+        writer.add("a.docx", b"b")
+    writer.close()
@@ -0,0 +1,55 @@
+import re
+import zipfile
+from io import BytesIO
+
+import pytest
+from docx.oxml.ns import qn
+
+import documents
+import generation
+import utils
+
+REPLACEMENT_DICT = {
+    "student_company": "ООО «Ромашка»",
+    "student_profession": "19203 «Тракторист»",
+    "hours": "72 часов",
+    "end_date": "20 марта 2024 г.",
+    "end_number": 809,
+    "teacher_name": "А.И. Мамонтов",
+}
+
+STUDENTS = [utils.Student(f"Иванов Иван {index}", str(index), "", "") for index in range(1, 6)]
+
+
+def drawing_ids(doc):
+    buffer = BytesIO()
+    doc.save(buffer)
+    with zipfile.ZipFile(buffer) as archive:
+        return re.findall(r'<wp:docPr id="(\d+)"', archive.read("word/document.xml").decode())
+
+
+@pytest.mark.parametrize("batch", [False, True])
+def test_certificate_drawing_ids_are_unique(batch):
+    ids = drawing_ids(documents.create_certificate(REPLACEMENT_DICT, STUDENTS, batch=batch))
+    assert len(ids) == len(STUDENTS)
+    assert len(set(ids)) == len(ids)
+
+
+def rows_per_table(doc):
+    return [len(tbl.tr_lst) for tbl in doc.element.body.iterchildren(qn("w:tbl"))]
+
+
+@pytest.mark.parametrize(
+    "key, rows",
+    [
+        ("certificate", [3, 2]),
+        # two tractor certificates or confirmation pages fill an A4 page, front and back tables
+        ("tractor_blue", [2, 2, 1, 2, 2, 1]),
+        ("confirmation_page", [2, 2, 1, 2, 2, 1]),
+    ],
+)
+def test_impose_keeps_the_rows_that_fit(key, rows):
+    layout = generation.Layout(per_page=3)
+    spec = generation.SPECS_BY_KEY[key]
+    doc = generation.build_document(spec, REPLACEMENT_DICT, STUDENTS, batch=True, layout=layout)
+    assert rows_per_table(doc) == rows
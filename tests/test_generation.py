@@ -0,0 +1,31 @@
+import dataclasses
+
+import pytest
+
+import generation
+import images
+import utils
+
+STUDENTS = [utils.Student("Иванов Иван", "1", "", "")]
+
+
+def test_fingerprint_follows_the_assets(tmp_path):
+    template = tmp_path / "template.docx"
+    template.write_bytes(b"first")
+    spec = dataclasses.replace(generation.SPECS_BY_KEY["end"], assets=(str(template),))
+    first = generation.fingerprint(spec, {}, STUDENTS)
+    assert generation.fingerprint(spec, {}, STUDENTS) == first
+
+    template.write_bytes(b"edited template")
+    assert generation.fingerprint(spec, {}, STUDENTS) != first
+
+
+@pytest.mark.parametrize(
+    "setting, value",
+    [("BACKGROUND_DPI", 300), ("BACKGROUND_FORMATS", ("png",)), ("JPEG_QUALITY", 75)],
+)
+def test_part_key_follows_the_background_encoding(monkeypatch, setting, value):
+    spec = generation.SPECS_BY_KEY["certificate"]
+    first = generation.part_key(spec, {}, STUDENTS)
+    monkeypatch.setattr(images, setting, value)
+    assert generation.part_key(spec, {}, STUDENTS) != first
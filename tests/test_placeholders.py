@@ -0,0 +1,89 @@
+import copy
+
+import pytest
+from docx import Document
+from docx.oxml.ns import qn
+from docx.shared import Cm, Emu, Inches, Mm, Pt
+
+import placeholders
+
+
+def test_parse_sizes_and_options():
+    (slot,) = placeholders.parse(
+        "до [[image prof_educ_logo mode=float x=12cm y=20mm width=1.5in height=100pt]] после"
+    )
+    assert slot.text == "[[image prof_educ_logo mode=float x=12cm y=20mm width=1.5in height=100pt]]"
+    assert slot.name == "prof_educ_logo"
+    assert slot.mode == "float"
+    assert (slot.x, slot.y) == (Cm(12), Mm(20))
+    assert (slot.width, slot.height) == (Inches(1.5), Pt(100))
+
+
+def test_parse_defaults_and_several_directives():
+    first, second = placeholders.parse("[[image a]][[image b width=914400]]")
+    assert (first.name, first.mode, first.width, first.height, first.x, first.y) == (
+        "a", "inline", None, None, 0, 0
+    )
+    assert (second.name, second.width) == ("b", Emu(914400))
+
+
+def test_parse_without_directive():
+    assert placeholders.parse("[[imag a]] текст") == []
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "[[image a size=1in]]",
+        "[[image a mode=behind]]",
+        "[[image a width=1km]]",
+    ],
+)
+def test_parse_refuses_invalid_directives(text):
+    with pytest.raises(ValueError):
+        placeholders.parse(text)
+
+
+def directive_document():
+    doc = Document()
+    table = doc.add_table(rows=1, cols=2)
+    table.cell(0, 0).text = "без картинки"
+    table.cell(0, 1).paragraphs[0].add_run("логотип [[image prof_educ_logo width=1in]]")
+    return doc, table
+
+
+def test_slot_index_finds_the_runs_of_a_copy():
+    doc, table = directive_document()
+    tr = table._tbl.tr_lst[0]
+    index = placeholders.SlotIndex(tr)
+    clone = copy.deepcopy(tr)
+    ((r, slots),) = index.runs(clone)
+    assert any(ancestor is clone for ancestor in r.iterancestors())
+    assert placeholders.run_text(r) == "логотип [[image prof_educ_logo width=1in]]"
+    assert slots[0].name == "prof_educ_logo"
+
+
+def test_slot_index_rescans_a_different_layout():
+    doc, table = directive_document()
+    index = placeholders.SlotIndex(table._tbl.tr_lst[0])
+    other = Document().add_table(rows=1, cols=1)
+    other.cell(0, 0).text = "[[image prof_educ_logo]]"
+    ((r, slots),) = index.runs(other._tbl.tr_lst[0])
+    assert placeholders.run_text(r) == "[[image prof_educ_logo]]"
+
+
+def test_fill_runs_replaces_the_directive_by_the_picture():
+    doc, table = directive_document()
+    tr = table._tbl.tr_lst[0]
+    placeholders.fill_runs(placeholders.SlotIndex(tr).runs(tr), table)
+    assert table.cell(0, 1).text == "логотип "
+    (inline,) = tr.iter(qn("wp:inline"))
+    assert int(inline.find(qn("wp:extent")).get("cx")) == Inches(1)
+    assert not list(tr.iter(qn("wp:anchor")))
+
+
+def test_fill_runs_unknown_image():
+    doc = Document()
+    p = doc.add_paragraph("[[image missing]]")
+    with pytest.raises(ValueError):
+        placeholders.fill_runs(placeholders.SlotIndex(p._p).runs(p._p), doc)
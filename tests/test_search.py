@@ -0,0 +1,73 @@
+import catalog
+import search
+import utils
+
+NAMES = {
+    "Тракторист": [19203],
+    "Тракторист-машинист сельскохозяйственного производства": [19205],
+    "Слесарь-ремонтник": [18559],
+    "Электрогазосварщик": [19756],
+    "Водитель погрузчика": [11453],
+}
+
+
+def professions():
+    return {
+        name: utils.Profession(
+            name=name, code=codes, hours_str="", formatted_profession=name, role_required=False
+        )
+        for name, codes in NAMES.items()
+    }
+
+
+def index():
+    return search.ProfessionIndex(professions())
+
+
+def test_code_match_and_prefix():
+    assert index().search("19203") == ["Тракторист"]
+    assert index().search("192") == ["Тракторист", "Тракторист-машинист сельскохозяйственного производства"]
+
+
+def test_stem_match():
+    assert index().search("трактористы")[:2] == [
+        "Тракторист",
+        "Тракторист-машинист сельскохозяйственного производства",
+    ]
+    assert index().search("погрузчики") == ["Водитель погрузчика"]
+
+
+def test_word_prefix_and_case():
+    assert index().search("СЛЕС") == ["Слесарь-ремонтник"]
+
+
+def test_typo():
+    assert index().search("электрогазосваршик") == ["Электрогазосварщик"]
+
+
+def test_every_word_has_to_match():
+    assert index().search("тракторист машинист") == ["Тракторист-машинист сельскохозяйственного производства"]
+    assert index().search("тракторист сварщик") == []
+
+
+def test_empty_query_and_limit():
+    assert index().search("") == list(NAMES)
+    assert index().search("", limit=2) == list(NAMES)[:2]
+    assert len(index().search("тракторист", limit=1)) == 1
+
+
+def test_index_is_rebuilt_for_a_new_catalog():
+    catalog_dict = professions()
+    first = search.get_index(catalog_dict)
+    assert search.get_index(catalog_dict) is first
+    assert search.get_index(dict(catalog_dict)) is not first
+
+
+def test_catalog_fuzzy_matches_start_like_the_query():
+    catalog_index = search.ProfessionIndex(catalog.load_professions())
+    # «Моторист» shares only the ending with "тракторист"
+    assert catalog_index.search("тракторист") == [
+        "Слесарь по ремонту дорожно-строительных машин и тракторов"
+    ]
+    assert catalog_index.search("электрогазосваршик")[0] == "Электрогазосварщик"
+    assert "Водитель погрузчика" in catalog_index.search("водитль погрузчека")
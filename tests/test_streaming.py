@@ -0,0 +1,118 @@
+import copy
+import zipfile
+from io import BytesIO
+
+import pytest
+from docx import Document
+from docx.table import _Cell
+
+import documents
+import streaming
+import template_cache
+import utils
+
+REPLACEMENT_DICT = {
+    "beginning_date": "01 марта 2024 г.",
+    "beginning_number": 808,
+    "end_date": "20 марта 2024 г.",
+    "end_number": 809,
+    "student_company": "ООО «Ромашка» & <Ко>",
+    "teacher_name": "А.И. Мамонтов",
+    "num_students": 3,
+    "hours": "72 часов",
+    "student_profession": "19203 «Тракторист»",
+}
+
+STUDENTS = [
+    utils.Student("Иванов Иван Иванович", "12", "слесарь", "B, C"),
+    utils.Student("Петров  Петр\tПетрович ", "13", "", ""),
+    utils.Student('Сидоров "Сидор" <&>', "14", "токарь", "D"),
+]
+
+TABLE_DOCUMENTS = [
+    (documents.create_beginning_document, "templates/Приказ о начале.docx", documents.BEGINNING_COLUMNS),
+    (documents.create_end_doc, "templates/Приказ о выпуске.docx", documents.END_COLUMNS),
+    (documents.create_protocol_doc, "templates/Протокол.docx", documents.PROTOCOL_COLUMNS),
+    (
+        documents.create_labour_protection_protocol,
+        "templates/protocol_milana.docx",
+        documents.LABOUR_PROTECTION_COLUMNS,
+    ),
+]
+
+
+def python_docx_document(template_path, columns, students):
+    """Fills the table as python-docx would: a copy of the data row per student, cell by cell."""
+    doc = template_cache.load_template(template_path)
+    doc.render(REPLACEMENT_DICT)
+    table = doc.tables[0]
+    data_row = table._tbl.tr_lst[-1]
+    table._tbl.remove(data_row)
+    values = streaming.row_values(columns, REPLACEMENT_DICT)
+    for index, student in enumerate(students):
+        tr = copy.deepcopy(data_row)
+        table._tbl.append(tr)
+        for tc, text in zip(tr.tc_lst, values(index, student)):
+            _Cell(tc, table).text = text
+    return doc
+
+
+def saved(doc):
+    buffer = BytesIO()
+    doc.save(buffer)
+    buffer.seek(0)
+    return buffer
+
+
+def cell_texts(doc):
+    return [[cell.text for cell in row.cells] for row in doc.tables[0].rows]
+
+
+@pytest.mark.parametrize("build, template_path, columns", TABLE_DOCUMENTS)
+def test_streamed_table_matches_python_docx(build, template_path, columns):
+    streamed = Document(saved(build(REPLACEMENT_DICT, STUDENTS)))
+    expected = Document(saved(python_docx_document(template_path, columns, STUDENTS)))
+
+    template_rows = len(Document(template_path).tables[0].rows)
+    assert len(streamed.tables[0].rows) == template_rows - 1 + len(STUDENTS)
+    assert cell_texts(streamed) == cell_texts(expected)
+    assert [p.text for p in streamed.paragraphs] == [p.text for p in expected.paragraphs]
+
+
+def test_streamed_document_is_a_valid_package():
+    buffer = saved(documents.create_beginning_document(REPLACEMENT_DICT, STUDENTS))
+    with zipfile.ZipFile(buffer) as archive:
+        assert archive.testzip() is None
+        assert "word/document.xml" in archive.namelist()
+
+
+def test_empty_group_keeps_the_header_rows():
+    doc = Document(saved(documents.create_end_doc(REPLACEMENT_DICT, [])))
+    assert len(doc.tables[0].rows) == len(Document("templates/Приказ о выпуске.docx").tables[0].rows) - 1
+
+
+def test_more_columns_than_cells_are_refused():
+    doc = Document()
+    table = doc.add_table(rows=1, cols=2)
+    with pytest.raises(ValueError):
+        streaming.fill_table(doc, table, ("index", "student.name", "student.role"), STUDENTS, {})
+
+
+def test_template_row_leaves_missing_cells_empty():
+    doc = Document()
+    table = doc.add_table(rows=1, cols=3)
+    for cell in table.rows[0].cells:
+        cell.text = "old"
+    template_row = streaming.TemplateRow(table._tbl.tr_lst[0])
+    assert template_row.cell_count == 3
+
+    filled = streaming.fill_table(doc, table, ("index", "student.name"), STUDENTS[:1], {})
+    result = Document(saved(filled))
+    assert cell_texts(result) == [["1", "Иванов Иван Иванович", ""]]
+
+
+def test_run_content():
+    assert streaming.run_content("a\tb\nc") == "<w:t>a</w:t><w:tab/><w:t>b</w:t><w:br/><w:t>c</w:t>"
+    assert streaming.run_content(" x<&> ") == '<w:t xml:space="preserve"> x&lt;&amp;&gt; </w:t>'
+    assert streaming.run_content("a\x01b") == "<w:t>ab</w:t>"
+    assert streaming.run_content("") == ""
@@ -0,0 +1,76 @@
+import pytest
+
+import student_import
+import utils
+
+TEXT = (
+    "12\tx\t\ty\tИванов Иван Иванович\tB, C\n"
+    "\n"
+    "13.0\tx\ty\tПетров Петр Петрович\n"
+    "14\tx\tСидоров\n"
+    "A-15\tx\ty\tКузнецов Кирилл\tD\n"
+    "12\tx\ty\tСмирнов Сергей\n"
+)
+
+
+def messages(table, level):
+    return [(issue.row, issue.message) for issue in table.issues if issue.level == level]
+
+
+def test_parse_text():
+    table = student_import.parse_text(TEXT)
+    assert list(table.rows) == [1, 3, 5, 6]
+    assert list(table.cert_numbers) == ["12", "13", "A-15", "12"]
+    assert list(table.names) == ["Иванов Иван Иванович", "Петров Петр Петрович", "Кузнецов Кирилл", "Смирнов Сергей"]
+    assert list(table.categories) == ["B, C", "", "D", ""]
+
+    assert [row for row, _ in messages(table, student_import.ERROR)] == [4]
+    warnings = messages(table, student_import.WARNING)
+    assert (5, "номер удостоверения 'A-15' не число") in warnings
+    assert {row for row, message in warnings if "повторяется" in message} == {1, 6}
+
+
+def test_students_take_roles_or_machine_categories():
+    text = "1\tx\ty\tИванов Иван\tслесарь\n"
+    assert student_import.parse_text(text).students() == [
+        utils.Student(name="Иванов Иван", cert_number="1", role="", machine_category="слесарь")
+    ]
+    assert student_import.parse_text(text, role_required=True).students() == [
+        utils.Student(name="Иванов Иван", cert_number="1", role="слесарь", machine_category="")
+    ]
+
+
+def test_missing_role_is_reported():
+    table = student_import.parse_text("1\tx\ty\tИванов Иван\n", role_required=True)
+    assert messages(table, student_import.WARNING) == [(1, "не указана должность")]
+
+
+def test_header_row_is_skipped():
+    table = student_import.parse_text("Номер\tГруппа\tДата\tФИО\n1\tx\ty\tИванов Иван\n")
+    assert list(table.names) == ["Иванов Иван"]
+    assert messages(table, student_import.WARNING) == [(1, "строка заголовков пропущена")]
+
+
+def test_empty_text():
+    table = student_import.parse_text("")
+    assert len(table) == 0
+    assert table.issues == []
+    assert table.students() == []
+
+
+def test_report_orders_by_row():
+    report = student_import.parse_text(TEXT).report()
+    assert list(report.columns) == ["Строка", "Уровень", "Сообщение"]
+    assert list(report["Строка"]) == sorted(report["Строка"])
+
+
+def test_parse_upload_csv_in_cp1251():
+    data = '12;x;y;"Иванов; Иван";B\r\n13;x;y;Петров Петр\r\n'.encode("cp1251")
+    table = student_import.parse_upload("Группа.csv", data)
+    assert list(table.names) == ["Иванов; Иван", "Петров Петр"]
+    assert list(table.categories) == ["B", ""]
+
+
+def test_parse_upload_unknown_format():
+    with pytest.raises(ValueError):
+        student_import.parse_upload("group.pdf", b"%PDF")
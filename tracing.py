@@ -0,0 +1,193 @@
+"""Lightweight spans for finding where document generation spends its time.
+
+    with tracing.record() as trace:
+        with tracing.span("build", document="certificate"):
+            ...
+    trace.summary()
+
+When no trace is being recorded, span() returns a shared no-op object, so
+instrumented code pays only for a function call and a context variable
+lookup. The trace being recorded belongs to the current context (thread),
+so the sessions of the Streamlit server profile independently.
+Spans inherit the attributes (document, student, ...) of the span they are
+nested in. Worker processes record their own trace and send the events
+back, see generation.build_serialized.
+"""
+import contextvars
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+class NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+_trace = contextvars.ContextVar("trace", default=None)
+_local = threading.local()
+
+# number of recorded traces measuring memory; tracemalloc runs while there is one
+_memory_traces = 0
+_started_tracemalloc = False
+_memory_lock = threading.Lock()
+
+
+class Span:
+    def __init__(self, trace, name, attrs):
+        self.trace = trace
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        stack = getattr(_local, "stack", None)
+        if stack is None:
+            stack = _local.stack = []
+        if stack:
+            self.attrs = {**stack[-1].attrs, **self.attrs}
+        stack.append(self)
+        self.memory = tracemalloc.get_traced_memory()[0] if self.trace.memory else 0
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        end = time.perf_counter()
+        memory_delta = (
+            tracemalloc.get_traced_memory()[0] - self.memory if self.trace.memory else None
+        )
+        _local.stack.pop()
+        self.trace.add(
+            {
+                "name": self.name,
+                "start": self.start,
+                "duration": end - self.start,
+                "memory_delta": memory_delta,
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+                "depth": len(_local.stack),
+                **self.attrs,
+            }
+        )
+        return False
+
+
+class Trace:
+    def __init__(self, memory=True, previous=None):
+        self.memory = memory
+        # the trace of the context before this one was started, restored by stop
+        self.previous = previous
+        self.events = []
+        self.origin = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add(self, event):
+        with self._lock:
+            self.events.append(event)
+
+    def extend(self, events):
+        with self._lock:
+            self.events.extend(events)
+
+    def summary(self):
+        """Returns {document: {span name: seconds}}. Nested spans are also part of their parent's time."""
+        totals = {}
+        for event in self.events:
+            document = event.get("document", "-")
+            phases = totals.setdefault(document, {})
+            phases[event["name"]] = phases.get(event["name"], 0.0) + event["duration"]
+        return totals
+
+    def to_json(self):
+        return json.dumps(
+            [
+                {**event, "start": event["start"] - self.origin}
+                for event in self.events
+            ],
+            ensure_ascii=False,
+            indent=1,
+        )
+
+    def to_chrome_trace(self):
+        """Returns the trace in the Chrome trace event format (chrome://tracing, Perfetto)."""
+        reserved = ("name", "start", "duration", "pid", "tid", "depth")
+        events = [
+            {
+                "name": event["name"],
+                "cat": event.get("document", "-"),
+                "ph": "X",
+                "ts": (event["start"] - self.origin) * 1e6,
+                "dur": event["duration"] * 1e6,
+                "pid": event["pid"],
+                "tid": event["tid"],
+                "args": {k: v for k, v in event.items() if k not in reserved},
+            }
+            for event in self.events
+        ]
+        return json.dumps({"traceEvents": events}, ensure_ascii=False)
+
+
+def is_enabled():
+    return _trace.get() is not None
+
+
+def span(name, **attrs):
+    """Context manager timing `name`; attrs such as document=, student=, phase= are stored with it."""
+    trace = _trace.get()
+    if trace is None:
+        return NULL_SPAN
+    return Span(trace, name, attrs)
+
+
+def start(memory=True):
+    """Starts recording a trace in the current context."""
+    global _memory_traces, _started_tracemalloc
+    trace = Trace(memory=memory, previous=_trace.get())
+    if memory:
+        with _memory_lock:
+            if _memory_traces == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                _started_tracemalloc = True
+            _memory_traces += 1
+    _trace.set(trace)
+    return trace
+
+
+def stop():
+    """Stops the trace of the current context and returns it, None if there is none."""
+    global _memory_traces, _started_tracemalloc
+    trace = _trace.get()
+    if trace is None:
+        return None
+    _trace.set(trace.previous)
+    if trace.memory:
+        with _memory_lock:
+            _memory_traces -= 1
+            # tracemalloc started by someone else is left running
+            if _memory_traces == 0 and _started_tracemalloc:
+                tracemalloc.stop()
+                _started_tracemalloc = False
+    return trace
+
+
+def merge(events):
+    """Adds events recorded in another process to the current trace."""
+    trace = _trace.get()
+    if trace is not None:
+        trace.extend(events)
+
+
+@contextmanager
+def record(memory=True):
+    trace = start(memory=memory)
+    try:
+        yield trace
+    finally:
+        stop()
@@ -1,13 +1,16 @@
 # Date formatting
 import streamlit as st
-import pandas as pd
 import pickle
 import copy
-import docx
 from docx.shared import Inches, Pt
 from docx.oxml import OxmlElement
 from dataclasses import dataclass
 import profession_parsing
+import tracing
+import catalog
+import search
+import preview
+import student_import
 
 @dataclass
 class Student:
@@ -16,21 +19,6 @@ class Student:
     role: str
     machine_category: str
 
-def parse_machine_cat_or_role(chosen_profession, value):
-    if value == '' or value == None: 
-        return ('', '')
-    if chosen_profession.role_required: 
-        return ("", value)
-    return (value, "")
-
-def get_cert_number(cert_number): 
-    try: 
-        return str(int(float(cert_number)))
-    except Exception as e: 
-        print(e)
-        return cert_number
-
-
 @dataclass
 class Profession:
     name: str
@@ -73,17 +61,20 @@ def format_hours_string(hours):
   else:
     return f"{hours} часов"
 
-def display_docx_content(doc):
-    """Reads a .docx file and displays paragraphs and tables in order."""
-    for element in doc.element.body:
-        if isinstance(element, docx.oxml.text.paragraph.CT_P):
-            st.write(element.text)
-        elif isinstance(element, docx.oxml.table.CT_Tbl):
-            # Display table (you'll need to customize formatting)
-            table = docx.table.Table(element, doc)  # Create Table object
-            data = [[cell.text for cell in row.cells] for row in table.rows]
-            df = pd.DataFrame(data)
-            st.table(df)
+def display_preview(data, key):
+    """Shows one page of the HTML preview of the generated .docx `data`."""
+    with tracing.span("display"):
+        document_preview = preview.get_preview(data)
+        page = 0
+        if document_preview.page_count > 1:
+            page = st.number_input(
+                f"Страница предпросмотра (всего {document_preview.page_count})",
+                min_value=1,
+                max_value=document_preview.page_count,
+                value=1,
+                key=f"preview_page_{key}",
+            ) - 1
+        st.markdown(document_preview.page(page), unsafe_allow_html=True)
 
 
 def save_data(dict, filename):
@@ -251,9 +242,7 @@ def choose_teacher(all_teachers):
     if add_new:
         new_teacher = st.text_input("Введите инициалы и фамилию нового преподавателя:")
         if st.button("Добавить преподавателя"):
-            if new_teacher and new_teacher not in all_teachers:
-                all_teachers.append(new_teacher)
-                save_data(all_teachers, "data/teachers.pickle")
+            if new_teacher and catalog.add_teacher(new_teacher):
                 st.success(f"Преподаватель '{new_teacher}' добавлен!")
                 # Store new_teacher in session state
                 st.session_state.new_teacher = new_teacher
@@ -269,15 +258,60 @@ def choose_teacher(all_teachers):
         return None
 
 
+def import_students(source, role_required):
+    """Parses the text or the (filename, data) of an upload, reusing the last result of the session.
+
+    Every widget interaction reruns the script; the list is only parsed again when it changed.
+    """
+    key = (source, role_required)
+    cached = st.session_state.get("imported_students")
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    if isinstance(source, tuple):
+        table = student_import.parse_upload(*source, role_required)
+    else:
+        table = student_import.parse_text(source, role_required)
+    st.session_state.imported_students = (key, table)
+    return table
+
+
+def choose_students(profession):
+    """Reads the student list from the text area or an uploaded file and shows the problems found in it."""
+    role_required = bool(profession and profession.role_required)
+    text = st.text_area("Введите имена студентов, по одному на строку")
+    uploaded = st.file_uploader(
+        "Или загрузите список из файла CSV или XLSX", type=["csv", "txt", "tsv", "xlsx", "xlsm"]
+    )
+    try:
+        source = (uploaded.name, uploaded.getvalue()) if uploaded is not None else text
+        table = import_students(source, role_required)
+    except ValueError as e:
+        st.error(str(e))
+        return student_import.StudentTable.empty()
+
+    if table.issues:
+        with st.expander(
+            f"Проверка списка: ошибок {len(table.errors)}, предупреждений {len(table.warnings)}",
+            expanded=bool(table.errors),
+        ):
+            st.dataframe(table.report(), hide_index=True)
+    return table
+
+
 # Now it should be a dictionary from name to info 
 def choose_profession(all_professions):
     """Handles profession selection and adding new professions."""
 
+    query = st.text_input(
+        "Поиск программы обучения",
+        placeholder="Название, часть названия или код программы",
+    )
+    matches = search.get_index(all_professions).search(query)
     selected_item = st.selectbox(
         "Выберите профессию/программу обучение из следующих опций:",
-        all_professions,
+        matches,
         index=None,
-        placeholder="Начинайте вводить название программы",
+        placeholder="Начинайте вводить название программы" if matches else "Ничего не найдено",
     )
 
     if selected_item:
@@ -303,8 +337,7 @@ def choose_profession(all_professions):
                 st.success(f"Программа '{profession_name}' добавлена c кодом {code_list} и часами {hrs}!")
                 
                 new_profession = Profession(name=profession_name, code=code_list, hours_str=hrs, formatted_profession=profession_parsing.format_profession_string(profession_name, code_list), role_required=role_required)
-                all_professions[profession_name] = new_profession
-                save_data(all_professions, filename="data/professions.pickle")
+                catalog.save_profession(new_profession)
                 st.session_state.new_profession = new_profession
             else:
                 st.warning("Введите название программы")